@@ -0,0 +1,30 @@
+"""Analytics API endpoints (read from the job rollups)"""
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+
+from ..database import get_async_db
+from ..services.analytics import job_report
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.get("/jobs", response_model=dict)
+async def get_job_analytics(
+    days: Optional[int] = Query(None, ge=1, le=3650, description="Last N UTC days including today; all time if omitted"),
+    top: int = Query(20, ge=1, le=100, description="Number of top users"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Job totals with latency percentiles, preset usage and top users"""
+    try:
+        return await job_report(db, days=days, top=top)
+    except Exception as e:
+        logger.error(f"Error building job analytics: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error building job analytics: {str(e)}"
+        )
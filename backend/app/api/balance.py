@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from .. import models, schemas
-from ..database import get_db
-from ..services.balance import check_balance, deduct_balance, refund_balance, add_balance
+from ..database import get_db, get_async_db
+from ..services.balance import check_balance, deduct_balance, refund_balance, add_balance, get_balance_snapshot
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -13,16 +14,18 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 @router.get("/{user_id}", response_model=schemas.BalanceResponse)
-def get_balance(user_id: int, db: Session = Depends(get_db)):
-    """Get user balance"""
+async def get_balance(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Get user balance (served from the Redis snapshot when present)"""
     try:
-        user = db.query(models.User).filter(models.User.user_id == user_id).first()
-        if not user:
+        balance = await get_balance_snapshot(user_id, db)
+        if balance is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
-        return {"user_id": user.user_id, "balance": user.balance}
+        return {"user_id": user_id, "balance": balance}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting balance: {e}")
         raise HTTPException(
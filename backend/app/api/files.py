@@ -0,0 +1,36 @@
+"""File download endpoints"""
+
+from fastapi import APIRouter, HTTPException, Request, status
+import logging
+
+from ..services.file_server import file_server
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.get("/immutable/{digest}/{file_path:path}")
+def download_immutable_file(digest: str, file_path: str, request: Request):
+    """Download a file by content-addressed URL; cacheable forever"""
+    path, st = file_server.resolve(file_path)
+    if file_server.content_digest(path, st) != digest:
+        # The file changed since the URL was issued
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    return file_server.serve(request, path, st, immutable=True)
+
+
+@router.get("/{file_path:path}")
+def download_file(file_path: str, request: Request):
+    """Download file from server (supports Range, If-None-Match and If-Modified-Since)"""
+    try:
+        path, st = file_server.resolve(file_path)
+        return file_server.serve(request, path, st)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Error downloading file: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error downloading file: {str(e)}"
+        )
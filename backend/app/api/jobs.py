@@ -1,14 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile, File
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from .. import models, schemas
-from ..database import get_db
+from ..database import get_db, get_async_db
 from ..config import settings
 from ..services.balance import check_balance, deduct_balance, refund_balance
+from ..services.write_queue import get_write_queue
+from ..services.preset_catalog import preset_catalog
+from ..utils.uploads import save_upload
+from ..services.job_events import (
+    TERMINAL_STATUSES, job_response, job_response_async, load_job_state, publish_job_event, record_job_state, store_job_state, subscribe_job
+)
+from ..utils.http_cache import etag_matches, strong_etag
+from ..utils.pagination import keyset_before
+from ..services.archive import get_with_archive, newest_first
+import anyio
+import json
+from contextlib import AsyncExitStack
 import logging
 import os
 from pathlib import Path
-import uuid
 from datetime import datetime
 import sys
 import os
@@ -29,14 +44,15 @@ async def create_job(
     prompt: str,
     image_file: UploadFile = File(...),
     second_image_file: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db)
+    preset_key: Optional[str] = Query(None, max_length=50, description="Preset id, 'custom' or 'fitting'"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new job"""
     try:
         logger.info(f"Creating job for user_id: {user_id}, prompt length: {len(prompt) if prompt else 0}")
 
         # Check if user exists
-        user = db.query(models.User).filter(models.User.user_id == user_id).first()
+        user = await db.scalar(select(models.User).where(models.User.user_id == user_id))
         if not user:
             # For testing purposes, create a default user if not found
             logger.warning(f"User with user_id {user_id} not found in database, creating default user for testing")
@@ -48,12 +64,12 @@ async def create_job(
             )
             db.add(user)
             try:
-                db.commit()
-                db.refresh(user)
+                await db.commit()
+                await db.refresh(user)
                 logger.info(f"Test user created with user_id: {user.user_id}")
             except Exception as db_error:
                 logger.error(f"Database error when creating test user: {db_error}")
-                db.rollback()
+                await db.rollback()
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail=f"Error creating test user: {str(db_error)}"
@@ -77,30 +93,27 @@ async def create_job(
         input_dir = Path(settings.COMFY_INPUT_DIR)
         input_dir.mkdir(parents=True, exist_ok=True)
 
-        # Validate and save first image
+        # Validate and stream first image to disk (hashed and sniffed while writing)
         if not image_file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="Uploaded file must be an image")
 
-        file_ext = image_file.filename.split('.')[-1] if image_file.filename else 'jpg'
-        image_filename = f"input_{uuid.uuid4().hex}.{file_ext}"
-        image_path = input_dir / image_filename
-
-        with open(image_path, "wb") as buffer:
-            buffer.write(await image_file.read())
+        saved_image = await save_upload(image_file, input_dir)
+        image_path = saved_image.path
+        logger.info(f"Image saved: {image_path.name} ({saved_image.size} bytes, sha256 {saved_image.sha256[:12]})")
 
-        # Validate and save second image if provided
+        # Validate and stream second image if provided
         second_image_path = None
         if second_image_file:
             if not second_image_file.content_type.startswith('image/'):
                 raise HTTPException(status_code=400, detail="Second uploaded file must be an image")
 
-            s_file_ext = second_image_file.filename.split('.')[-1] if second_image_file.filename else 'jpg'
-            s_image_filename = f"input_{uuid.uuid4().hex}.{s_file_ext}"
-            s_image_path = input_dir / s_image_filename
+            saved_second = await save_upload(second_image_file, input_dir)
+            second_image_path = str(saved_second.path)
+            logger.info(f"Second image saved: {saved_second.path.name} ({saved_second.size} bytes)")
 
-            with open(s_image_path, "wb") as buffer:
-                buffer.write(await second_image_file.read())
-            second_image_path = str(s_image_path)
+        # Preset identity as sent by the bot; older clients get the prompt matched
+        matcher = await db.run_sync(preset_catalog.get_matcher)
+        identity = matcher.identify(prompt, preset_key)
 
         # Create job in database
         logger.info(f"Creating job record in database for user {user_id}")
@@ -109,17 +122,20 @@ async def create_job(
             image_path=str(image_path),
             second_image_path=second_image_path,
             prompt=prompt,
+            preset_key=identity.preset_key,
+            workflow_type=identity.workflow_type,
             status=schemas.JobStatus.queued
         )
 
         db.add(new_job)
         try:
-            db.commit()
-            db.refresh(new_job)
+            await db.commit()
+            await db.refresh(new_job)
             logger.info(f"Job record created successfully with ID: {new_job.id}")
+            await publish_job_event(new_job)
         except Exception as db_error:
             logger.error(f"Database error when creating job: {db_error}")
-            db.rollback()
+            await db.rollback()
             raise
 
         # Skip balance deduction during testing
@@ -151,7 +167,7 @@ async def create_job(
         # Re-raise HTTP exceptions as-is
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error creating job: {e}")
         logger.exception("Full traceback:")  # Log the full traceback for debugging
         raise HTTPException(
@@ -159,17 +175,31 @@ async def create_job(
             detail=f"Internal server error: {str(e)}"
         )
 
+async def _current_job_state(job_id: int, db: AsyncSession) -> schemas.JobResponse:
+    """Job state from the Redis hash; the DB is read (and the hash primed) only on a miss"""
+    state = await load_job_state(job_id)
+    if state is not None:
+        return state
+
+    job = await get_with_archive(db, models.Job, models.JobArchive, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+    state = await job_response_async(job)
+    await store_job_state(state)
+    return state
+
 @router.get("/{job_id}", response_model=schemas.JobResponse)
-def get_job(job_id: int, db: Session = Depends(get_db)):
-    """Get job status"""
+async def get_job(job_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Get job status (served from Redis, supports If-None-Match)"""
     try:
-        job = db.query(models.Job).filter(models.Job.id == job_id).first()
-        if not job:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Job not found"
-            )
-        return job
+        body = (await _current_job_state(job_id, db)).model_dump_json().encode()
+        headers = {"ETag": strong_etag(body), "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         logger.error(f"Error getting job: {e}")
         raise HTTPException(
@@ -177,6 +207,89 @@ def get_job(job_id: int, db: Session = Depends(get_db)):
             detail=f"Error getting job: {str(e)}"
         )
 
+async def _load_job_state(job_id: int, db: AsyncSession) -> dict:
+    state = json.loads((await _current_job_state(job_id, db)).model_dump_json())
+    # Nothing else is read from the DB while the client waits
+    await db.close()
+    return state
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Stream status transitions as server-sent events.
+
+    The current state is sent first; the stream ends after a terminal status
+    (completed, failed, cancelled) or JOB_EVENTS_MAX_DURATION. Comment lines
+    are sent every JOB_EVENTS_HEARTBEAT seconds to keep proxies from closing
+    the idle connection.
+    """
+    # Subscribe before reading the state so no transition falls in between
+    subscription_scope = AsyncExitStack()
+    subscription = await subscription_scope.enter_async_context(subscribe_job(job_id))
+    try:
+        state = await _load_job_state(job_id, db)
+    except BaseException:
+        await subscription_scope.aclose()
+        raise
+
+    async def stream(state: dict):
+        yield _sse("status", state)
+        if subscription is None:
+            # No Redis: let the client reconnect for a fresh state
+            yield "retry: 5000\n\n"
+            return
+
+        deadline = anyio.current_time() + settings.JOB_EVENTS_MAX_DURATION
+        while state["status"] not in TERMINAL_STATUSES and anyio.current_time() < deadline:
+            if await request.is_disconnected():
+                return
+            event = await subscription.next_event(settings.JOB_EVENTS_HEARTBEAT)
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            state = event
+            yield _sse("status", state)
+
+    return StreamingResponse(
+        stream(state),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Runs after the stream ends, also when the client went away
+        background=BackgroundTask(subscription_scope.aclose)
+    )
+
+@router.get("/{job_id}/wait", response_model=schemas.JobResponse)
+async def wait_for_job(
+    job_id: int,
+    since: Optional[schemas.JobStatus] = None,
+    timeout: int = 30,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Long-poll: return once the job's status differs from `since`.
+
+    Without `since` the current state is returned at once. Otherwise the
+    request waits for the next transition, up to `timeout` seconds (capped
+    at JOB_WAIT_MAX_TIMEOUT), and then returns whatever the state is.
+    """
+    timeout = max(0, min(timeout, settings.JOB_WAIT_MAX_TIMEOUT))
+    async with subscribe_job(job_id) as subscription:
+        state = await _load_job_state(job_id, db)
+        if since is None or state["status"] != since.value or subscription is None:
+            return state
+
+        deadline = anyio.current_time() + timeout
+        while state["status"] == since.value:
+            remaining = deadline - anyio.current_time()
+            if remaining <= 0:
+                break
+            event = await subscription.next_event(remaining)
+            if event is None:
+                break
+            state = event
+        return state
+
 @router.get("/", response_model=List[schemas.JobResponse])
 def get_jobs(
     status: Optional[str] = None,
@@ -204,13 +317,26 @@ def get_user_jobs(
     user_id: int,
     skip: int = 0,
     limit: int = 10,
+    cursor: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """Get user's jobs with pagination"""
+    """Get user's jobs, newest first, archived jobs included.
+
+    Pass the id of the last job of the previous page as `cursor` for keyset
+    pagination; `skip` is kept for older clients.
+    """
     try:
-        jobs = db.query(models.Job).filter(models.Job.user_id == user_id)
-        jobs = jobs.offset(skip).limit(limit).order_by(models.Job.created_at.desc()).all()
-        return jobs
+        limit = min(limit, settings.HISTORY_MAX_PAGE_SIZE)
+        skip = skip if cursor is None else 0
+        tables = (models.Job, models.JobArchive)
+        pages = []
+        for table in tables:
+            jobs = db.query(table).filter(table.user_id == user_id)
+            if cursor is not None:
+                jobs = jobs.filter(keyset_before(table, cursor, tables))
+            jobs = jobs.order_by(table.created_at.desc(), table.id.desc())
+            pages.append(jobs.limit(skip + limit).all())
+        return newest_first(pages, skip + limit)[skip:]
     except Exception as e:
         logger.error(f"Error getting user jobs: {e}")
         raise HTTPException(
@@ -218,6 +344,75 @@ def get_user_jobs(
             detail=f"Error getting user jobs: {str(e)}"
         )
 
+@router.post("/{job_id}/cancel", response_model=schemas.JobResponse)
+async def cancel_job(
+    job_id: int,
+    user_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Cancel a queued or running job.
+
+    Queued jobs are removed from the Redis queue. Running jobs are flagged in
+    Redis; the worker interrupts the ComfyUI prompt and frees the GPU.
+    """
+    try:
+        job = await db.get(models.Job, job_id)
+        if not job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job not found"
+            )
+
+        # When called on behalf of a user, only the owner may cancel
+        if user_id is not None and job.user_id != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Job belongs to another user"
+            )
+
+        if job.status not in (models.JobStatus.queued, models.JobStatus.processing):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Job is already {job.status.value}"
+            )
+
+        was_queued = job.status == models.JobStatus.queued
+        job.status = models.JobStatus.cancelled
+        job.error = "Cancelled by user"
+        await db.commit()
+        await db.refresh(job)
+
+        try:
+            if was_queued:
+                await redis_client.remove_queued_job(job.id)
+            # Always set the flag: the worker may have popped the job already
+            await redis_client.request_job_cancel(job.id)
+        except Exception as redis_error:
+            logger.error(f"Failed to propagate cancel of job {job_id} to Redis: {redis_error}")
+        await publish_job_event(job)
+
+        # Skip refund during testing (balance deduction is skipped in create_job)
+        logger.info(f"Refund skipped for user {job.user_id} during testing (job {job_id} cancelled)")
+
+        # Original code (commented out for testing):
+        # user = db.query(models.User).filter(models.User.user_id == job.user_id).first()
+        # is_admin = user is not None and user.telegram_id in getattr(settings, 'ADMIN_IDS', [])
+        # if user and not (is_admin or getattr(settings, 'UNLIMITED_PROCESSING', False)):
+        #     refund_balance(job.user_id, settings.EDIT_COST, f"Job {job_id} cancelled", db)
+
+        logger.info(f"Job cancelled: {job_id} (was {'queued' if was_queued else 'processing'})")
+        return job
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error cancelling job: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error cancelling job: {str(e)}"
+        )
+
 @router.put("/{job_id}", response_model=schemas.JobResponse)
 def update_job_status(
     job_id: int,
@@ -225,14 +420,20 @@ def update_job_status(
     db: Session = Depends(get_db)
 ):
     """Update job status (Worker only)"""
-    try:
-        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+
+    def apply_update(session: Session) -> models.Job:
+        job = session.query(models.Job).filter(models.Job.id == job_id).first()
         if not job:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Job not found"
             )
-        
+
+        # A cancelled job stays cancelled even if the worker reports late
+        if job.status == models.JobStatus.cancelled and job_update.status != schemas.JobStatus.cancelled:
+            logger.info(f"Ignoring status update {job_update.status} for cancelled job {job_id}")
+            return job
+
         # Update job status
         job.status = job_update.status
         job.result_path = job_update.result_path
@@ -241,17 +442,21 @@ def update_job_status(
         # Update retry count if provided
         if job_update.retry_count is not None:
             job.retry_count = job_update.retry_count
+        return job
+
+    try:
+        write_queue = get_write_queue()
+        if write_queue:
+            # Committed together with other small writes by the single SQLite writer
+            job = anyio.from_thread.run(write_queue.submit, apply_update)
+        else:
+            job = apply_update(db)
+            db.commit()
+            db.refresh(job)
         
-        db.commit()
-        db.refresh(job)
-        
-        # Update job status in Redis if needed
-        try:
-            # Since this is a sync endpoint, we can't await the async Redis method
-            # We'll update Redis status separately via a background task or scheduled update
-            logger.info(f"Job {job_id} status would be updated in Redis to {job_update.status}")
-        except Exception as redis_error:
-            logger.error(f"Failed to update job {job_id} status in Redis: {redis_error}")
+        # Mirror into the Redis state hash and wake up /events and /wait
+        # listeners; serialised here, off the event loop
+        anyio.from_thread.run(record_job_state, job_response(job))
         
         logger.info(f"Job updated: {job_id}, status: {job_update.status}")
         return job
@@ -1,9 +1,9 @@
 """Payment API endpoints"""
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
-from ..database import get_db
+from ..database import get_async_db
 from ..schemas import PaymentCreate, PaymentResponse, PaymentHistoryResponse
 from ..services.payment_service import PaymentService
 from ..config import settings
@@ -42,7 +42,7 @@ async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
 async def create_payment(
     request: Request,
     payment_data: PaymentCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Create a new payment
@@ -86,7 +86,7 @@ async def create_payment(
 @router.get("/{payment_id}", response_model=PaymentResponse)
 async def get_payment(
     payment_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get payment status
@@ -127,7 +127,8 @@ async def get_user_payments(
     limit: int = 20,
     offset: int = 0,
     status: Optional[str] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get payment history for a user
@@ -139,6 +140,7 @@ async def get_user_payments(
         limit: Maximum number of payments to return (default: 20)
         offset: Offset for pagination (default: 0)
         status: Filter by payment status (optional)
+        cursor: next_cursor from the previous page (keyset pagination, preferred over offset)
         
     Returns:
         PaymentHistoryResponse with payments list and metadata
@@ -149,7 +151,8 @@ async def get_user_payments(
             user_id=user_id,
             limit=limit,
             offset=offset,
-            status=status
+            status=status,
+            cursor=cursor
         )
         
         return history
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from .. import models, schemas
 from ..database import get_db
+from ..services.preset_catalog import preset_catalog
+from ..utils.http_cache import etag_matches
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -12,18 +14,21 @@ import logging
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+def _cached_response(request: Request, entry) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
 @router.get("/", response_model=List[schemas.PresetResponse])
 def get_presets(
+    request: Request,
     category: Optional[str] = Query(None, description="Filter by category"),
     db: Session = Depends(get_db)
 ):
-    """Get all presets, optionally filtered by category"""
+    """Get all presets, optionally filtered by category (cached, supports If-None-Match)"""
     try:
-        query = db.query(models.Preset)
-        if category:
-            query = query.filter(models.Preset.category == category)
-        presets = query.order_by(models.Preset.order_index).all()
-        return presets
+        return _cached_response(request, preset_catalog.get_list(db, category))
     except Exception as e:
         logger.error(f"Error getting presets: {e}")
         raise HTTPException(
@@ -32,16 +37,16 @@ def get_presets(
         )
 
 @router.get("/{preset_id}", response_model=schemas.PresetResponse)
-def get_preset(preset_id: int, db: Session = Depends(get_db)):
+def get_preset(preset_id: int, request: Request, db: Session = Depends(get_db)):
     """Get a specific preset"""
     try:
-        preset = db.query(models.Preset).filter(models.Preset.id == preset_id).first()
-        if not preset:
+        entry = preset_catalog.get_item(db, preset_id)
+        if not entry:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Preset not found"
             )
-        return preset
+        return _cached_response(request, entry)
     except Exception as e:
         logger.error(f"Error getting preset: {e}")
         raise HTTPException(
@@ -57,6 +62,7 @@ def create_preset(preset: schemas.PresetCreate, db: Session = Depends(get_db)):
         db.add(new_preset)
         db.commit()
         db.refresh(new_preset)
+        preset_catalog.invalidate()
         logger.info(f"Preset created: {new_preset.id}")
         return new_preset
     except Exception as e:
@@ -83,6 +89,7 @@ def update_preset(preset_id: int, preset: schemas.PresetCreate, db: Session = De
         
         db.commit()
         db.refresh(db_preset)
+        preset_catalog.invalidate()
         logger.info(f"Preset updated: {db_preset.id}")
         return db_preset
     except Exception as e:
@@ -106,6 +113,7 @@ def delete_preset(preset_id: int, db: Session = Depends(get_db)):
         
         db.delete(preset)
         db.commit()
+        preset_catalog.invalidate()
         logger.info(f"Preset deleted: {preset_id}")
         return None
     except Exception as e:
@@ -1,24 +1,36 @@
 """Promocode API endpoints"""
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime
+import anyio
+import csv
+import codecs
 import logging
 
 from .. import models, schemas
-from ..database import get_db
-from ..services.balance import add_balance
+from ..config import settings
+from ..database import get_db, get_async_db
+from ..services.balance import apply_credit_async, store_balance_snapshot
+from ..services.payment_service import payment_totals
+from ..services.promocodes import (
+    VALID_AMOUNTS, add_to_code_filter, bulk_generate, bulk_import, code_filter_rejects, generate_promocode_code
+)
+from redis_client import redis_client
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-def generate_promocode_code(length: int = 8) -> str:
-    """Generate a random promocode"""
-    import random
-    import string
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(chars) for _ in range(length))
+def _register_codes(codes):
+    """Add new codes to the Redis filter from a sync route"""
+    try:
+        anyio.from_thread.run(add_to_code_filter, codes)
+    except Exception as e:
+        logger.warning(f"Failed to register promocodes in filter: {e}")
 
 
 @router.post("/generate", response_model=schemas.PromocodeResponse)
@@ -30,11 +42,10 @@ def generate_promocode(
     """Generate a new promocode (for admin use)"""
     try:
         # Validate amount
-        valid_amounts = [100, 200, 300, 400, 500, 1000, 2000, 3000, 5000]
-        if amount not in valid_amounts:
+        if amount not in VALID_AMOUNTS:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid amount. Must be one of: {valid_amounts}"
+                detail=f"Invalid amount. Must be one of: {VALID_AMOUNTS}"
             )
         
         # Generate or use custom code
@@ -63,6 +74,7 @@ def generate_promocode(
         db.add(promocode)
         db.commit()
         db.refresh(promocode)
+        _register_codes([code])
         
         logger.info(f"Generated promocode: {code} for {amount} points")
         return promocode
@@ -78,72 +90,102 @@ def generate_promocode(
         )
 
 
+def _promocode_file_lines(pairs, generated_at: datetime):
+    yield f"# Generated Promocodes - {generated_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    yield f"# Total: {len(pairs)} promocodes\n"
+    yield "# Format: CODE - AMOUNT (points)\n\n"
+    for code, amount in pairs:
+        yield f"{code} - {amount}\n"
+
+
+def _promocode_csv_lines(pairs):
+    yield "code,amount\n"
+    for code, amount in pairs:
+        yield f"{code},{amount}\n"
+
+
 @router.post("/batch-generate")
 def batch_generate_promocodes(
     amounts: dict,
+    download: bool = False,
     db: Session = Depends(get_db)
 ):
     """
-    Generate multiple promocodes and save to file
-    Request body: {"amounts": [100, 200, 300, ...]}
-    Returns file path with all promocodes
+    Generate multiple promocodes in one transaction and save to file
+    Request body: {"amounts": [100, 200, 300, ...]} or {"count": 1000, "amount": 100}
+    Returns file path with all promocodes, or streams them as CSV with ?download=true
     """
     try:
         import os
         
-        promocodes_data = []
-        valid_amounts = [100, 200, 300, 400, 500, 1000, 2000, 3000, 5000]
+        requested = amounts.get("amounts")
+        if requested is None:
+            # Checked before the list is built: a huge count must not allocate it
+            try:
+                count = int(amounts.get("count", 0))
+            except (TypeError, ValueError):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid count: {amounts.get('count')!r}"
+                )
+            if not 0 < count <= settings.PROMOCODE_BULK_MAX_COUNT:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Count must be between 1 and {settings.PROMOCODE_BULK_MAX_COUNT}"
+                )
+            requested = [amounts.get("amount")] * count
+        elif not isinstance(requested, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="amounts must be a list"
+            )
+        
+        if len(requested) > settings.PROMOCODE_BULK_MAX_COUNT:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Too many promocodes: at most {settings.PROMOCODE_BULK_MAX_COUNT} per batch"
+            )
         
         # Validate all amounts
-        for amount in amounts.get("amounts", []):
-            if amount not in valid_amounts:
+        for amount in set(requested):
+            if amount not in VALID_AMOUNTS:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Invalid amount: {amount}. Must be one of: {valid_amounts}"
+                    detail=f"Invalid amount: {amount}. Must be one of: {VALID_AMOUNTS}"
                 )
         
-        # Generate promocodes
-        for amount in amounts.get("amounts", []):
-            code = generate_promocode_code()
-            while db.query(models.Promocode).filter(models.Promocode.code == code).first():
-                code = generate_promocode_code()
-            
-            promocode = models.Promocode(
-                code=code,
-                amount=amount
+        generated_at = datetime.now()
+        pairs = bulk_generate(db, requested)
+        _register_codes([code for code, _ in pairs])
+        
+        if download:
+            filename = f"promocodes_{generated_at.strftime('%Y%m%d_%H%M%S')}.csv"
+            return StreamingResponse(
+                _promocode_csv_lines(pairs),
+                media_type="text/csv",
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
             )
-            db.add(promocode)
-            db.commit()
-            db.refresh(promocode)
-            
-            promocodes_data.append({
-                "code": code,
-                "amount": amount,
-                "created_at": promocode.created_at.isoformat()
-            })
         
         # Save to file
         data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), "data")
         os.makedirs(data_dir, exist_ok=True)
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = generated_at.strftime("%Y%m%d_%H%M%S")
         file_path = os.path.join(data_dir, f"promocodes_{timestamp}.txt")
         
         with open(file_path, "w", encoding="utf-8") as f:
-            f.write(f"# Generated Promocodes - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"# Total: {len(promocodes_data)} promocodes\n")
-            f.write(f"# Format: CODE - AMOUNT (points)\n\n")
-            
-            for pc in promocodes_data:
-                f.write(f"{pc['code']} - {pc['amount']}\n")
+            f.writelines(_promocode_file_lines(pairs, generated_at))
         
-        logger.info(f"Generated {len(promocodes_data)} promocodes, saved to {file_path}")
+        logger.info(f"Generated {len(pairs)} promocodes, saved to {file_path}")
         
         return {
             "success": True,
-            "count": len(promocodes_data),
+            "count": len(pairs),
             "file_path": file_path,
-            "promocodes": promocodes_data
+            "promocodes": [
+                {"code": code, "amount": amount, "created_at": generated_at.isoformat()}
+                for code, amount in pairs
+            ]
         }
         
     except HTTPException:
@@ -157,79 +199,122 @@ def batch_generate_promocodes(
         )
 
 
+@router.post("/import")
+def import_promocodes(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Import promocodes from a CSV file with `code,amount` rows (header optional)
+    All valid new codes are inserted in one transaction; the rest are reported
+    """
+    try:
+        reader = csv.reader(codecs.iterdecode(file.file, "utf-8-sig"))
+        
+        def rows():
+            for line in reader:
+                if not line or line[0].strip().startswith("#"):
+                    continue
+                if line[0].strip().lower() == "code":
+                    continue
+                yield line[0], line[1] if len(line) > 1 else None
+        
+        result = bulk_import(db, rows())
+        _register_codes(result.pop('codes'))
+        return {"success": True, **result}
+        
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid CSV file: {e}"
+        )
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error importing promocodes: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error importing promocodes: {str(e)}"
+        )
+
+
 @router.post("/use", response_model=schemas.PromocodeUseResponse)
-def use_promocode(
+async def use_promocode(
     promocode_data: schemas.PromocodeUse,
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Use a promocode to add points to user balance"""
+    code = promocode_data.code.strip().upper()
+    
+    # Unknown codes are rejected by the Redis filter without touching the DB
+    if await code_filter_rejects(code):
+        return {
+            "success": False,
+            "message": "Промокод не найден"
+        }
+    
     try:
-        # Get user
-        user = db.query(models.User).filter(models.User.user_id == user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        # Find promocode
-        promocode = db.query(models.Promocode).filter(
-            models.Promocode.code == promocode_data.code.upper()
-        ).first()
-        
-        if not promocode:
-            return {
-                "success": False,
-                "message": "Промокод не найден"
-            }
+        # Claim the code and credit the balance in one transaction; the
+        # conditional UPDATE lets exactly one concurrent redemption win
+        amount = await db.scalar(
+            update(models.Promocode)
+            .where(models.Promocode.code == code, models.Promocode.is_used == False)  # noqa: E712
+            .values(is_used=True, used_at=datetime.now(), used_by_user_id=user_id)
+            .returning(models.Promocode.amount)
+        )
         
-        if promocode.is_used:
+        if amount is None:
+            await db.rollback()
+            exists = await db.scalar(select(models.Promocode.id).where(models.Promocode.code == code))
+            if not exists:
+                return {
+                    "success": False,
+                    "message": "Промокод не найден"
+                }
             return {
                 "success": False,
                 "message": "Промокод уже был использован"
             }
         
-        # Mark promocode as used
-        promocode.is_used = True
-        promocode.used_at = datetime.now()
-        promocode.used_by_user_id = user_id
-        
-        # Add points to user balance
-        new_balance = add_balance(
-            user_id,
-            promocode.amount,
-            f"Promocode: {promocode.code}",
-            db
-        )
+        try:
+            new_balance = await apply_credit_async(db, user_id, amount, f"Promocode: {code}", f"promocode:{code}")
+        except HTTPException:
+            await db.rollback()
+            raise
         
         # Create payment record for promocode
-        payment = models.Payment(
+        db.add(models.Payment(
             user_id=user_id,
-            yukassa_payment_id=f"promocode_{promocode.code}",
-            amount=promocode.amount * 100,  # Store in kopeks for consistency
+            yukassa_payment_id=f"promocode_{code}",
+            amount=amount * 100,  # Store in kopeks for consistency
             currency="RUB",
             status=models.PaymentStatus.succeeded,
             payment_type=models.PaymentType.promocode,
             payment_method="promocode",
-            description=f"Promocode: {promocode.code}"
-        )
-        db.add(payment)
-        db.commit()
+            description=f"Promocode: {code}"
+        ))
+        await db.commit()
+        payment_totals.invalidate(user_id)
+        await store_balance_snapshot(user_id, new_balance)
+        
+        try:
+            await redis_client.promocode_filter_remove(code)
+        except Exception as e:
+            logger.warning(f"Failed to remove promocode {code} from filter: {e}")
         
-        logger.info(f"User {user_id} used promocode {promocode.code} for {promocode.amount} points")
+        logger.info(f"User {user_id} used promocode {code} for {amount} points")
         
         return {
             "success": True,
-            "message": f"Промокод активирован! +{promocode.amount} баллов",
-            "amount": promocode.amount,
+            "message": f"Промокод активирован! +{amount} баллов",
+            "amount": amount,
             "new_balance": new_balance
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error using promocode: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from .. import models, schemas
-from ..database import get_db
+from ..database import get_async_db
 from ..config import settings
+from ..services.user_cache import user_cache
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -14,11 +16,11 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 @router.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Register a new user with initial balance"""
     try:
         # Check if user already exists
-        existing_user = db.query(models.User).filter(models.User.telegram_id == user.telegram_id).first()
+        existing_user = await db.scalar(select(models.User.user_id).where(models.User.telegram_id == user.telegram_id))
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -33,25 +35,31 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         )
         
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
+        await user_cache.prime(new_user)
         
         logger.info(f"User registered: {new_user.user_id}")
         return new_user
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error registering user: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error registering user: {str(e)}"
         )
 
+@router.get("/cache/metrics", response_model=dict)
+def get_user_cache_metrics():
+    """Hit ratio and counters of the user cache in this process"""
+    return user_cache.metrics()
+
 @router.get("/by-telegram-id/{telegram_id}", response_model=schemas.UserResponse)
-def get_user_by_telegram_id(telegram_id: int, db: Session = Depends(get_db)):
+async def get_user_by_telegram_id(telegram_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get user information by telegram_id"""
     try:
-        user = db.query(models.User).filter(models.User.telegram_id == telegram_id).first()
+        user = await user_cache.get_by_telegram_id(db, telegram_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -66,10 +74,10 @@ def get_user_by_telegram_id(telegram_id: int, db: Session = Depends(get_db)):
         )
 
 @router.get("/{user_id}", response_model=schemas.UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db)):
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get user information"""
     try:
-        user = db.query(models.User).filter(models.User.user_id == user_id).first()
+        user = await user_cache.get_by_id(db, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -84,10 +92,10 @@ def get_user(user_id: int, db: Session = Depends(get_db)):
         )
 
 @router.get("/{user_id}/balance", response_model=schemas.BalanceResponse)
-def get_user_balance(user_id: int, db: Session = Depends(get_db)):
+async def get_user_balance(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get user balance"""
     try:
-        user = db.query(models.User).filter(models.User.user_id == user_id).first()
+        user = await user_cache.get_by_id(db, user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -99,4 +107,4 @@ def get_user_balance(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error getting user balance: {str(e)}"
-        )
\ No newline at end of file
+        )
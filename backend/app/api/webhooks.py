@@ -1,13 +1,13 @@
 """Webhook endpoints for external services"""
 
 from fastapi import APIRouter, Request, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from ..database import get_db
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
+from .. import models
 from ..schemas import YuKassaWebhook
-from ..services.payment_service import PaymentService
+from ..services.payment_webhooks import submit_payment_webhook_event
 from ..services.yukassa import YuKassaClient
-from ..services.telegram_client import TelegramClient
-from ..config import settings
 import logging
 import json
 
@@ -19,13 +19,14 @@ router = APIRouter()
 @router.post("/yukassa")
 async def yukassa_webhook(
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Webhook from YuKassa for payment status updates
     
     Receives notifications from YuKassa when payment status changes.
-    Verifies signature and updates payment status in database.
+    Verifies signature, records the event once per (payment, status) and
+    responds; the payment is updated by PaymentWebhookQueue.
     
     Expected payload:
     {
@@ -72,52 +73,33 @@ async def yukassa_webhook(
 
         # Parse webhook data
         data = json.loads(body_str)
-        # webhook = YuKassaWebhook(**data) # We'll use raw data to get payment_method
         
         # Extract payment info
         object_data = data.get("object", {})
         yukassa_payment_id = object_data.get("id")
         payment_status = object_data.get("status")
-        payment_method_data = object_data.get("payment_method", {})
         
-        logger.info(f"YuKassa webhook: {yukassa_payment_id}, status: {payment_status}, method: {payment_method_data.get('type')}")
+        logger.info(f"YuKassa webhook: {yukassa_payment_id}, status: {payment_status}, method: {object_data.get('payment_method', {}).get('type')}")
         
-        # Process webhook
-        payment_service = PaymentService(db)
-        success = await payment_service.handle_webhook(
+        if not yukassa_payment_id or not payment_status:
+            return {"status": "ignored"}
+        
+        # Record the event; the (payment id, status) key turns a redelivery into a no-op
+        event = models.PaymentWebhookEvent(
             yukassa_payment_id=yukassa_payment_id,
             status=payment_status,
-            payment_method_details=payment_method_data
+            payload=json.dumps(object_data)
         )
+        db.add(event)
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            logger.info(f"Duplicate YuKassa webhook ignored: {yukassa_payment_id}, status: {payment_status}")
+            return {"status": "duplicate"}
         
-        if not success:
-            return {"status": "ignored"}
-        
-        # Send notification to user if payment succeeded
-        if payment_status == "succeeded":
-            payment = db.query(__import__("..models", fromlist=["Payment"]).Payment).filter(
-                __import__("..models", fromlist=["Payment"]).Payment.yukassa_payment_id == yukassa_payment_id
-            ).first()
-            
-            if payment:
-                user = db.query(__import__("..models", fromlist=["User"]).User).filter(
-                    __import__("..models", fromlist=["User"]).User.user_id == payment.user_id
-                ).first()
-                
-                if user:
-                    # Calculate points credited
-                    points = (payment.amount // 100) * settings.POINTS_PER_RUBLE
-
-                    try:
-                        telegram_client = TelegramClient()
-                        await telegram_client.send_message(
-                            chat_id=user.telegram_id,
-                            text=f"✅ Платёж успешен!\n\n💰 Пополнено: {points} баллов\n💳 Баланс: {int(user.balance)} баллов\n\nСпасибо за использование QwenEditBot! 🎉",
-                        )
-                        logger.info(f"Notification sent to user {user.user_id} about successful payment")
-                    except Exception as e:
-                        logger.error(f"Failed to send Telegram notification: {e}")
-        
+        # Balance credit and user notification happen in the background
+        submit_payment_webhook_event(event.id)
         return {"status": "ok"}
         
     except HTTPException:
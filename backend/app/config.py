@@ -18,6 +18,14 @@ class Settings(BaseSettings):
     REDIS_DB: int = Field(0, env="REDIS_DB")
     REDIS_JOB_QUEUE_KEY: str = Field("qwenedit:job_queue", env="REDIS_JOB_QUEUE_KEY")
     REDIS_RESULT_TTL: int = Field(3600, env="REDIS_RESULT_TTL")  # 1 hour
+    # Per-job state hash (written on every transition, read by GET /api/jobs/{id})
+    REDIS_JOB_STATE_KEY_PREFIX: str = Field("qwenedit:job", env="REDIS_JOB_STATE_KEY_PREFIX")
+    REDIS_JOB_STATE_TTL: int = Field(86400, env="REDIS_JOB_STATE_TTL")  # seconds after the last transition
+    # Job status transitions published for /api/jobs/{id}/events and /wait
+    REDIS_JOB_EVENTS_CHANNEL_PREFIX: str = Field("qwenedit:job_events", env="REDIS_JOB_EVENTS_CHANNEL_PREFIX")
+    JOB_EVENTS_HEARTBEAT: int = Field(15, env="JOB_EVENTS_HEARTBEAT")  # seconds between SSE keep-alives
+    JOB_EVENTS_MAX_DURATION: int = Field(900, env="JOB_EVENTS_MAX_DURATION")  # seconds before a stream is closed
+    JOB_WAIT_MAX_TIMEOUT: int = Field(60, env="JOB_WAIT_MAX_TIMEOUT")  # long-poll upper bound, seconds
     
     # ComfyUI configuration
     COMFYUI_URL: str = Field("http://localhost:8188", env="COMFYUI_URL")
@@ -27,18 +35,52 @@ class Settings(BaseSettings):
     COMFYUI_TIMEOUT: int = Field(300, env="COMFYUI_TIMEOUT")
     COMFYUI_HEALTH_CHECK_INTERVAL: int = Field(10, env="COMFYUI_HEALTH_CHECK_INTERVAL")
     COMFY_OUTPUT_FILENAME: str = Field("qwen_result.png", env="COMFY_OUTPUT_FILENAME")
+    UPLOAD_CHUNK_SIZE: int = Field(1024 * 1024, env="UPLOAD_CHUNK_SIZE")  # bytes read per chunk
+    UPLOAD_MAX_BYTES: int = Field(20 * 1024 * 1024, env="UPLOAD_MAX_BYTES")  # Telegram bot download limit
+    FILE_CHUNK_SIZE: int = Field(256 * 1024, env="FILE_CHUNK_SIZE")  # /file reads when zero-copy is unavailable
+    FILE_DIGEST_CACHE_SIZE: int = Field(4096, env="FILE_DIGEST_CACHE_SIZE")  # memoised content hashes
     
     # Database configuration
     # Use absolute path to database: sqlite:///C:/QwenEditBot/backend/qwen.db
     DATABASE_URL: str = Field("sqlite:///C:/QwenEditBot/backend/qwen.db", env="DATABASE_URL")
+    # Async driver URL; derived from DATABASE_URL when empty (sqlite+aiosqlite / postgresql+asyncpg)
+    ASYNC_DATABASE_URL: Optional[str] = Field(None, env="ASYNC_DATABASE_URL")
+
+    # SQLite performance profile (applied on every connection)
+    SQLITE_WAL_ENABLED: bool = Field(True, env="SQLITE_WAL_ENABLED")
+    SQLITE_SYNCHRONOUS: str = Field("NORMAL", env="SQLITE_SYNCHRONOUS")  # NORMAL is durable with WAL except on power loss
+    SQLITE_BUSY_TIMEOUT_MS: int = Field(5000, env="SQLITE_BUSY_TIMEOUT_MS")
+    SQLITE_CACHE_SIZE: int = Field(-65536, env="SQLITE_CACHE_SIZE")  # negative = KiB, i.e. 64 MB
+    SQLITE_MMAP_SIZE: int = Field(268435456, env="SQLITE_MMAP_SIZE")  # 256 MB
+    # Single-writer queue that groups small write transactions into one commit
+    SQLITE_WRITE_QUEUE_ENABLED: bool = Field(False, env="SQLITE_WRITE_QUEUE_ENABLED")
+    SQLITE_WRITE_BATCH_SIZE: int = Field(50, env="SQLITE_WRITE_BATCH_SIZE")
+    SQLITE_WRITE_BATCH_DELAY_MS: int = Field(5, env="SQLITE_WRITE_BATCH_DELAY_MS")
     
     # Backend configuration
     BACKEND_URL: str = Field("http://localhost:8000", env="BACKEND_URL")
+
+    # Logging: records are queued and written by a listener thread
+    LOG_LEVEL: str = Field("INFO", env="LOG_LEVEL")
+    LOG_FORMAT: str = Field("text", env="LOG_FORMAT")  # text or json
+    LOG_FILE: Optional[str] = Field(None, env="LOG_FILE")  # defaults to backend/logs/backend_runtime.log
+    LOG_MAX_BYTES: int = Field(10 * 1024 * 1024, env="LOG_MAX_BYTES")  # size before rotation
+    LOG_BACKUP_COUNT: int = Field(5, env="LOG_BACKUP_COUNT")
+    # Hot-loop loggers, 'logger=value,...': fraction of records kept / records per second (below WARNING)
+    LOG_SAMPLING: str = Field("", env="LOG_SAMPLING")
+    LOG_RATE_LIMITS: str = Field("uvicorn.access=50", env="LOG_RATE_LIMITS")
     
     # Balance configuration
     INITIAL_BALANCE: int = Field(60, env="INITIAL_BALANCE")
     EDIT_COST: int = Field(30, env="EDIT_COST")
     WEEKLY_BONUS: int = Field(10, env="WEEKLY_BONUS")
+    # Read-through user cache in Redis (by user_id and telegram_id)
+    USER_CACHE_ENABLED: bool = Field(True, env="USER_CACHE_ENABLED")
+    USER_CACHE_TTL: int = Field(30, env="USER_CACHE_TTL")  # seconds
+    REDIS_USER_CACHE_KEY_PREFIX: str = Field("qwenedit:user", env="REDIS_USER_CACHE_KEY_PREFIX")
+    # Balance snapshot in Redis, written after every ledger operation
+    BALANCE_SNAPSHOT_TTL: int = Field(60, env="BALANCE_SNAPSHOT_TTL")  # seconds
+    REDIS_BALANCE_KEY_PREFIX: str = Field("qwenedit:balance", env="REDIS_BALANCE_KEY_PREFIX")
     
     # Payment configuration
     YUKASSA_SHOP_ID: Optional[str] = Field(None, env="YUKASSA_SHOP_ID")
@@ -48,7 +90,38 @@ class Settings(BaseSettings):
     PAYMENT_MAX_AMOUNT: int = Field(10000, env="PAYMENT_MAX_AMOUNT")  # rubles
     PAYMENT_RETURN_URL: str = Field("https://t.me/YourBotUsername", env="PAYMENT_RETURN_URL")
     POINTS_PER_RUBLE: int = Field(1, env="POINTS_PER_RUBLE")
+    # Webhook events are processed in the background after the webhook responds
+    PAYMENT_WEBHOOK_CONSUMERS: int = Field(2, env="PAYMENT_WEBHOOK_CONSUMERS")
+    PAYMENT_WEBHOOK_SWEEP_INTERVAL: int = Field(60, env="PAYMENT_WEBHOOK_SWEEP_INTERVAL")  # seconds between retries of unprocessed events
+    PAYMENT_WEBHOOK_MAX_ATTEMPTS: int = Field(5, env="PAYMENT_WEBHOOK_MAX_ATTEMPTS")
     
+    # Job analytics rollups (hourly/daily/all-time), refreshed from a watermark
+    ANALYTICS_ROLLUP_ENABLED: bool = Field(True, env="ANALYTICS_ROLLUP_ENABLED")
+    ANALYTICS_ROLLUP_INTERVAL: int = Field(60, env="ANALYTICS_ROLLUP_INTERVAL")  # seconds between refreshes
+    ANALYTICS_ROLLUP_OVERLAP: int = Field(300, env="ANALYTICS_ROLLUP_OVERLAP")  # seconds re-read for late commits
+
+    # Archival of settled jobs and payments into the *_archive tables
+    ARCHIVE_ENABLED: bool = Field(True, env="ARCHIVE_ENABLED")
+    ARCHIVE_INTERVAL: int = Field(3600, env="ARCHIVE_INTERVAL")  # seconds between archival runs
+    ARCHIVE_CHUNK_SIZE: int = Field(500, env="ARCHIVE_CHUNK_SIZE")  # rows moved per transaction
+    JOB_ARCHIVE_AFTER_DAYS: int = Field(30, env="JOB_ARCHIVE_AFTER_DAYS")  # finished jobs older than this
+    PAYMENT_ARCHIVE_AFTER_DAYS: int = Field(180, env="PAYMENT_ARCHIVE_AFTER_DAYS")  # settled payments and logs older than this
+
+    # Preset catalog cache (rebuilt on preset writes; TTL covers writes from other processes)
+    PRESET_CATALOG_TTL: int = Field(300, env="PRESET_CATALOG_TTL")  # seconds
+
+    # History pagination
+    HISTORY_MAX_PAGE_SIZE: int = Field(100, env="HISTORY_MAX_PAGE_SIZE")
+    HISTORY_TOTAL_CACHE_TTL: int = Field(300, env="HISTORY_TOTAL_CACHE_TTL")  # seconds
+
+    # Promocodes
+    PROMOCODE_BULK_CHUNK_SIZE: int = Field(500, env="PROMOCODE_BULK_CHUNK_SIZE")  # codes per IN query / INSERT
+    PROMOCODE_BULK_MAX_COUNT: int = Field(50000, env="PROMOCODE_BULK_MAX_COUNT")
+    # Redis set of unused codes that rejects unknown codes without a DB query
+    PROMOCODE_FILTER_ENABLED: bool = Field(True, env="PROMOCODE_FILTER_ENABLED")
+    PROMOCODE_FILTER_TTL: int = Field(600, env="PROMOCODE_FILTER_TTL")  # seconds until the set is rebuilt from the DB
+    REDIS_PROMOCODE_FILTER_KEY: str = Field("qwenedit:promocodes:unused", env="REDIS_PROMOCODE_FILTER_KEY")
+
     # Rate limiting configuration
     RATE_LIMIT_ENABLED: bool = Field(True, env="RATE_LIMIT_ENABLED")
     PAYMENT_RATE_LIMIT: str = Field("5/minute", env="PAYMENT_RATE_LIMIT")  # 5 payments per minute per user
@@ -58,6 +131,20 @@ class Settings(BaseSettings):
     WEEKLY_BONUS_AMOUNT: int = Field(10, env="WEEKLY_BONUS_AMOUNT")  # points
     WEEKLY_BONUS_DAY: int = Field(4, env="WEEKLY_BONUS_DAY")  # 0=Monday, 4=Friday
     WEEKLY_BONUS_TIME: str = Field("20:00", env="WEEKLY_BONUS_TIME")  # HH:MM UTC
+    WEEKLY_BONUS_CHUNK_SIZE: int = Field(1000, env="WEEKLY_BONUS_CHUNK_SIZE")  # users per transaction
+    REDIS_BONUS_KEY_PREFIX: str = Field("qwenedit:weekly_bonus", env="REDIS_BONUS_KEY_PREFIX")
+
+    # Bulk Telegram notifications (Bot API allows ~30 messages/s per bot)
+    TELEGRAM_BROADCAST_RATE: float = Field(25.0, env="TELEGRAM_BROADCAST_RATE")  # messages per second
+    TELEGRAM_BROADCAST_CONCURRENCY: int = Field(10, env="TELEGRAM_BROADCAST_CONCURRENCY")
+
+    # Telegram webhook: updates are acknowledged at once and processed from a Redis stream
+    TELEGRAM_WEBHOOK_SECRET: Optional[str] = Field(None, env="TELEGRAM_WEBHOOK_SECRET")  # setWebhook secret_token
+    REDIS_TELEGRAM_UPDATES_STREAM: str = Field("qwenedit:telegram:updates", env="REDIS_TELEGRAM_UPDATES_STREAM")
+    TELEGRAM_UPDATES_STREAM_MAXLEN: int = Field(100000, env="TELEGRAM_UPDATES_STREAM_MAXLEN")
+    TELEGRAM_UPDATE_DEDUPE_TTL: int = Field(86400, env="TELEGRAM_UPDATE_DEDUPE_TTL")  # seconds an update_id is remembered
+    TELEGRAM_UPDATE_CONSUMERS: int = Field(4, env="TELEGRAM_UPDATE_CONSUMERS")  # updates processed concurrently
+    TELEGRAM_UPDATE_CLAIM_IDLE_MS: int = Field(60000, env="TELEGRAM_UPDATE_CLAIM_IDLE_MS")  # reclaim after a consumer died
      
     # QwenEdit 2511 configuration
     QWEN_EDIT_VAE_NAME: str = Field("qwen_image_vae.safetensors", env="QWEN_EDIT_VAE_NAME")
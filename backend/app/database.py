@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import Session
@@ -8,16 +9,65 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the SQLite performance profile to every new connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        if settings.SQLITE_WAL_ENABLED:
+            # WAL lets readers run while a writer commits; persistent per database file
+            cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute(f"PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size = {int(settings.SQLITE_CACHE_SIZE)}")
+        cursor.execute(f"PRAGMA mmap_size = {int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+    finally:
+        cursor.close()
+
+
+def configure_sqlite(sync_engine) -> None:
+    """Register the SQLite PRAGMA profile on an engine (no-op for other databases)"""
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+
+
 # Create SQLAlchemy engine
 engine = create_engine(
     settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
+    connect_args={
+        "check_same_thread": False,
+        # sqlite3 waits this long on a locked database before raising "database is locked"
+        "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000,
+    } if "sqlite" in settings.DATABASE_URL else {},
     echo=False  # Set to True for debugging SQL queries
 )
+configure_sqlite(engine)
 
 # Create a configured "Session" class (SQLAlchemy 2.x style)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False, future=True)
 
+
+def get_async_database_url(url: str) -> str:
+    """Map a sync DATABASE_URL to its async driver (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql://") or url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("postgresql+psycopg2://"):
+        return url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+    return url
+
+# Async engine for `async def` routes, so DB I/O does not block the event loop.
+# Sync routes keep using SessionLocal and run in FastAPI's threadpool.
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL or get_async_database_url(settings.DATABASE_URL),
+    echo=False
+)
+configure_sqlite(async_engine.sync_engine)
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # Base class for declarative models
 Base = declarative_base()
 
@@ -29,6 +79,11 @@ def get_db():
     finally:
         db.close()
 
+# Dependency to get async DB session (use only in `async def` routes)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Preset database functions
 def get_presets_by_category(db: Session, category: str):
     """Get all presets for a category"""
@@ -1,32 +1,37 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi import HTTPException, status
 from .config import settings, ensure_directories
-from .database import engine, Base, SessionLocal, seed_presets_if_empty
-from .api import users, presets, jobs, balance, telegram, payments, webhooks, promocodes
+from .database import engine, async_engine, Base, SessionLocal, AsyncSessionLocal
+from .api import users, presets, jobs, balance, telegram, payments, webhooks, promocodes, files, analytics
 from . import models
 from .services.scheduler import WeeklyBonusScheduler
+from .services.write_queue import start_write_queue, stop_write_queue
+from .services.file_server import file_server
+from .utils.logger import setup_logger
+from .services.telegram_updates import start_telegram_update_consumers, stop_telegram_update_consumers
+from .services.payment_webhooks import start_payment_webhook_queue, stop_payment_webhook_queue
+from .services.analytics import start_analytics_rollups, stop_analytics_rollups
+from .services.archive import start_archive_scheduler, stop_archive_scheduler
 from redis_client import redis_client
 from sqlalchemy import text
 import logging
 import os
-from pathlib import Path
 import asyncio
 import sys
+import time
+from contextlib import contextmanager
 
-# Configure logging with file output
+# Configure logging: records are written by a listener thread, off the event loop
 log_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'logs')
-os.makedirs(log_directory, exist_ok=True)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler(os.path.join(log_directory, 'backend_startup.log'), encoding='utf-8'),
-        logging.FileHandler(os.path.join(log_directory, 'backend_runtime.log'), encoding='utf-8')
-    ]
+
+setup_logger(
+    settings.LOG_LEVEL,
+    log_format=settings.LOG_FORMAT,
+    log_file=settings.LOG_FILE or os.path.join(log_directory, 'backend_runtime.log'),
+    max_bytes=settings.LOG_MAX_BYTES,
+    backup_count=settings.LOG_BACKUP_COUNT,
+    sampling=settings.LOG_SAMPLING,
+    rate_limits=settings.LOG_RATE_LIMITS,
 )
 logger = logging.getLogger(__name__)
 
@@ -36,21 +41,61 @@ def create_tables():
     Base.metadata.create_all(bind=engine)
     logger.info("Database tables created successfully")
 
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'alembic.ini')
+
 # Run database migrations
-def run_migrations():
-    logger.info("Running database migrations...")
-    try:
-        import subprocess
-        result = subprocess.run([
-            "alembic", "upgrade", "head"
-        ], cwd=".", capture_output=True, text=True)
+def run_migrations() -> bool:
+    """Apply Alembic migrations in-process, only when the database is behind head.
 
-        if result.returncode == 0:
-            logger.info("Database migrations applied successfully")
-        else:
-            logger.error(f"Failed to apply migrations: {result.stderr}")
-    except Exception as e:
-        logger.exception(f"Error running migrations: {e}")
+    Comparing alembic_version with the script heads costs one query, so a
+    restart of an up-to-date database no longer spawns `alembic upgrade head`
+    (a second interpreter that re-imports the whole app).
+    """
+    from alembic import command
+    from alembic.config import Config
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    config = Config(ALEMBIC_INI)
+    config.attributes["configure_logger"] = False
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+
+    with engine.begin() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+        if current == heads:
+            logger.info(f"Database is up to date at {', '.join(sorted(heads))}")
+            return False
+
+        logger.info(
+            f"Upgrading database from {', '.join(sorted(current)) or 'empty'} "
+            f"to {', '.join(sorted(heads))}..."
+        )
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+    logger.info("Database migrations applied successfully")
+    return True
+
+
+class StartupTimer:
+    """Collects the duration of each startup phase for the final report"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        logger.info(f"Startup timing (total {total * 1000:.0f} ms):")
+        for name, duration in self.phases:
+            logger.info(f"  {name:<20} {duration * 1000:8.1f} ms")
 
 # Create FastAPI app
 app = FastAPI(
@@ -79,10 +124,31 @@ app.include_router(telegram.router, prefix="/api/telegram", tags=["telegram"])
 app.include_router(payments.router, prefix="/api/payments", tags=["payments"])
 app.include_router(webhooks.router, prefix="/api/webhooks", tags=["webhooks"])
 app.include_router(promocodes.router, prefix="/api/promocodes", tags=["promocodes"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
+app.include_router(files.router, prefix="/file", tags=["files"])
 
 # Global scheduler instance
 scheduler: WeeklyBonusScheduler = None
 
+async def _connect_redis(timer: StartupTimer):
+    # Non-critical: runs concurrently with the migration check
+    with timer.phase("redis"):
+        try:
+            await redis_client.connect()
+            logger.info("[OK] Redis connected successfully")
+        except Exception as e:
+            logger.warning(f"[WARN] Redis connection failed (non-critical): {e}")
+
+
+async def _start_write_queue(timer: StartupTimer):
+    # Start single-writer SQLite queue (optional)
+    with timer.phase("write queue"):
+        try:
+            await start_write_queue(SessionLocal)
+        except Exception as e:
+            logger.warning(f"[WARN] SQLite write queue failed to start, writes commit directly: {e}")
+
+
 @app.on_event("startup")
 async def on_startup():
     logger.info("="*60)
@@ -90,9 +156,10 @@ async def on_startup():
     logger.info("="*60)
     
     startup_errors = []
-    
+    timer = StartupTimer()
+
     # Pre-flight: Check environment
-    logger.info("[1/7] Checking environment...")
+    logger.info("[1/6] Checking environment...")
     try:
         env = os.getenv('APP_ENV', 'production')
         logger.info(f"APP_ENV: {env}")
@@ -101,55 +168,49 @@ async def on_startup():
     except Exception as e:
         logger.error(f"Environment check failed: {e}")
         startup_errors.append(f"Environment: {e}")
-    
-    # Step 1: Run migrations
-    logger.info("[2/7] Running database migrations...")
-    try:
-        run_migrations()
-        logger.info("[OK] Migrations completed")
-    except Exception as e:
-        logger.error(f"[ERROR] Migration failed: {e}")
-        logger.exception("Migration error details")
-        startup_errors.append(f"Migration: {str(e)[:100]}")
-    
-    # Step 2: Ensure required directories
-    logger.info("[3/7] Creating required directories...")
-    try:
-        ensure_directories()
-        logger.info("[OK] Directories ensured")
-    except Exception as e:
-        logger.error(f"[ERROR] Directory creation failed: {e}")
-        logger.exception("Directory error details")
-        startup_errors.append(f"Directories: {str(e)[:100]}")
-    
-    # Step 3: Test database connection
-    logger.info("[4/7] Testing database connection...")
-    db_test_session = None
-    try:
-        db_test_session = SessionLocal()
-        result = db_test_session.execute(text("SELECT 1"))
-        result.scalar()
-        logger.info("[OK] Database connection successful")
-        
-        # Test if tables exist
-        from sqlalchemy import inspect
-        inspector = inspect(engine)
-        tables = inspector.get_table_names()
-        logger.info(f"[OK] Found {len(tables)} tables in database: {tables[:5]}{'...' if len(tables) > 5 else ''}")
-    except Exception as e:
-        logger.error(f"[ERROR] Database connection failed: {e}")
-        logger.exception("Database error details")
-        startup_errors.append(f"Database: {str(e)[:100]}")
-    finally:
-        if db_test_session:
-            db_test_session.close()
-    
-    # Step 4: Create tables (development only)
-    logger.info("[5/7] Creating tables (if development)...")
+
+    # Redis is not needed by the steps below, so connect in the background
+    logger.info("[2/6] Connecting to Redis (in background)...")
+    redis_task = asyncio.create_task(_connect_redis(timer))
+
+    # Step 1: Ensure required directories
+    logger.info("[3/6] Creating required directories...")
+    with timer.phase("directories"):
+        try:
+            ensure_directories()
+            file_server.configure()
+            logger.info("[OK] Directories ensured")
+        except Exception as e:
+            logger.error(f"[ERROR] Directory creation failed: {e}")
+            logger.exception("Directory error details")
+            startup_errors.append(f"Directories: {str(e)[:100]}")
+
+    # Step 2: Run migrations (also proves the database is reachable)
+    logger.info("[4/6] Checking database migrations...")
+    with timer.phase("migrations"):
+        try:
+            await asyncio.to_thread(run_migrations)
+            logger.info("[OK] Migrations completed")
+        except Exception as e:
+            logger.error(f"[ERROR] Migration failed: {e}")
+            logger.exception("Migration error details")
+            startup_errors.append(f"Migration: {str(e)[:100]}")
+
+            # Tell a broken migration apart from an unreachable database
+            try:
+                with SessionLocal() as db_test_session:
+                    db_test_session.execute(text("SELECT 1")).scalar()
+            except Exception as db_error:
+                logger.error(f"[ERROR] Database connection failed: {db_error}")
+                startup_errors.append(f"Database: {str(db_error)[:100]}")
+
+    # Step 3: Create tables (development only)
+    logger.info("[5/6] Creating tables (if development)...")
     try:
         if os.getenv('APP_ENV', 'production').lower() == 'development':
             logger.info("Creating tables via metadata.create_all()...")
-            create_tables()
+            with timer.phase("create tables"):
+                await asyncio.to_thread(create_tables)
             logger.info("[OK] Tables created")
         else:
             logger.info("Skipping Base.metadata.create_all() in production")
@@ -157,44 +218,57 @@ async def on_startup():
         logger.error(f"[ERROR] Table creation failed: {e}")
         logger.exception("Table creation error details")
         startup_errors.append(f"Tables: {str(e)[:100]}")
-    
-    # Step 5: Seed presets (deprecated - presets are now in menu.py)
-    logger.info("[6/7] Seeding presets (deprecated)...")
-    db = SessionLocal()
-    try:
-        await asyncio.to_thread(seed_presets_if_empty, db)
-        logger.info("[OK] Presets initialization completed (no-op, presets in menu.py)")
-    except Exception as e:
-        logger.error(f"[ERROR] Preset seeding failed: {e}")
-        logger.exception("Preset seeding error details")
-        startup_errors.append(f"Presets: {str(e)[:100]}")
-    finally:
-        db.close()
-    
-    # Step 6: Connect to Redis (non-critical)
-    logger.info("[7/7] Connecting to Redis...")
-    try:
-        await redis_client.connect()
-        logger.info("[OK] Redis connected successfully")
-    except Exception as e:
-        logger.warning(f"[WARN] Redis connection failed (non-critical): {e}")
-        # Don't add to startup_errors - this is non-critical
-    
-    # Step 7: Start scheduler (non-critical)
+
+    # Step 4: Background services (non-critical); the scheduler resumes
+    # interrupted bonus runs from Redis checkpoints, so it waits for Redis
+    logger.info("[6/6] Starting background services...")
+    await asyncio.gather(redis_task, _start_write_queue(timer))
+
     logger.info("Starting WeeklyBonusScheduler...")
     global scheduler
-    try:
-        scheduler = WeeklyBonusScheduler(SessionLocal)
-        await scheduler.start()
-        logger.info("[OK] Scheduler started")
-    except Exception as e:
-        logger.warning(f"[WARN] Scheduler failed to start (non-critical): {e}")
-        logger.exception("Scheduler error details (non-critical)")
-        scheduler = None
-        # Don't add to startup_errors - this is non-critical
+    with timer.phase("scheduler"):
+        try:
+            scheduler = WeeklyBonusScheduler(AsyncSessionLocal)
+            await scheduler.start()
+            logger.info("[OK] Scheduler started")
+        except Exception as e:
+            logger.warning(f"[WARN] Scheduler failed to start (non-critical): {e}")
+            logger.exception("Scheduler error details (non-critical)")
+            scheduler = None
+            # Don't add to startup_errors - this is non-critical
+
+    # Telegram webhook updates are queued in Redis and handled here
+    with timer.phase("update consumers"):
+        try:
+            await start_telegram_update_consumers(AsyncSessionLocal)
+        except Exception as e:
+            logger.warning(f"[WARN] Telegram update consumers failed to start (non-critical): {e}")
+
+    # YuKassa webhook events recorded by the webhook, including any left over
+    with timer.phase("payment webhooks"):
+        try:
+            await start_payment_webhook_queue(AsyncSessionLocal)
+        except Exception as e:
+            logger.error(f"[ERROR] Payment webhook consumers failed to start: {e}")
+            startup_errors.append(f"Payment webhooks: {str(e)[:100]}")
+
+    # Job analytics rollups, caught up from the stored watermark
+    with timer.phase("analytics rollups"):
+        try:
+            await start_analytics_rollups(AsyncSessionLocal)
+        except Exception as e:
+            logger.warning(f"[WARN] Analytics rollups failed to start (non-critical): {e}")
+
+    # Settled jobs and payments moved to the archive tables in chunks
+    with timer.phase("archiver"):
+        try:
+            await start_archive_scheduler(AsyncSessionLocal)
+        except Exception as e:
+            logger.warning(f"[WARN] Archive scheduler failed to start (non-critical): {e}")
     
     # Final status
     logger.info("="*60)
+    timer.report()
     if startup_errors:
         logger.error("BACKEND STARTUP COMPLETED WITH ERRORS:")
         for i, error in enumerate(startup_errors, 1):
@@ -214,6 +288,34 @@ async def on_shutdown():
         except Exception:
             logger.exception("Error stopping scheduler")
 
+    # Stop Telegram update consumers; unacknowledged updates stay in the stream
+    try:
+        await stop_telegram_update_consumers()
+    except Exception:
+        logger.exception("Error stopping Telegram update consumers")
+
+    # Stop payment webhook consumers; unprocessed events are swept up on the next start
+    try:
+        await stop_payment_webhook_queue()
+    except Exception:
+        logger.exception("Error stopping payment webhook consumers")
+
+    try:
+        await stop_analytics_rollups()
+    except Exception:
+        logger.exception("Error stopping analytics rollups")
+
+    try:
+        await stop_archive_scheduler()
+    except Exception:
+        logger.exception("Error stopping archive scheduler")
+
+    # Flush pending batched writes
+    try:
+        await stop_write_queue()
+    except Exception:
+        logger.exception("Error stopping SQLite write queue")
+
     # Close Redis connection
     try:
         await redis_client.close()
@@ -221,6 +323,12 @@ async def on_shutdown():
     except Exception:
         logger.exception("Error closing Redis connection")
 
+    # Close async DB connection pool
+    try:
+        await async_engine.dispose()
+    except Exception:
+        logger.exception("Error disposing async database engine")
+
     logger.info("QwenEditBot Backend shutdown complete")
 
 @app.get("/")
@@ -230,66 +338,3 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "version": "1.0.0"}
-
-@app.get("/file/{file_path:path}")
-async def download_file(file_path: str):
-    """Download file from server"""
-    try:
-        file_path_obj = Path(file_path)
-
-        # Resolve to absolute path
-        if not file_path_obj.is_absolute():
-            file_path_obj = (Path.cwd() / file_path_obj).resolve()
-        else:
-            file_path_obj = file_path_obj.resolve()
-
-        # Build list of allowed directories (resolve them)
-        allowed_dirs = []
-        for allowed_dir in (
-            getattr(settings, 'COMFY_INPUT_DIR', None),
-            getattr(settings, 'COMFY_OUTPUT_DIR', None),
-            getattr(settings, 'UPLOADS_DIR', None),
-            './results'
-        ):
-            if not allowed_dir:
-                continue
-            allowed_dirs.append(Path(allowed_dir).resolve())
-
-        # Security check - ensure requested file is inside one of the allowed directories
-        is_allowed = False
-        for d in allowed_dirs:
-            try:
-                if file_path_obj.is_relative_to(d):
-                    is_allowed = True
-                    break
-            except Exception:
-                # For Python versions without is_relative_to, fallback to manual check
-                try:
-                    if str(d) == str(file_path_obj) or str(file_path_obj).startswith(str(d) + os.sep):
-                        is_allowed = True
-                        break
-                except Exception:
-                    continue
-
-        if not is_allowed:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Access to this file is not allowed"
-            )
-
-        if not file_path_obj.exists():
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="File not found"
-            )
-
-        return FileResponse(str(file_path_obj))
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.exception(f"Error downloading file: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error downloading file: {str(e)}"
-        )
\ No newline at end of file
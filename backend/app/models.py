@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, ForeignKey, Text, Boolean, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -10,6 +10,7 @@ class JobStatus(str, PyEnum):
     processing = "processing"
     completed = "completed"
     failed = "failed"
+    cancelled = "cancelled"
 
 class PaymentStatus(str, PyEnum):
     pending = "pending"
@@ -57,6 +58,9 @@ class Job(Base):
     image_path = Column(String(255))
     second_image_path = Column(String(255), nullable=True)
     prompt = Column(Text)
+    # Preset id as a string, "custom" or "fitting"; NULL on rows not yet backfilled
+    preset_key = Column(String(50), nullable=True)
+    workflow_type = Column(String(50), nullable=True)
     status = Column(Enum(JobStatus), default=JobStatus.queued)
     result_path = Column(String(255))
     error = Column(Text)
@@ -66,6 +70,51 @@ class Job(Base):
     
     user = relationship("User", back_populates="jobs")
 
+    __table_args__ = (
+        Index("ix_jobs_user_id_created_at", "user_id", "created_at"),
+        Index("ix_jobs_status_created_at", "status", "created_at"),
+        # Analytics rollups: changed jobs since the watermark, then whole hours by creation time
+        Index("ix_jobs_created_at", "created_at"),
+        Index("ix_jobs_updated_at", "updated_at"),
+        Index("ix_jobs_preset_key_created_at", "preset_key", "created_at"),
+        # Ids are never reused once archiving has moved the newest rows out
+        {"sqlite_autoincrement": True},
+    )
+
+class JobRollup(Base):
+    """Job counts and latency histogram per time bucket and dimension.
+
+    granularity is hour, day or total (bucket_start fixed at the epoch);
+    dimension is all (key ''), preset (preset id or 'custom') or user (user id).
+    Jobs are attributed to the bucket of their created_at.
+    """
+    __tablename__ = "job_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String(10), nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    dimension = Column(String(20), nullable=False)
+    key = Column(String(50), nullable=False, default="")
+    jobs = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    cancelled = Column(Integer, nullable=False, default=0)
+    latency_sum = Column(Float, nullable=False, default=0.0)  # seconds, completed jobs
+    latency_histogram = Column(Text, nullable=False, default="[]")  # JSON counts per LATENCY_BUCKETS bound
+
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "dimension", "key", name="uq_job_rollups_bucket"),
+        Index("ix_job_rollups_dimension_bucket", "granularity", "dimension", "bucket_start"),
+    )
+
+class AnalyticsWatermark(Base):
+    """How far a periodic analytics job has read (jobs changed before `value` are rolled up)"""
+    __tablename__ = "analytics_watermarks"
+
+    name = Column(String(50), primary_key=True)
+    value = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class PaymentLog(Base):
     __tablename__ = "payment_logs"
     
@@ -78,6 +127,27 @@ class PaymentLog(Base):
     
     user = relationship("User", back_populates="payment_logs")
 
+    __table_args__ = (
+        # Ids are never reused once archiving has moved the newest rows out
+        {"sqlite_autoincrement": True},
+    )
+
+class BalanceLedger(Base):
+    """Append-only record of every balance change"""
+    __tablename__ = "balance_ledger"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    delta = Column(Float, nullable=False)
+    balance_after = Column(Float, nullable=False)
+    reason = Column(String(255))
+    reference = Column(String(100), nullable=True)  # e.g. "payment:12", "job:34"
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_balance_ledger_user_id_id", "user_id", "id"),
+    )
+
 class Payment(Base):
     __tablename__ = "payments"
     
@@ -109,6 +179,97 @@ class Payment(Base):
     # Relationships
     user = relationship("User", back_populates="payments")
 
+    __table_args__ = (
+        Index("ix_payments_user_id_created_at", "user_id", "created_at"),
+        # Ids are never reused once archiving has moved the newest rows out
+        {"sqlite_autoincrement": True},
+    )
+
+
+class PaymentWebhookEvent(Base):
+    """YuKassa notification received once per (payment, status); the processing queue"""
+    __tablename__ = "payment_webhook_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    yukassa_payment_id = Column(String(100), nullable=False)
+    status = Column(String(50), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON of the notification "object"
+    attempts = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("yukassa_payment_id", "status", name="uq_payment_webhook_events_payment_status"),
+        Index("ix_payment_webhook_events_processed_at", "processed_at"),
+    )
+
+
+# Cold copies of settled rows moved out of jobs, payments and payment_logs by
+# services/archive.py. Ids are kept, so a row is found by the same key in
+# either table (the hot tables use AUTOINCREMENT, so an archived id is never
+# handed out again); there are no foreign keys, archived rows are never updated.
+
+class JobArchive(Base):
+    __tablename__ = "jobs_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    image_path = Column(String(255))
+    second_image_path = Column(String(255), nullable=True)
+    prompt = Column(Text)
+    preset_key = Column(String(50), nullable=True)
+    workflow_type = Column(String(50), nullable=True)
+    status = Column(Enum(JobStatus))
+    result_path = Column(String(255))
+    error = Column(Text)
+    retry_count = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_jobs_archive_user_id_created_at", "user_id", "created_at"),
+        Index("ix_jobs_archive_created_at", "created_at"),
+    )
+
+class PaymentArchive(Base):
+    __tablename__ = "payments_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    yukassa_payment_id = Column(String(100), nullable=True, index=True)
+    amount = Column(Integer)
+    currency = Column(String(3), default="RUB")
+    status = Column(Enum(PaymentStatus))
+    payment_type = Column(Enum(PaymentType))
+    payment_method = Column(String(50))
+    payment_method_details = Column(Text, nullable=True)
+    description = Column(Text, nullable=True)
+    confirmation_url = Column(String(500), nullable=True)
+    created_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
+    paid_at = Column(DateTime(timezone=True), nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_payments_archive_user_id_created_at", "user_id", "created_at"),
+    )
+
+class PaymentLogArchive(Base):
+    __tablename__ = "payment_logs_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    amount = Column(Float)
+    status = Column(String(50))
+    payment_id = Column(String(100))
+    created_at = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_payment_logs_archive_user_id_created_at", "user_id", "created_at"),
+    )
+
 
 class Promocode(Base):
     __tablename__ = "promocodes"
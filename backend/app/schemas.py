@@ -8,6 +8,7 @@ class JobStatus(str, Enum):
     processing = "processing"
     completed = "completed"
     failed = "failed"
+    cancelled = "cancelled"
 
 class PaymentStatus(str, Enum):
     pending = "pending"
@@ -80,6 +81,9 @@ class JobResponse(JobBase):
     id: int
     status: JobStatus
     result_path: Optional[str] = None
+    result_url: Optional[str] = None  # content-addressed /file URL of a completed result
+    preset_key: Optional[str] = None  # preset id, "custom" or "fitting"
+    workflow_type: Optional[str] = None
     error: Optional[str] = None
     retry_count: int = 0
     created_at: datetime
@@ -156,6 +160,7 @@ class PaymentHistoryResponse(BaseModel):
     total: int
     limit: int
     offset: int
+    next_cursor: Optional[int] = None  # pass as `cursor` to get the next page
 
 # YuKassa webhook schema
 class YuKassaWebhookObject(BaseModel):
@@ -0,0 +1,409 @@
+"""Job analytics: rollup tables maintained from a watermark, and reports read from them"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import desc, func, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..config import settings
+from .preset_matching import CUSTOM_PRESET_KEY, PresetMatcher, is_preset_id
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram slots; one more slot counts anything longer
+LATENCY_BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+WATERMARK = "job_rollups"
+# bucket_start of the all-time rows
+EPOCH = datetime(1970, 1, 1)
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _hour(value: datetime) -> datetime:
+    return _naive_utc(value).replace(minute=0, second=0, microsecond=0)
+
+
+def _day(value: datetime) -> datetime:
+    return _naive_utc(value).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class RollupCounts:
+    """Additive job counts of one rollup row; differences are applied to coarser buckets"""
+
+    __slots__ = ('jobs', 'completed', 'failed', 'cancelled', 'latency_sum', 'histogram')
+
+    def __init__(self):
+        self.jobs = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.latency_sum = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    @classmethod
+    def from_row(cls, row: models.JobRollup) -> "RollupCounts":
+        counts = cls()
+        counts.jobs = row.jobs
+        counts.completed = row.completed
+        counts.failed = row.failed
+        counts.cancelled = row.cancelled
+        counts.latency_sum = row.latency_sum
+        for i, value in enumerate(json.loads(row.latency_histogram or "[]")[:len(counts.histogram)]):
+            counts.histogram[i] = value
+        return counts
+
+    def add_job(self, status: models.JobStatus, latency: Optional[float]):
+        self.jobs += 1
+        if status == models.JobStatus.completed:
+            self.completed += 1
+        elif status == models.JobStatus.failed:
+            self.failed += 1
+        elif status == models.JobStatus.cancelled:
+            self.cancelled += 1
+        if latency is not None:
+            self.latency_sum += latency
+            slot = next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+            self.histogram[slot] += 1
+
+    def merge(self, other: "RollupCounts", sign: int = 1):
+        self.jobs += sign * other.jobs
+        self.completed += sign * other.completed
+        self.failed += sign * other.failed
+        self.cancelled += sign * other.cancelled
+        self.latency_sum += sign * other.latency_sum
+        self.histogram = [a + sign * b for a, b in zip(self.histogram, other.histogram)]
+
+    def minus(self, other: "RollupCounts") -> "RollupCounts":
+        delta = RollupCounts()
+        delta.merge(self)
+        delta.merge(other, sign=-1)
+        return delta
+
+    def is_zero(self) -> bool:
+        return not (self.jobs or self.completed or self.failed or self.cancelled or any(self.histogram))
+
+    def store(self, row: models.JobRollup):
+        row.jobs = self.jobs
+        row.completed = self.completed
+        row.failed = self.failed
+        row.cancelled = self.cancelled
+        row.latency_sum = self.latency_sum
+        row.latency_histogram = json.dumps(self.histogram)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the histogram slot holding the q-th latency, capped at the last bound"""
+        total = sum(self.histogram)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank:
+                break
+        return float(LATENCY_BUCKETS[min(i, len(LATENCY_BUCKETS) - 1)])
+
+    def as_dict(self) -> dict:
+        latency_count = sum(self.histogram)
+        return {
+            'jobs': self.jobs,
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'in_progress': self.jobs - self.completed - self.failed - self.cancelled,
+            'latency': {
+                'avg': round(self.latency_sum / latency_count, 1) if latency_count else None,
+                'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9),
+                'p95': self.percentile(0.95),
+            },
+        }
+
+
+async def _add_to_bucket(db: AsyncSession, granularity: str, bucket_start: datetime,
+                         dimension: str, key: str, delta: RollupCounts):
+    row = await db.scalar(
+        select(models.JobRollup).where(
+            models.JobRollup.granularity == granularity,
+            models.JobRollup.bucket_start == bucket_start,
+            models.JobRollup.dimension == dimension,
+            models.JobRollup.key == key
+        )
+    )
+    counts = RollupCounts.from_row(row) if row is not None else RollupCounts()
+    counts.merge(delta)
+    if counts.jobs <= 0:
+        if row is not None:
+            await db.delete(row)
+        return
+    if row is None:
+        row = models.JobRollup(granularity=granularity, bucket_start=bucket_start, dimension=dimension, key=key)
+        db.add(row)
+    counts.store(row)
+
+
+async def rollup_hour(db: AsyncSession, hour: datetime, matcher: PresetMatcher):
+    """Recompute the hourly rows of `hour` from its jobs and apply the difference to its day and the total.
+
+    Recomputing is idempotent, so an hour may be rolled up any number of times.
+    """
+    # The range is widened by a second and the hour checked in Python: SQLite compares
+    # datetimes as text, and CURRENT_TIMESTAMP values have no fractional part
+    # Archived jobs are read too, so recomputing an old hour keeps them counted
+    jobs = []
+    for table in (models.Job, models.JobArchive):
+        jobs.extend((await db.execute(
+            select(
+                table.user_id, table.prompt, table.preset_key, table.status,
+                table.created_at, table.updated_at
+            )
+            .where(
+                table.created_at >= hour - timedelta(seconds=1),
+                table.created_at < hour + timedelta(hours=1, seconds=1)
+            )
+        )).all())
+
+    current: Dict[Tuple[str, str], RollupCounts] = defaultdict(RollupCounts)
+    for job in jobs:
+        if _hour(job.created_at) != hour:
+            continue
+        latency = None
+        if job.status == models.JobStatus.completed and job.updated_at is not None:
+            latency = max(0.0, (_naive_utc(job.updated_at) - _naive_utc(job.created_at)).total_seconds())
+        # Jobs created before preset_key was recorded (and not yet backfilled) are matched here
+        preset_key = job.preset_key or matcher.key(job.prompt)
+        for dimension_key in (('all', ''), ('preset', preset_key), ('user', str(job.user_id))):
+            current[dimension_key].add_job(job.status, latency)
+
+    stored = {
+        (row.dimension, row.key): row
+        for row in (await db.scalars(
+            select(models.JobRollup).where(
+                models.JobRollup.granularity == 'hour',
+                models.JobRollup.bucket_start == hour
+            )
+        )).all()
+    }
+
+    for dimension, key in current.keys() | stored.keys():
+        row = stored.get((dimension, key))
+        before = RollupCounts.from_row(row) if row is not None else RollupCounts()
+        after = current.get((dimension, key)) or RollupCounts()
+        delta = after.minus(before)
+        if delta.is_zero():
+            continue
+
+        if after.jobs == 0:
+            await db.delete(row)
+        else:
+            if row is None:
+                row = models.JobRollup(granularity='hour', bucket_start=hour, dimension=dimension, key=key)
+                db.add(row)
+            after.store(row)
+
+        await _add_to_bucket(db, 'day', _day(hour), dimension, key, delta)
+        await _add_to_bucket(db, 'total', EPOCH, dimension, key, delta)
+
+
+async def refresh_rollups(db_session_factory) -> int:
+    """Roll up the hours of jobs created or changed since the watermark; returns the number of hours.
+
+    The watermark is moved to the start of the run minus ANALYTICS_ROLLUP_OVERLAP,
+    so changes committed late (batched writes) are still seen on the next run.
+    """
+    started = datetime.utcnow()
+    async with db_session_factory() as db:
+        watermark = await db.get(models.AnalyticsWatermark, WATERMARK)
+        changed = select(models.Job.created_at).where(models.Job.created_at.is_not(None))
+        if watermark is not None:
+            changed = changed.where(or_(
+                models.Job.updated_at >= watermark.value,
+                models.Job.created_at >= watermark.value
+            ))
+        hours = sorted({_hour(created_at) for created_at in (await db.scalars(changed)).all()})
+        matcher = PresetMatcher((await db.scalars(select(models.Preset))).all())
+
+    # One transaction per hour keeps a first backfill of a long history incremental too
+    for hour in hours:
+        async with db_session_factory() as db:
+            await rollup_hour(db, hour, matcher)
+            await db.commit()
+
+    async with db_session_factory() as db:
+        watermark = await db.get(models.AnalyticsWatermark, WATERMARK)
+        value = started - timedelta(seconds=settings.ANALYTICS_ROLLUP_OVERLAP)
+        if watermark is None:
+            db.add(models.AnalyticsWatermark(name=WATERMARK, value=value))
+        else:
+            watermark.value = value
+        await db.commit()
+
+    if hours:
+        logger.info(f"Analytics rollups refreshed for {len(hours)} hour(s)")
+    return len(hours)
+
+
+async def _merged_rows(db: AsyncSession, granularity: str, dimension: str,
+                       since: Optional[datetime]) -> Dict[str, RollupCounts]:
+    query = select(models.JobRollup).where(
+        models.JobRollup.granularity == granularity,
+        models.JobRollup.dimension == dimension
+    )
+    if since is not None:
+        query = query.where(models.JobRollup.bucket_start >= since)
+    merged: Dict[str, RollupCounts] = defaultdict(RollupCounts)
+    for row in (await db.scalars(query)).all():
+        merged[row.key].merge(RollupCounts.from_row(row))
+    return merged
+
+
+async def job_report(db: AsyncSession, days: Optional[int] = None, top: int = 20) -> dict:
+    """Job totals, preset usage and top users from the rollups.
+
+    `days` covers that many UTC calendar days including today (daily rows);
+    without it the all-time rows are read. The cost depends on the period
+    and the number of presets and active users, not on the job history.
+    """
+    if days:
+        granularity, since = 'day', _day(datetime.utcnow()) - timedelta(days=days - 1)
+    else:
+        granularity, since = 'total', None
+
+    totals = (await _merged_rows(db, granularity, 'all', since)).get('') or RollupCounts()
+
+    by_preset = await _merged_rows(db, granularity, 'preset', since)
+    custom = by_preset.pop(CUSTOM_PRESET_KEY, None) or RollupCounts()
+    preset_ids = [int(key) for key in by_preset if is_preset_id(key)]
+    presets = {
+        str(preset.id): preset
+        for preset in (await db.scalars(select(models.Preset).where(models.Preset.id.in_(preset_ids)))).all()
+    } if preset_ids else {}
+    preset_usage = []
+    for key, counts in sorted(by_preset.items(), key=lambda item: item[1].jobs, reverse=True):
+        preset = presets.get(key)
+        preset_usage.append({
+            'preset_key': key,
+            'preset_id': int(key) if is_preset_id(key) else None,
+            'category': preset.category if preset else None,
+            # Built-in modes (e.g. fitting) are reported under their key
+            'name': preset.name if preset else key,
+            **counts.as_dict(),
+        })
+
+    user_query = (
+        select(
+            models.JobRollup.key,
+            func.sum(models.JobRollup.jobs).label('jobs'),
+            func.sum(models.JobRollup.completed).label('completed'),
+            func.sum(models.JobRollup.failed).label('failed'),
+        )
+        .where(models.JobRollup.granularity == granularity, models.JobRollup.dimension == 'user')
+        .group_by(models.JobRollup.key)
+        .order_by(desc('jobs'))
+        .limit(top)
+    )
+    if since is not None:
+        user_query = user_query.where(models.JobRollup.bucket_start >= since)
+    user_rows = (await db.execute(user_query)).all()
+    users = {
+        user.user_id: user
+        for user in (await db.scalars(
+            select(models.User).where(models.User.user_id.in_([int(row.key) for row in user_rows]))
+        )).all()
+    } if user_rows else {}
+    top_users = []
+    for row in user_rows:
+        user = users.get(int(row.key))
+        top_users.append({
+            'user_id': int(row.key),
+            'username': user.username if user else None,
+            'telegram_id': user.telegram_id if user else None,
+            'jobs': row.jobs,
+            'completed': row.completed,
+            'failed': row.failed,
+        })
+
+    watermark = await db.get(models.AnalyticsWatermark, WATERMARK)
+    return {
+        'days': days,
+        'rolled_up_until': watermark.value if watermark else None,
+        'totals': totals.as_dict(),
+        'preset_jobs': sum(counts.jobs for counts in by_preset.values()),
+        'custom': custom.as_dict(),
+        'presets': preset_usage,
+        'users': top_users,
+    }
+
+
+class AnalyticsRollupScheduler:
+    """Refreshes the rollups every ANALYTICS_ROLLUP_INTERVAL seconds"""
+
+    def __init__(self, db_session_factory):
+        # Async session factory (AsyncSessionLocal): the refresh runs on the event loop
+        self.db_session_factory = db_session_factory
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not settings.ANALYTICS_ROLLUP_ENABLED:
+            logger.info("Analytics rollups are disabled")
+            return
+        if self.running:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._run())
+        logger.info("Analytics rollup scheduler started")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        logger.info("Analytics rollup scheduler stopped")
+
+    async def _run(self):
+        while self.running:
+            try:
+                await refresh_rollups(self.db_session_factory)
+            except asyncio.CancelledError:
+                break
+            except IntegrityError as e:
+                # Another process rolled up the same hour; the next run recomputes it
+                logger.warning(f"Analytics rollup conflict, retrying on the next run: {e}")
+            except Exception as e:
+                logger.error(f"Error refreshing analytics rollups: {e}")
+            try:
+                await asyncio.sleep(settings.ANALYTICS_ROLLUP_INTERVAL)
+            except asyncio.CancelledError:
+                break
+
+
+analytics_rollup_scheduler: Optional[AnalyticsRollupScheduler] = None
+
+
+async def start_analytics_rollups(db_session_factory) -> AnalyticsRollupScheduler:
+    global analytics_rollup_scheduler
+    analytics_rollup_scheduler = AnalyticsRollupScheduler(db_session_factory)
+    await analytics_rollup_scheduler.start()
+    return analytics_rollup_scheduler
+
+
+async def stop_analytics_rollups():
+    if analytics_rollup_scheduler is not None:
+        await analytics_rollup_scheduler.stop()
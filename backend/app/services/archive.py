@@ -0,0 +1,171 @@
+"""Archival of settled rows into cold tables, and reads that span hot and cold tables"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveTarget(NamedTuple):
+    name: str
+    model: type
+    archive_model: type
+    # Conditions selecting rows that may be archived, given the age cutoff
+    settled: Callable[[datetime], list]
+    after_days: Callable[[], int]
+
+
+TARGETS = (
+    ArchiveTarget(
+        "jobs", models.Job, models.JobArchive,
+        lambda cutoff: [
+            models.Job.status.in_([models.JobStatus.completed, models.JobStatus.failed, models.JobStatus.cancelled]),
+            models.Job.created_at < cutoff,
+        ],
+        lambda: settings.JOB_ARCHIVE_AFTER_DAYS,
+    ),
+    ArchiveTarget(
+        "payments", models.Payment, models.PaymentArchive,
+        lambda cutoff: [
+            models.Payment.status.in_([
+                models.PaymentStatus.succeeded, models.PaymentStatus.failed, models.PaymentStatus.cancelled
+            ]),
+            models.Payment.created_at < cutoff,
+        ],
+        lambda: settings.PAYMENT_ARCHIVE_AFTER_DAYS,
+    ),
+    ArchiveTarget(
+        "payment_logs", models.PaymentLog, models.PaymentLogArchive,
+        lambda cutoff: [
+            models.PaymentLog.status != "pending",
+            models.PaymentLog.created_at < cutoff,
+        ],
+        lambda: settings.PAYMENT_ARCHIVE_AFTER_DAYS,
+    ),
+)
+
+
+async def archive_chunk(db: AsyncSession, target: ArchiveTarget, cutoff: datetime, chunk_size: int) -> int:
+    """Move up to chunk_size settled rows into the archive table in one transaction; returns the count"""
+    ids = (await db.scalars(
+        select(target.model.id)
+        .where(*target.settled(cutoff))
+        .order_by(target.model.id)
+        .limit(chunk_size)
+    )).all()
+    if not ids:
+        return 0
+
+    hot = target.model.__table__
+    columns = [column.name for column in target.archive_model.__table__.columns if column.name != "archived_at"]
+    await db.execute(
+        insert(target.archive_model.__table__).from_select(
+            columns, select(*[hot.c[name] for name in columns]).where(hot.c.id.in_(ids))
+        )
+    )
+    await db.execute(delete(hot).where(hot.c.id.in_(ids)))
+    await db.commit()
+    return len(ids)
+
+
+async def archive_settled_rows(db_session_factory, chunk_size: Optional[int] = None) -> dict:
+    """Archive everything currently eligible, chunk by chunk; returns rows moved per table"""
+    chunk_size = chunk_size or settings.ARCHIVE_CHUNK_SIZE
+    moved = {}
+    for target in TARGETS:
+        cutoff = datetime.utcnow() - timedelta(days=target.after_days())
+        moved[target.name] = 0
+        while True:
+            async with db_session_factory() as db:
+                count = await archive_chunk(db, target, cutoff, chunk_size)
+            moved[target.name] += count
+            if count < chunk_size:
+                break
+            # Let other writers in between chunks
+            await asyncio.sleep(0)
+    if any(moved.values()):
+        logger.info(f"Archived settled rows: {moved}")
+    return moved
+
+
+async def get_with_archive(db: AsyncSession, model: type, archive_model: type, key: int):
+    """Row by primary key from the hot table, else from its archive"""
+    row = await db.get(model, key)
+    if row is None:
+        row = await db.get(archive_model, key)
+    return row
+
+
+def newest_first(pages: Sequence[Sequence], limit: int) -> List:
+    """Merge per-table pages, each already in (created_at DESC, id DESC) order"""
+    rows = [row for page in pages for row in page]
+    rows.sort(key=lambda row: (row.created_at or datetime.min, row.id), reverse=True)
+    return rows[:limit]
+
+
+class ArchiveScheduler:
+    """Moves settled rows to the archive tables every ARCHIVE_INTERVAL seconds"""
+
+    def __init__(self, db_session_factory):
+        # Async session factory (AsyncSessionLocal): archiving runs on the event loop
+        self.db_session_factory = db_session_factory
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not settings.ARCHIVE_ENABLED:
+            logger.info("Archiving is disabled")
+            return
+        if self.running:
+            return
+        self.running = True
+        self.task = asyncio.create_task(self._run())
+        logger.info("Archive scheduler started")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        logger.info("Archive scheduler stopped")
+
+    async def _run(self):
+        while self.running:
+            try:
+                await archive_settled_rows(self.db_session_factory)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error archiving settled rows: {e}")
+            try:
+                await asyncio.sleep(settings.ARCHIVE_INTERVAL)
+            except asyncio.CancelledError:
+                break
+
+
+archive_scheduler: Optional[ArchiveScheduler] = None
+
+
+async def start_archive_scheduler(db_session_factory) -> ArchiveScheduler:
+    global archive_scheduler
+    archive_scheduler = ArchiveScheduler(db_session_factory)
+    await archive_scheduler.start()
+    return archive_scheduler
+
+
+async def stop_archive_scheduler():
+    if archive_scheduler is not None:
+        await archive_scheduler.stop()
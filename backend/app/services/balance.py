@@ -1,180 +1,251 @@
+"""Balance engine: conditional atomic updates recorded in an append-only ledger.
+
+Every change is a single `UPDATE users SET balance = balance +/- :x ...
+RETURNING balance` (debits also require `balance >= :x`), followed by an
+insert into balance_ledger in the same transaction. Concurrent operations
+can no longer overwrite each other's result, and the common path costs one
+statement plus the ledger row. The new balance is written through to a
+short-lived Redis snapshot that serves balance reads.
+"""
+
+from typing import Optional
+
+import anyio
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ..models import User
+from ..models import BalanceLedger, User
+from ..config import settings
 from fastapi import HTTPException, status
+from .user_cache import user_cache
+from redis_client import redis_client
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _is_exempt(telegram_id: Optional[int]) -> bool:
+    """Unlimited mode and admins never pay"""
+    if getattr(settings, 'UNLIMITED_PROCESSING', False):
+        return True
+    return telegram_id in getattr(settings, 'ADMIN_IDS', [])
+
+
+def _credit_stmt(user_id: int, points: float):
+    return (
+        update(User)
+        .where(User.user_id == user_id)
+        .values(balance=User.balance + points)
+        .returning(User.balance)
+    )
+
+
+def _debit_stmt(user_id: int, points: float):
+    stmt = (
+        update(User)
+        .where(User.user_id == user_id, User.balance >= points)
+        .values(balance=User.balance - points)
+        .returning(User.balance)
+    )
+    admin_ids = getattr(settings, 'ADMIN_IDS', [])
+    if admin_ids:
+        stmt = stmt.where(User.telegram_id.notin_(admin_ids))
+    return stmt
+
+
+def _ledger_stmt(user_id: int, delta: float, balance_after: float, reason: str, reference: Optional[str]):
+    return insert(BalanceLedger).values(
+        user_id=user_id,
+        delta=delta,
+        balance_after=balance_after,
+        reason=reason[:255] if reason else reason,
+        reference=reference,
+    )
+
+
+def _balance_stmt(user_id: int):
+    return select(User.balance, User.telegram_id).where(User.user_id == user_id)
+
+
+def _not_found():
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+
+async def store_balance_snapshot(user_id: int, balance: float):
+    """Publish a committed balance change to the Redis snapshot and user cache"""
+    try:
+        await redis_client.set_balance_snapshot(user_id, balance)
+    except Exception as e:
+        logger.warning(f"Failed to store balance snapshot for user {user_id}: {e}")
+    await user_cache.invalidate(user_id)
+
+
+def _store_snapshot_from_thread(user_id: int, balance: float):
+    # Sync callers run in the threadpool; outside of it the snapshot just expires
+    try:
+        anyio.from_thread.run(store_balance_snapshot, user_id, balance)
+    except RuntimeError:
+        pass
+
+
+# Statement-level operations: they do not commit, so callers can combine them
+# with their own writes (payment rows, promocode claims) in one transaction.
+
+def apply_credit(db: Session, user_id: int, points: float, reason: str, reference: Optional[str] = None) -> float:
+    new_balance = db.scalar(_credit_stmt(user_id, points))
+    if new_balance is None:
+        raise _not_found()
+    db.execute(_ledger_stmt(user_id, points, new_balance, reason, reference))
+    return new_balance
+
+
+def apply_debit(db: Session, user_id: int, points: float, reason: str, reference: Optional[str] = None) -> float:
+    new_balance = db.scalar(_debit_stmt(user_id, points))
+    if new_balance is not None:
+        db.execute(_ledger_stmt(user_id, -points, new_balance, reason, reference))
+        return new_balance
+
+    # Only a failed debit pays for the second query: tell apart why
+    row = db.execute(_balance_stmt(user_id)).first()
+    if row is None:
+        raise _not_found()
+    if row.telegram_id in getattr(settings, 'ADMIN_IDS', []):
+        logger.info(f"Balance deduction skipped for admin {user_id}: {points} points, reason: {reason}")
+        return row.balance
+    raise HTTPException(
+        status_code=status.HTTP_402_PAYMENT_REQUIRED,
+        detail=f"Insufficient balance: {row.balance} < {points}"
+    )
+
+
+async def apply_credit_async(db: AsyncSession, user_id: int, points: float, reason: str,
+                             reference: Optional[str] = None) -> float:
+    new_balance = await db.scalar(_credit_stmt(user_id, points))
+    if new_balance is None:
+        raise _not_found()
+    await db.execute(_ledger_stmt(user_id, points, new_balance, reason, reference))
+    return new_balance
+
+
+async def apply_debit_async(db: AsyncSession, user_id: int, points: float, reason: str,
+                            reference: Optional[str] = None) -> float:
+    new_balance = await db.scalar(_debit_stmt(user_id, points))
+    if new_balance is not None:
+        await db.execute(_ledger_stmt(user_id, -points, new_balance, reason, reference))
+        return new_balance
+
+    row = (await db.execute(_balance_stmt(user_id))).first()
+    if row is None:
+        raise _not_found()
+    if row.telegram_id in getattr(settings, 'ADMIN_IDS', []):
+        logger.info(f"Balance deduction skipped for admin {user_id}: {points} points, reason: {reason}")
+        return row.balance
+    raise HTTPException(
+        status_code=status.HTTP_402_PAYMENT_REQUIRED,
+        detail=f"Insufficient balance: {row.balance} < {points}"
+    )
+
+
 def check_balance(user_id: int, required_points: float, db: Session) -> bool:
-    """Check if user has sufficient balance"""
+    """Check if user has sufficient balance (one SELECT of two columns)"""
     try:
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        # Check if unlimited processing is enabled
-        from ..config import settings
-        if getattr(settings, 'UNLIMITED_PROCESSING', False):
-            logger.info(f"Unlimited processing enabled: Balance check bypassed for user {user_id}")
-            return True
-        
-        # Check if user is admin (admins always have sufficient balance)
-        is_admin = user.telegram_id in getattr(settings, 'ADMIN_IDS', [])
-        
-        if is_admin:
-            logger.info(f"Balance check passed for admin {user_id}: admins always have sufficient balance")
+        row = db.execute(_balance_stmt(user_id)).first()
+        if row is None:
+            raise _not_found()
+
+        if _is_exempt(row.telegram_id):
+            logger.info(f"Balance check bypassed for user {user_id} (unlimited mode or admin)")
             return True
 
-        has_sufficient = user.balance >= required_points
-        logger.info(f"Balance check for user {user_id}: required={required_points}, available={user.balance}, sufficient={has_sufficient}")
+        has_sufficient = row.balance >= required_points
+        logger.info(f"Balance check for user {user_id}: required={required_points}, available={row.balance}, sufficient={has_sufficient}")
         return has_sufficient
-        
-        # Original code (commented out for testing):
-        # # Check if user is admin (admins always have sufficient balance)
-        # from ..config import settings
-        # is_admin = user.telegram_id in getattr(settings, 'ADMIN_IDS', [])
-        #
-        # if is_admin:
-        #     logger.info(f"Balance check passed for admin {user_id}: admins always have sufficient balance")
-        #     return True
-        #
-        # has_sufficient = user.balance >= required_points
-        # logger.info(f"Balance check for user {user_id}: required={required_points}, available={user.balance}, sufficient={has_sufficient}")
-        # return has_sufficient
-        
+
     except Exception as e:
         logger.error(f"Error checking balance: {e}")
         raise
 
-def deduct_balance(user_id: int, points: float, reason: str, db: Session) -> float:
+
+async def check_balance_async(user_id: int, required_points: float, db: AsyncSession) -> bool:
+    """Async variant of check_balance for AsyncSession routes"""
+    row = (await db.execute(_balance_stmt(user_id))).first()
+    if row is None:
+        raise _not_found()
+    return _is_exempt(row.telegram_id) or row.balance >= required_points
+
+
+def deduct_balance(user_id: int, points: float, reason: str, db: Session, reference: Optional[str] = None) -> float:
     """Deduct points from user balance"""
     try:
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        # Check if unlimited processing is enabled
-        from ..config import settings
         if getattr(settings, 'UNLIMITED_PROCESSING', False):
             logger.info(f"Unlimited processing enabled: Balance deduction skipped for user {user_id}: {points} points, reason: {reason}")
-            return user.balance
-
-        # Check if user is admin (admins don't pay)
-        is_admin = user.telegram_id in getattr(settings, 'ADMIN_IDS', [])
-
-        if is_admin:
-            # Admins don't pay, return current balance
-            logger.info(f"Balance deduction skipped for admin {user_id}: {points} points, reason: {reason}")
-            return user.balance
+            row = db.execute(_balance_stmt(user_id)).first()
+            if row is None:
+                raise _not_found()
+            return row.balance
 
-        if user.balance < points:
-            raise HTTPException(
-                status_code=status.HTTP_402_PAYMENT_REQUIRED,
-                detail=f"Insufficient balance: {user.balance} < {points}"
-            )
-
-        user.balance -= points
+        new_balance = apply_debit(db, user_id, points, reason, reference)
         db.commit()
-        logger.info(f"Balance deducted: user={user_id}, points={points}, reason={reason}, new_balance={user.balance}")
-        return user.balance
-        
-        # Original code (commented out for testing):
-        # # Check if user is admin (admins don't pay)
-        # from ..config import settings
-        # is_admin = user.telegram_id in getattr(settings, 'ADMIN_IDS', [])
-        #
-        # if is_admin:
-        #     # Admins don't pay, return current balance
-        #     logger.info(f"Balance deduction skipped for admin {user_id}: {points} points, reason: {reason}")
-        #     return user.balance
-        #
-        # if user.balance < points:
-        #     raise HTTPException(
-        #         status_code=status.HTTP_402_PAYMENT_REQUIRED,
-        #         detail=f"Insufficient balance: {user.balance} < {points}"
-        #     )
-        #
-        # user.balance -= points
-        # db.commit()
-        # logger.info(f"Balance deducted: user={user_id}, points={points}, reason={reason}, new_balance={user.balance}")
-        # return user.balance
-        
+        _store_snapshot_from_thread(user_id, new_balance)
+        logger.info(f"Balance deducted: user={user_id}, points={points}, reason={reason}, new_balance={new_balance}")
+        return new_balance
+
     except Exception as e:
         db.rollback()
         logger.error(f"Error deducting balance: {e}")
         raise
 
-def refund_balance(user_id: int, points: float, reason: str, db: Session) -> float:
+
+def refund_balance(user_id: int, points: float, reason: str, db: Session, reference: Optional[str] = None) -> float:
     """Refund points to user balance"""
     try:
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        # Check if unlimited processing is enabled
-        from ..config import settings
-        if getattr(settings, 'UNLIMITED_PROCESSING', False):
-            logger.info(f"Unlimited processing enabled: Balance refund skipped for user {user_id}: {points} points, reason: {reason}")
-            return user.balance
+        row = db.execute(_balance_stmt(user_id)).first()
+        if row is None:
+            raise _not_found()
 
-        # Check if user is admin (admins don't need refunds since they don't pay)
-        is_admin = user.telegram_id in getattr(settings, 'ADMIN_IDS', [])
+        # Admins and unlimited mode don't pay, so there is nothing to refund
+        if _is_exempt(row.telegram_id):
+            logger.info(f"Balance refund skipped for user {user_id} (unlimited mode or admin): {points} points, reason: {reason}")
+            return row.balance
 
-        if is_admin:
-            # Admins don't pay, so no need to refund
-            logger.info(f"Balance refund skipped for admin {user_id}: {points} points, reason: {reason}")
-            return user.balance
-
-        user.balance += points
+        new_balance = apply_credit(db, user_id, points, reason, reference)
         db.commit()
-        logger.info(f"Balance refunded: user={user_id}, points={points}, reason={reason}, new_balance={user.balance}")
-        return user.balance
-        
-        # Original code (commented out for testing):
-        # # Check if user is admin (admins don't need refunds since they don't pay)
-        # from ..config import settings
-        # is_admin = user.telegram_id in getattr(settings, 'ADMIN_IDS', [])
-        #
-        # if is_admin:
-        #     # Admins don't pay, so no need to refund
-        #     logger.info(f"Balance refund skipped for admin {user_id}: {points} points, reason: {reason}")
-        #     return user.balance
-        #
-        # user.balance += points
-        # db.commit()
-        # logger.info(f"Balance refunded: user={user_id}, points={points}, reason={reason}, new_balance={user.balance}")
-        # return user.balance
-        
+        _store_snapshot_from_thread(user_id, new_balance)
+        logger.info(f"Balance refunded: user={user_id}, points={points}, reason={reason}, new_balance={new_balance}")
+        return new_balance
+
     except Exception as e:
         db.rollback()
         logger.error(f"Error refunding balance: {e}")
         raise
 
-def add_balance(user_id: int, points: float, reason: str, db: Session) -> float:
+
+def add_balance(user_id: int, points: float, reason: str, db: Session, reference: Optional[str] = None) -> float:
     """Add points to user balance (Admin only)"""
     try:
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        user.balance += points
+        new_balance = apply_credit(db, user_id, points, reason, reference)
         db.commit()
-        logger.info(f"Balance added: user={user_id}, points={points}, reason={reason}, new_balance={user.balance}")
-        return user.balance
-        
+        _store_snapshot_from_thread(user_id, new_balance)
+        logger.info(f"Balance added: user={user_id}, points={points}, reason={reason}, new_balance={new_balance}")
+        return new_balance
+
     except Exception as e:
         db.rollback()
         logger.error(f"Error adding balance: {e}")
-        raise
\ No newline at end of file
+        raise
+
+
+async def get_balance_snapshot(user_id: int, db: AsyncSession) -> Optional[float]:
+    """Balance from the Redis snapshot, falling back to one SELECT"""
+    try:
+        cached = await redis_client.get_balance_snapshot(user_id)
+    except Exception as e:
+        logger.warning(f"Balance snapshot unavailable: {e}")
+        cached = None
+    if cached is not None:
+        return cached
+
+    balance = await db.scalar(select(User.balance).where(User.user_id == user_id))
+    if balance is not None:
+        await store_balance_snapshot(user_id, balance)
+    return balance
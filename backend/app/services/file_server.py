@@ -0,0 +1,211 @@
+"""File serving with precomputed roots, zero-copy sends, Range and cache validators"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import stat
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+import anyio
+from fastapi import HTTPException, Request, status
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from ..config import settings
+from ..utils.http_cache import etag_matches
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Names produced by save_upload(): <prefix>_<32 hex of the SHA-256>.<ext>
+CONTENT_ADDRESSED_NAME = re.compile(r"^[a-z]+_[0-9a-f]{32}\.[a-z0-9]+$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRangeResponse(Response):
+    """Sends a whole file or one byte range of it.
+
+    Uses the ASGI zero-copy extension (os.sendfile) when the server offers
+    it, `http.response.pathsend` for whole files, and chunked reads in a
+    worker thread otherwise.
+    """
+
+    def __init__(self, path: Path, st: os.stat_result, status_code: int, headers: dict,
+                 start: int = 0, length: Optional[int] = None, media_type: Optional[str] = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.length = st.st_size - start if length is None else length
+        self.headers["content-length"] = str(self.length)
+        self.whole_file = start == 0 and self.length == st.st_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+        if self.whole_file and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+
+        remaining = self.length
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(settings.FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank underneath us; end the body rather than hang the client
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class FileServer:
+    """Serves files from a fixed set of allowed roots resolved once at startup"""
+
+    def __init__(self):
+        self.roots: Tuple[str, ...] = ()
+        self._digests: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+
+    def configure(self):
+        roots = []
+        for allowed_dir in (
+            getattr(settings, 'COMFY_INPUT_DIR', None),
+            getattr(settings, 'COMFY_OUTPUT_DIR', None),
+            getattr(settings, 'UPLOADS_DIR', None),
+            './results'
+        ):
+            if allowed_dir:
+                roots.append(os.path.realpath(allowed_dir))
+        self.roots = tuple(roots)
+        logger.info(f"File server roots: {', '.join(self.roots)}")
+
+    def resolve(self, file_path: str) -> Tuple[Path, os.stat_result]:
+        """Map a request path to an allowed regular file with one realpath and one stat"""
+        if not self.roots:
+            self.configure()
+        real = os.path.realpath(file_path)
+        if not any(real == root or real.startswith(root + os.sep) for root in self.roots):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access to this file is not allowed")
+        try:
+            st = os.stat(real)
+        except (FileNotFoundError, NotADirectoryError):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+        if not stat.S_ISREG(st.st_mode):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+        return Path(real), st
+
+    def content_digest(self, path: Path, st: os.stat_result) -> str:
+        """SHA-256 prefix of the file, memoised by (path, mtime, size)"""
+        key = (str(path), st.st_mtime_ns, st.st_size)
+        digest = self._digests.get(key)
+        if digest is not None:
+            self._digests.move_to_end(key)
+            return digest
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(settings.FILE_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()[:32]
+        self._digests[key] = digest
+        while len(self._digests) > settings.FILE_DIGEST_CACHE_SIZE:
+            self._digests.popitem(last=False)
+        return digest
+
+    def immutable_url(self, file_path: Optional[str]) -> Optional[str]:
+        """Content-addressed URL of an allowed file, or None if it cannot be served"""
+        if not file_path:
+            return None
+        try:
+            path, st = self.resolve(file_path)
+            digest = self.content_digest(path, st)
+        except (HTTPException, OSError):
+            return None
+        # Absolute paths keep their leading slash (//srv/...): the route takes the path as given
+        return f"/file/immutable/{digest}/{file_path}"
+
+    def _not_modified(self, request: Request, etag: str, st: os.stat_result) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(st.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _byte_range(self, request: Request, etag: str, size: int) -> Optional[Tuple[int, int]]:
+        """(start, length) for a satisfiable single range, None for the whole file"""
+        header = request.headers.get("range")
+        if not header:
+            return None
+        if_range = request.headers.get("if-range")
+        if if_range and if_range.strip() != etag:
+            return None
+        match = _RANGE.match(header.strip())
+        if not match or match.group(1) == match.group(2) == "":
+            # Multiple or malformed ranges: sending the whole file is always allowed
+            return None
+        first, last = match.groups()
+        if first == "":
+            length = min(int(last), size)
+            start = size - length
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            length = end - start + 1
+        if start >= size or length <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail="Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+        return start, length
+
+    def serve(self, request: Request, path: Path, st: os.stat_result, immutable: bool = False) -> Response:
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        immutable = immutable or bool(CONTENT_ADDRESSED_NAME.match(path.name))
+        headers = {
+            "etag": etag,
+            "last-modified": formatdate(st.st_mtime, usegmt=True),
+            "accept-ranges": "bytes",
+            "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else "no-cache",
+        }
+        if self._not_modified(request, etag, st):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        media_type = _media_type(path)
+        byte_range = self._byte_range(request, etag, st.st_size)
+        if byte_range is None:
+            return FileRangeResponse(path, st, status.HTTP_200_OK, headers, media_type=media_type)
+        start, length = byte_range
+        headers["content-range"] = f"bytes {start}-{start + length - 1}/{st.st_size}"
+        return FileRangeResponse(path, st, status.HTTP_206_PARTIAL_CONTENT, headers, start, length, media_type)
+
+
+def _media_type(path: Path) -> str:
+    return mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+
+file_server = FileServer()
@@ -0,0 +1,125 @@
+"""Job state in Redis: the per-job state hash and pub/sub of transitions"""
+
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import anyio
+
+from .. import models, schemas
+from .file_server import file_server
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {
+    schemas.JobStatus.completed.value,
+    schemas.JobStatus.failed.value,
+    schemas.JobStatus.cancelled.value,
+}
+
+
+def job_response(job: models.Job) -> schemas.JobResponse:
+    """Job as returned by the API, with result_url for completed jobs"""
+    response = schemas.JobResponse.model_validate(job)
+    if job.status == models.JobStatus.completed:
+        response.result_url = file_server.immutable_url(job.result_path)
+    return response
+
+
+async def job_response_async(job: models.Job) -> schemas.JobResponse:
+    """job_response() for the event loop: the result file is stat'ed and hashed in a thread"""
+    response = schemas.JobResponse.model_validate(job)
+    if job.status == models.JobStatus.completed:
+        response.result_url = await anyio.to_thread.run_sync(file_server.immutable_url, job.result_path)
+    return response
+
+
+# JobResponse fields mirrored into the state hash; the worker writes its own
+# progress under "worker_" names, so these only ever hold a committed state
+_STATE_FIELDS = tuple(schemas.JobResponse.model_fields)
+
+
+async def publish_job_state(job_id: int, payload: str):
+    """Send a serialised job state to everyone waiting on the job"""
+    try:
+        await redis_client.publish_job_event(job_id, payload)
+    except Exception as e:
+        logger.warning(f"Failed to publish status of job {job_id}: {e}")
+
+
+async def store_job_state(state: schemas.JobResponse) -> str:
+    """Mirror a committed job state into its Redis hash; returns the JSON payload"""
+    payload = state.model_dump_json()
+    values = json.loads(payload)
+    try:
+        await redis_client.set_job_state(state.id, {name: values.get(name) for name in _STATE_FIELDS})
+    except Exception as e:
+        logger.warning(f"Failed to store state of job {state.id}: {e}")
+    return payload
+
+
+async def record_job_state(state: schemas.JobResponse):
+    """Store a committed job state and announce it to waiting clients"""
+    await publish_job_state(state.id, await store_job_state(state))
+
+
+async def publish_job_event(job: models.Job):
+    await record_job_state(await job_response_async(job))
+
+
+async def load_job_state(job_id: int) -> Optional[schemas.JobResponse]:
+    """Job state from Redis, or None if it is not mirrored there (then read the DB)"""
+    try:
+        values = await redis_client.get_job_state(job_id)
+    except Exception as e:
+        logger.debug(f"Job state of {job_id} unavailable in Redis: {e}")
+        return None
+    # Only a hash written by record_job_state carries the full response
+    if 'created_at' not in values or 'user_id' not in values:
+        return None
+    return schemas.JobResponse.model_validate({name: values[name] for name in _STATE_FIELDS if name in values})
+
+
+class JobSubscription:
+    """Transitions of one job, read from a Redis pub/sub channel"""
+
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def next_event(self, timeout: float) -> Optional[dict]:
+        """The next published state, or None if nothing arrived within `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = await self.pubsub.get_message(timeout=remaining)
+            if message and message.get("type") == "message":
+                return json.loads(message["data"])
+
+
+@asynccontextmanager
+async def subscribe_job(job_id: int) -> AsyncIterator[Optional[JobSubscription]]:
+    """Subscribe before reading the job from the DB so no transition is missed.
+
+    Yields None when Redis is unavailable; callers then answer with the
+    current state only.
+    """
+    try:
+        pubsub = await redis_client.subscribe_job_events(job_id)
+    except Exception as e:
+        logger.warning(f"Job events unavailable for job {job_id}: {e}")
+        yield None
+        return
+
+    try:
+        yield JobSubscription(pubsub)
+    finally:
+        try:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+        except Exception:
+            pass
@@ -1,20 +1,36 @@
 """Payment service for handling payment logic"""
 
+import json
 import logging
 from datetime import datetime
-from typing import Optional, List
-from sqlalchemy.orm import Session
+from typing import NamedTuple, Optional, List
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from .. import models, schemas
 from ..config import settings
 from .yukassa import YuKassaClient
+from .balance import apply_credit_async, store_balance_snapshot
+from fastapi import HTTPException
+from ..utils.pagination import TotalCache, keyset_before
+from .archive import get_with_archive, newest_first
 
 logger = logging.getLogger(__name__)
 
+# Cached per-user payment counts for history pages (invalidated on writes)
+payment_totals = TotalCache()
+
+
+class WebhookResult(NamedTuple):
+    payment_id: int
+    user_id: int
+    credited_points: int  # 0 unless this call credited the balance
+    new_balance: Optional[float]
+
 
 class PaymentService:
     """Business logic for payments"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
         self.yukassa_client = YuKassaClient() if settings.YUKASSA_SHOP_ID else None
     
@@ -31,9 +47,9 @@ class PaymentService:
             Payment object with confirmation_url
         """
         # Validate user exists
-        user = self.db.query(models.User).filter(
-            models.User.user_id == user_id
-        ).first()
+        user = await self.db.scalar(
+            select(models.User).where(models.User.user_id == user_id)
+        )
         
         if not user:
             logger.warning(f"Payment creation failed: User {user_id} not found")
@@ -77,14 +93,16 @@ class PaymentService:
         )
         
         self.db.add(payment)
-        self.db.commit()
-        self.db.refresh(payment)
+        await self.db.commit()
+        await self.db.refresh(payment)
+        payment_totals.invalidate(user_id)
         
         logger.info(f"Payment created successfully: payment_id={payment.id}, user_id={user_id}, yukassa_payment_id={payment.yukassa_payment_id}, amount={amount} rubles, status=pending")
         
         return payment
     
-    async def handle_webhook(self, yukassa_payment_id: str, status: str, payment_method_details: Optional[dict] = None) -> bool:
+    async def handle_webhook(self, yukassa_payment_id: str, status: str,
+                             payment_method_details: Optional[dict] = None) -> Optional[WebhookResult]:
         """
         Handle webhook from YuKassa
         
@@ -94,24 +112,25 @@ class PaymentService:
             payment_method_details: Optional details about payment method (e.g. SBP ID)
             
         Returns:
-            True if webhook was processed successfully
+            WebhookResult, or None if the payment is unknown. The balance is
+            credited only by the call that moves the payment to succeeded,
+            so a repeated "succeeded" notification credits nothing.
         """
         logger.info(f"Processing YuKassa webhook: yukassa_payment_id={yukassa_payment_id}, status={status}")
         
         # Find payment in database
-        payment = self.db.query(models.Payment).filter(
-            models.Payment.yukassa_payment_id == yukassa_payment_id
-        ).first()
+        payment = await self.db.scalar(
+            select(models.Payment).where(models.Payment.yukassa_payment_id == yukassa_payment_id)
+        )
         
         if not payment:
             logger.warning(f"Webhook processing failed: Payment not found for YuKassa ID: {yukassa_payment_id}")
-            return False
+            return None
         
         logger.info(f"Found payment: payment_id={payment.id}, user_id={payment.user_id}, current_status={payment.status}")
         
         # Save payment method details if provided
         if payment_method_details:
-            import json
             payment.payment_method_details = json.dumps(payment_method_details)
             # Update payment method if it was unknown
             if "type" in payment_method_details:
@@ -121,30 +140,41 @@ class PaymentService:
                     payment.payment_method = "card"
         
         # Update status
+        points = 0
+        new_balance = None
         if status == "succeeded":
-            payment.status = models.PaymentStatus.succeeded
-            payment.paid_at = datetime.now()
-            
-            # Credit points to user
-            user = self.db.query(models.User).filter(
-                models.User.user_id == payment.user_id
-            ).first()
-            
-            if user:
+            # Conditional transition: of two concurrent deliveries only one credits
+            transitioned = await self.db.execute(
+                update(models.Payment)
+                .where(
+                    models.Payment.id == payment.id,
+                    models.Payment.status != models.PaymentStatus.succeeded
+                )
+                .values(status=models.PaymentStatus.succeeded, paid_at=datetime.now())
+            )
+            if transitioned.rowcount == 0:
+                logger.info(f"Payment {payment.id} already succeeded, nothing credited")
+            else:
                 # Convert kopeks to points (1 ruble = 100 points)
                 points = (payment.amount // 100) * settings.POINTS_PER_RUBLE
-                user.balance += points
+                try:
+                    new_balance = await apply_credit_async(
+                        self.db, payment.user_id, points, "Payment", f"payment:{payment.id}"
+                    )
+                except HTTPException:
+                    logger.warning(f"Payment {payment.id}: user {payment.user_id} not found, nothing credited")
                 
-                # Create payment log entry
-                payment_log = models.PaymentLog(
-                    user_id=payment.user_id,
-                    amount=float(points),
-                    status="completed",
-                    payment_id=str(payment.id)
-                )
-                self.db.add(payment_log)
-                
-                logger.info(f"Payment succeeded: payment_id={payment.id}, user_id={payment.user_id}, amount={payment.amount} kopeks, credited {points} points, new_balance={user.balance}")
+                if new_balance is not None:
+                    # Create payment log entry
+                    payment_log = models.PaymentLog(
+                        user_id=payment.user_id,
+                        amount=float(points),
+                        status="completed",
+                        payment_id=str(payment.id)
+                    )
+                    self.db.add(payment_log)
+                    
+                    logger.info(f"Payment succeeded: payment_id={payment.id}, user_id={payment.user_id}, amount={payment.amount} kopeks, credited {points} points, new_balance={new_balance}")
                 
         elif status == "failed":
             payment.status = models.PaymentStatus.failed
@@ -154,11 +184,14 @@ class PaymentService:
             logger.info(f"Payment cancelled: payment_id={payment.id}, user_id={payment.user_id}, yukassa_payment_id={yukassa_payment_id}")
         
         payment.updated_at = datetime.now()
-        self.db.commit()
+        await self.db.commit()
+        payment_totals.invalidate(payment.user_id)
+        if new_balance is not None:
+            await store_balance_snapshot(payment.user_id, new_balance)
         
         logger.info(f"Webhook processed successfully: payment_id={payment.id}, new_status={payment.status}")
         
-        return True
+        return WebhookResult(payment.id, payment.user_id, points if new_balance is not None else 0, new_balance)
     
     async def refund_payment(self, user_id: int, amount: int, reason: str) -> models.Payment:
         """
@@ -174,15 +207,6 @@ class PaymentService:
         """
         logger.info(f"Creating refund for user {user_id}: amount={amount} points, reason={reason}")
         
-        # Validate user exists
-        user = self.db.query(models.User).filter(
-            models.User.user_id == user_id
-        ).first()
-        
-        if not user:
-            logger.warning(f"Refund failed: User {user_id} not found")
-            raise ValueError(f"User {user_id} not found")
-        
         # Create refund payment
         payment = models.Payment(
             user_id=user_id,
@@ -195,8 +219,13 @@ class PaymentService:
             paid_at=datetime.now()
         )
         
-        # Credit points to user
-        user.balance += amount
+        # Credit points to user; also validates that the user exists
+        try:
+            new_balance = await apply_credit_async(self.db, user_id, amount, f"Refund: {reason}", "refund")
+        except HTTPException:
+            await self.db.rollback()
+            logger.warning(f"Refund failed: User {user_id} not found")
+            raise ValueError(f"User {user_id} not found")
         
         # Create payment log entry
         payment_log = models.PaymentLog(
@@ -207,66 +236,89 @@ class PaymentService:
         )
         self.db.add(payment_log)
         self.db.add(payment)
-        self.db.commit()
-        self.db.refresh(payment)
+        await self.db.commit()
+        await self.db.refresh(payment)
+        payment_totals.invalidate(user_id)
+        await store_balance_snapshot(user_id, new_balance)
         
-        logger.info(f"Refund created successfully: payment_id={payment.id}, user_id={user_id}, amount={amount} points, reason={reason}, new_balance={user.balance}")
+        logger.info(f"Refund created successfully: payment_id={payment.id}, user_id={user_id}, amount={amount} points, reason={reason}, new_balance={new_balance}")
         
         return payment
     
     async def get_payment(self, payment_id: int) -> Optional[models.Payment]:
         """
-        Get payment by ID
+        Get payment by ID, archived payments included
         
         Args:
             payment_id: Payment ID
             
         Returns:
-            Payment object or None
+            Payment (or PaymentArchive) object or None
         """
-        return self.db.query(models.Payment).filter(
-            models.Payment.id == payment_id
-        ).first()
+        return await get_with_archive(self.db, models.Payment, models.PaymentArchive, payment_id)
     
     async def get_user_payments(
         self,
         user_id: int,
         limit: int = 20,
         offset: int = 0,
-        status: Optional[str] = None
+        status: Optional[str] = None,
+        cursor: Optional[int] = None
     ) -> schemas.PaymentHistoryResponse:
         """
-        Get payment history for a user
+        Get payment history for a user, archived payments included
         
         Args:
             user_id: User ID
             limit: Maximum number of payments to return
-            offset: Offset for pagination
+            offset: Offset for pagination (ignored when cursor is given)
             status: Filter by payment status (optional)
+            cursor: Id of the last payment of the previous page (keyset pagination)
             
         Returns:
             PaymentHistoryResponse with payments list and metadata
         """
-        query = self.db.query(models.Payment).filter(
-            models.Payment.user_id == user_id
-        )
-        
-        if status:
-            query = query.filter(models.Payment.status == status)
-        
-        # Get total count
-        total = query.count()
-        
-        # Get payments with pagination
-        payments = query.order_by(
-            models.Payment.created_at.desc()
-        ).offset(offset).limit(limit).all()
+        limit = min(limit, settings.HISTORY_MAX_PAGE_SIZE)
+        if cursor is not None:
+            offset = 0
+        
+        # Each table yields its newest offset + limit + 1 rows; the merged page
+        # keeps one extra row to know whether another page exists
+        tables = (models.Payment, models.PaymentArchive)
+        pages = []
+        for table in tables:
+            query = select(table).where(table.user_id == user_id)
+            if status:
+                query = query.where(table.status == status)
+            if cursor is not None:
+                query = query.where(keyset_before(table, cursor, tables))
+            query = query.order_by(table.created_at.desc(), table.id.desc())
+            pages.append((await self.db.scalars(query.limit(offset + limit + 1))).all())
+        payments = newest_first(pages, offset + limit + 1)[offset:]
+        has_more = len(payments) > limit
+        payments = payments[:limit]
+        
+        # Total: exact for a first page that holds everything, otherwise cached count
+        if cursor is None and not offset and not has_more:
+            total = len(payments)
+            payment_totals.set(user_id, total, status)
+        else:
+            total = payment_totals.get(user_id, status)
+            if total is None:
+                total = 0
+                for table in tables:
+                    count_query = select(func.count()).select_from(table).where(table.user_id == user_id)
+                    if status:
+                        count_query = count_query.where(table.status == status)
+                    total += await self.db.scalar(count_query)
+                payment_totals.set(user_id, total, status)
         
         return schemas.PaymentHistoryResponse(
             payments=payments,
             total=total,
             limit=limit,
-            offset=offset
+            offset=offset,
+            next_cursor=payments[-1].id if has_more else None
         )
     
     async def issue_weekly_bonus(self, user_id: int, amount: int = None) -> models.Payment:
@@ -285,15 +337,6 @@ class PaymentService:
         
         logger.info(f"Issuing weekly bonus to user {user_id}: amount={amount} points")
         
-        # Validate user exists
-        user = self.db.query(models.User).filter(
-            models.User.user_id == user_id
-        ).first()
-        
-        if not user:
-            logger.warning(f"Weekly bonus failed: User {user_id} not found")
-            raise ValueError(f"User {user_id} not found")
-        
         # Create weekly bonus payment
         payment = models.Payment(
             user_id=user_id,
@@ -306,8 +349,13 @@ class PaymentService:
             paid_at=datetime.now()
         )
         
-        # Credit points to user
-        user.balance += amount
+        # Credit points to user; also validates that the user exists
+        try:
+            new_balance = await apply_credit_async(self.db, user_id, amount, "Еженедельный бонус", "weekly_bonus")
+        except HTTPException:
+            await self.db.rollback()
+            logger.warning(f"Weekly bonus failed: User {user_id} not found")
+            raise ValueError(f"User {user_id} not found")
         
         # Create payment log entry
         payment_log = models.PaymentLog(
@@ -318,9 +366,11 @@ class PaymentService:
         )
         self.db.add(payment_log)
         self.db.add(payment)
-        self.db.commit()
-        self.db.refresh(payment)
+        await self.db.commit()
+        await self.db.refresh(payment)
+        payment_totals.invalidate(user_id)
+        await store_balance_snapshot(user_id, new_balance)
         
-        logger.info(f"Weekly bonus issued successfully: payment_id={payment.id}, user_id={user_id}, amount={amount} points, new_balance={user.balance}")
+        logger.info(f"Weekly bonus issued successfully: payment_id={payment.id}, user_id={user_id}, amount={amount} points, new_balance={new_balance}")
         
         return payment
@@ -0,0 +1,192 @@
+"""Background processing of recorded YuKassa webhook events"""
+
+import asyncio
+import json
+import logging
+from typing import List, Optional, Set
+
+import httpx
+from sqlalchemy import func, select, update
+
+from .. import models
+from ..config import settings
+from .payment_service import PaymentService, WebhookResult
+from .telegram_client import TelegramClient
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentWebhookQueue:
+    """Processes payment_webhook_events rows outside of the webhook request.
+
+    The webhook only inserts the event (the unique (payment id, status) key
+    turns a redelivery into a failed insert) and submits its id here. A
+    consumer claims the row with a conditional UPDATE in the same
+    transaction as the payment change, so an event takes effect at most
+    once even when it is picked up twice. Rows left unprocessed by a crash
+    or a failed attempt are resubmitted by a periodic sweep, up to
+    PAYMENT_WEBHOOK_MAX_ATTEMPTS times. User notifications are sent by the
+    consumers over one shared HTTP connection pool.
+    """
+
+    def __init__(self, db_session_factory):
+        # Async session factory (AsyncSessionLocal): consumers run on the event loop
+        self.db_session_factory = db_session_factory
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.running = False
+        self.tasks: List[asyncio.Task] = []
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self.telegram: Optional[TelegramClient] = None
+        self._queued: Set[int] = set()
+
+    async def start(self):
+        if self.running:
+            return
+        self.http_client = httpx.AsyncClient(timeout=10, verify=False)
+        self.telegram = TelegramClient(http_client=self.http_client)
+        self.running = True
+        self.tasks = [asyncio.create_task(self._consume()) for _ in range(settings.PAYMENT_WEBHOOK_CONSUMERS)]
+        self.tasks.append(asyncio.create_task(self._sweep()))
+        logger.info(f"Payment webhook consumers started: {settings.PAYMENT_WEBHOOK_CONSUMERS}")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.http_client.aclose()
+        logger.info("Payment webhook consumers stopped")
+
+    def submit(self, event_id: int):
+        if event_id not in self._queued:
+            self._queued.add(event_id)
+            self.queue.put_nowait(event_id)
+
+    async def _sweep(self):
+        """Resubmit unprocessed events: at startup, then every PAYMENT_WEBHOOK_SWEEP_INTERVAL"""
+        while self.running:
+            try:
+                async with self.db_session_factory() as db:
+                    event_ids = (await db.scalars(
+                        select(models.PaymentWebhookEvent.id)
+                        .where(
+                            models.PaymentWebhookEvent.processed_at.is_(None),
+                            models.PaymentWebhookEvent.attempts < settings.PAYMENT_WEBHOOK_MAX_ATTEMPTS
+                        )
+                        .order_by(models.PaymentWebhookEvent.id)
+                        .limit(500)
+                    )).all()
+                if event_ids:
+                    logger.info(f"Resubmitting {len(event_ids)} unprocessed payment webhook events")
+                for event_id in event_ids:
+                    self.submit(event_id)
+                await asyncio.sleep(settings.PAYMENT_WEBHOOK_SWEEP_INTERVAL)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Payment webhook sweep failed: {e}")
+                await asyncio.sleep(settings.PAYMENT_WEBHOOK_SWEEP_INTERVAL)
+
+    async def _consume(self):
+        while self.running:
+            try:
+                event_id = await self.queue.get()
+            except asyncio.CancelledError:
+                break
+            self._queued.discard(event_id)
+            try:
+                result = await self.process(event_id)
+                if result is not None and result.credited_points:
+                    await self.notify(result)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.exception(f"Payment webhook event {event_id} failed: {e}")
+                await self._record_failure(event_id)
+
+    async def process(self, event_id: int) -> Optional[WebhookResult]:
+        async with self.db_session_factory() as db:
+            claimed = (await db.execute(
+                update(models.PaymentWebhookEvent)
+                .where(
+                    models.PaymentWebhookEvent.id == event_id,
+                    models.PaymentWebhookEvent.processed_at.is_(None)
+                )
+                .values(processed_at=func.now())
+                .returning(
+                    models.PaymentWebhookEvent.yukassa_payment_id,
+                    models.PaymentWebhookEvent.status,
+                    models.PaymentWebhookEvent.payload
+                )
+            )).first()
+            if claimed is None:
+                # Already handled by another consumer or process
+                return None
+
+            payload = json.loads(claimed.payload)
+            # Commits the claim together with the payment change
+            result = await PaymentService(db).handle_webhook(
+                yukassa_payment_id=claimed.yukassa_payment_id,
+                status=claimed.status,
+                payment_method_details=payload.get("payment_method")
+            )
+            if result is None:
+                # Unknown payment: nothing to retry
+                await db.commit()
+            return result
+
+    async def _record_failure(self, event_id: int):
+        try:
+            async with self.db_session_factory() as db:
+                await db.execute(
+                    update(models.PaymentWebhookEvent)
+                    .where(models.PaymentWebhookEvent.id == event_id)
+                    .values(attempts=models.PaymentWebhookEvent.attempts + 1)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to record attempt of payment webhook event {event_id}: {e}")
+
+    async def notify(self, result: WebhookResult):
+        """Tell the user about the credited payment"""
+        async with self.db_session_factory() as db:
+            telegram_id = await db.scalar(
+                select(models.User.telegram_id).where(models.User.user_id == result.user_id)
+            )
+        if telegram_id is None:
+            return
+
+        sent = await self.telegram.send_message(
+            chat_id=telegram_id,
+            text=f"✅ Платёж успешен!\n\n💰 Пополнено: {result.credited_points} баллов\n💳 Баланс: {int(result.new_balance)} баллов\n\nСпасибо за использование QwenEditBot! 🎉",
+        )
+        if sent.get("ok"):
+            logger.info(f"Notification sent to user {result.user_id} about successful payment")
+        else:
+            logger.error(f"Failed to send Telegram notification to user {result.user_id}: {sent.get('error')}")
+
+
+payment_webhook_queue: Optional[PaymentWebhookQueue] = None
+
+
+async def start_payment_webhook_queue(db_session_factory) -> PaymentWebhookQueue:
+    global payment_webhook_queue
+    payment_webhook_queue = PaymentWebhookQueue(db_session_factory)
+    await payment_webhook_queue.start()
+    return payment_webhook_queue
+
+
+async def stop_payment_webhook_queue():
+    if payment_webhook_queue is not None:
+        await payment_webhook_queue.stop()
+
+
+def submit_payment_webhook_event(event_id: int) -> bool:
+    """Hand a recorded event to the consumers; False if they are not running (the sweep picks it up)"""
+    if payment_webhook_queue is None or not payment_webhook_queue.running:
+        return False
+    payment_webhook_queue.submit(event_id)
+    return True
@@ -0,0 +1,110 @@
+"""In-process, versioned cache of the preset catalog"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
+
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+
+from .. import models, schemas
+from ..config import settings
+from ..utils.http_cache import strong_etag
+from .preset_matching import PresetMatcher
+
+logger = logging.getLogger(__name__)
+
+_preset_list = TypeAdapter(List[schemas.PresetResponse])
+
+
+class CatalogEntry(NamedTuple):
+    etag: str
+    body: bytes
+
+
+class PresetCatalog:
+    """Serialised preset responses, built once per catalog version.
+
+    Every variant (full list, per-category list, single preset) is stored as
+    ready JSON bytes with a strong ETag, so a request costs no query and no
+    serialisation, and a matching If-None-Match costs nothing at all. The
+    prompt-to-preset matcher used when jobs are created is built alongside.
+    Preset writes call invalidate(); PRESET_CATALOG_TTL bounds staleness when
+    another process changed the table.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._built_at = 0.0
+        self._lists: Dict[Optional[str], CatalogEntry] = {}
+        self._items: Dict[int, CatalogEntry] = {}
+        self._matcher = PresetMatcher([])
+        self._lock = threading.Lock()
+        # Bumped by invalidate(); the catalog is stale until a build that started
+        # after the last bump has finished
+        self._generation = 1
+        self._built_generation = 0
+
+    def _entry(self, body: bytes) -> CatalogEntry:
+        return CatalogEntry(strong_etag(body), body)
+
+    @property
+    def _stale(self) -> bool:
+        return self._built_generation != self._generation
+
+    def _build(self, db: Session):
+        # Captured before the query: an invalidate() landing while the table is
+        # read keeps the catalog stale
+        generation = self._generation
+        presets = db.query(models.Preset).order_by(models.Preset.order_index).all()
+        responses = [schemas.PresetResponse.model_validate(preset) for preset in presets]
+
+        by_category = defaultdict(list)
+        for response in responses:
+            by_category[response.category].append(response)
+
+        self._lists = {None: self._entry(_preset_list.dump_json(responses))}
+        for category, items in by_category.items():
+            self._lists[category] = self._entry(_preset_list.dump_json(items))
+        self._items = {response.id: self._entry(response.model_dump_json().encode()) for response in responses}
+        self._matcher = PresetMatcher(presets)
+
+        self.version += 1
+        self._built_at = time.monotonic()
+        self._built_generation = generation
+        logger.info(f"Preset catalog v{self.version} built: {len(responses)} presets, {len(by_category)} categories")
+
+    def _ensure_fresh(self, db: Session):
+        expired = time.monotonic() - self._built_at > settings.PRESET_CATALOG_TTL
+        if not (self._stale or expired):
+            return
+        with self._lock:
+            expired = time.monotonic() - self._built_at > settings.PRESET_CATALOG_TTL
+            if self._stale or expired:
+                self._build(db)
+
+    def get_list(self, db: Session, category: Optional[str] = None) -> CatalogEntry:
+        self._ensure_fresh(db)
+        entry = self._lists.get(category)
+        if entry is None:
+            # Unknown category: an empty list, like the unfiltered query returned
+            entry = self._entry(b"[]")
+        return entry
+
+    def get_item(self, db: Session, preset_id: int) -> Optional[CatalogEntry]:
+        self._ensure_fresh(db)
+        return self._items.get(preset_id)
+
+    def get_matcher(self, db: Session) -> PresetMatcher:
+        """Prompt-to-preset matcher of the current catalog version"""
+        self._ensure_fresh(db)
+        return self._matcher
+
+    def invalidate(self):
+        """Rebuild on the next read; called after every preset write"""
+        self._generation += 1
+
+
+preset_catalog = PresetCatalog()
@@ -0,0 +1,136 @@
+"""Which preset a job prompt came from: a normalised-prompt hash map plus an Aho-Corasick automaton"""
+
+import re
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from .. import models
+
+# preset_key of jobs: the preset id as a string, or one of these
+CUSTOM_PRESET_KEY = "custom"
+FITTING_PRESET_KEY = "fitting"
+DEFAULT_WORKFLOW_TYPE = "qwen_edit_2511"
+
+_whitespace = re.compile(r"\s+")
+_preset_id = re.compile(r"[0-9]+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case-folded, with runs of whitespace collapsed to one space"""
+    return _whitespace.sub(" ", prompt).strip().casefold()
+
+
+def is_preset_id(key: Optional[str]) -> bool:
+    """Whether a preset_key is a preset id (ASCII digits only)"""
+    return bool(key) and _preset_id.fullmatch(key) is not None
+
+
+class PresetIdentity(NamedTuple):
+    preset_key: str
+    workflow_type: str
+
+
+class _Automaton:
+    """Aho-Corasick automaton over the normalised preset prompts.
+
+    One pass over a prompt finds every preset prompt it contains, however
+    many presets there are.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # Pattern indices ending at each state, including those reached through fail links
+        self.out: List[List[int]] = [[]]
+
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                nxt = self.goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def find(self, text: str) -> List[int]:
+        """Indices of the patterns occurring in text"""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            found.update(self.out[state])
+        return list(found)
+
+
+class PresetMatcher:
+    """Attributes a job prompt to a preset.
+
+    A prompt equal to a preset prompt (after normalisation) is found in the
+    hash map; otherwise the longest preset prompt contained in it wins, ties
+    going to the lower preset id.
+    """
+
+    def __init__(self, presets: Iterable[models.Preset]):
+        self.presets: List[models.Preset] = []
+        self.by_id: Dict[int, models.Preset] = {}
+        self.by_prompt: Dict[str, models.Preset] = {}
+        patterns = []
+        for preset in sorted(presets, key=lambda p: p.id):
+            self.by_id[preset.id] = preset
+            normalized = normalize_prompt(preset.prompt or "")
+            if not normalized:
+                continue
+            self.presets.append(preset)
+            self.by_prompt.setdefault(normalized, preset)
+            patterns.append(normalized)
+        self.automaton = _Automaton(patterns)
+
+    def match(self, prompt: Optional[str]) -> Optional[models.Preset]:
+        if not prompt:
+            return None
+        normalized = normalize_prompt(prompt)
+        preset = self.by_prompt.get(normalized)
+        if preset is not None:
+            return preset
+        found = [self.presets[i] for i in self.automaton.find(normalized)]
+        if not found:
+            return None
+        return min(found, key=lambda p: (-len(normalize_prompt(p.prompt)), p.id))
+
+    def key(self, prompt: Optional[str]) -> str:
+        preset = self.match(prompt)
+        return str(preset.id) if preset is not None else CUSTOM_PRESET_KEY
+
+    def identify(self, prompt: Optional[str], preset_key: Optional[str] = None) -> PresetIdentity:
+        """preset_key and workflow_type of a job; a preset_key sent by the client wins over matching.
+
+        Only a known preset id or "custom"/"fitting" is taken from the client;
+        anything else is ignored and the prompt is matched instead.
+        """
+        if preset_key in (CUSTOM_PRESET_KEY, FITTING_PRESET_KEY):
+            return PresetIdentity(preset_key, DEFAULT_WORKFLOW_TYPE)
+        preset = None
+        if is_preset_id(preset_key):
+            preset = self.by_id.get(int(preset_key))
+        if preset is None:
+            preset = self.match(prompt)
+        if preset is None:
+            return PresetIdentity(CUSTOM_PRESET_KEY, DEFAULT_WORKFLOW_TYPE)
+        return PresetIdentity(str(preset.id), preset.workflow_type or DEFAULT_WORKFLOW_TYPE)
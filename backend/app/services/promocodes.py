@@ -0,0 +1,188 @@
+"""Bulk promocode generation and import"""
+
+import asyncio
+import logging
+import secrets
+import string
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..config import settings
+from ..database import AsyncSessionLocal
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+VALID_AMOUNTS = [100, 200, 300, 400, 500, 1000, 2000, 3000, 5000]
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_MAX_LENGTH = 50
+# Imported codes may also use separators
+IMPORT_CODE_CHARS = set(CODE_ALPHABET + "-_")
+
+
+def generate_promocode_code(length: int = 8) -> str:
+    """Generate a random promocode"""
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def existing_codes(db: Session, codes: List[str]) -> Set[str]:
+    """Which of `codes` are already stored; one IN query per chunk"""
+    found = set()
+    for chunk in _chunks(codes, settings.PROMOCODE_BULK_CHUNK_SIZE):
+        found.update(db.scalars(select(models.Promocode.code).where(models.Promocode.code.in_(chunk))))
+    return found
+
+
+def _insert_promocodes(db: Session, rows: List[Dict]):
+    for chunk in _chunks(rows, settings.PROMOCODE_BULK_CHUNK_SIZE):
+        db.execute(insert(models.Promocode), chunk)
+
+
+def bulk_generate(db: Session, amounts: List[int], length: int = 8) -> List[Tuple[str, int]]:
+    """Create one new code per amount in a single transaction.
+
+    Candidates are generated in memory, checked against the table with
+    chunked IN queries and only the colliding ones are regenerated, so the
+    cost is a handful of queries and one commit regardless of the count.
+    """
+    codes: List[str] = []
+    taken: Set[str] = set()
+    while len(codes) < len(amounts):
+        candidates = set()
+        while len(candidates) < len(amounts) - len(codes):
+            code = generate_promocode_code(length)
+            if code not in taken:
+                candidates.add(code)
+        candidates = list(candidates)
+        collisions = existing_codes(db, candidates)
+        taken.update(candidates)
+        codes.extend(code for code in candidates if code not in collisions)
+        if collisions:
+            logger.info(f"Regenerating {len(collisions)} colliding promocodes")
+
+    pairs = list(zip(codes, amounts))
+    _insert_promocodes(db, [{'code': code, 'amount': amount} for code, amount in pairs])
+    db.commit()
+    logger.info(f"Bulk generated {len(pairs)} promocodes")
+    return pairs
+
+
+def bulk_import(db: Session, rows: Iterable[Tuple[str, str]]) -> Dict:
+    """Insert (code, amount) rows in a single transaction.
+
+    Invalid rows, duplicates within the input and codes that already exist
+    are reported back instead of failing the whole import.
+    """
+    valid: Dict[str, int] = {}
+    invalid: List[Dict] = []
+    duplicates: List[str] = []
+
+    for row_no, (raw_code, raw_amount) in enumerate(rows, start=1):
+        code = raw_code.strip().upper()
+        try:
+            amount = int(raw_amount)
+        except (TypeError, ValueError):
+            invalid.append({'row': row_no, 'code': code, 'error': "amount is not a number"})
+            continue
+        if not code or len(code) > CODE_MAX_LENGTH or not set(code) <= IMPORT_CODE_CHARS:
+            invalid.append({'row': row_no, 'code': code, 'error': "invalid code"})
+        elif amount not in VALID_AMOUNTS:
+            invalid.append({'row': row_no, 'code': code, 'error': f"invalid amount {amount}"})
+        elif code in valid:
+            duplicates.append(code)
+        else:
+            valid[code] = amount
+
+    existing = existing_codes(db, list(valid))
+    to_insert = [{'code': code, 'amount': amount} for code, amount in valid.items() if code not in existing]
+    _insert_promocodes(db, to_insert)
+    db.commit()
+
+    logger.info(
+        f"Imported {len(to_insert)} promocodes "
+        f"({len(existing)} existing, {len(duplicates)} duplicate, {len(invalid)} invalid rows)"
+    )
+    return {
+        'imported': len(to_insert),
+        'codes': [row['code'] for row in to_insert],
+        'existing': sorted(existing),
+        'duplicates': duplicates,
+        'invalid': invalid,
+    }
+
+
+_filter_rebuild: Optional[asyncio.Task] = None
+# Set when new codes could not be added to the filter and its ready marker could
+# not be dropped either; the filter is not trusted until the marker is gone
+_filter_untrusted = False
+
+
+async def rebuild_code_filter():
+    """Load unused and used codes from the DB into the Redis filter"""
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(models.Promocode.code, models.Promocode.is_used))).all()
+    await redis_client.promocode_filter_rebuild(
+        [row.code for row in rows if not row.is_used],
+        [row.code for row in rows if row.is_used],
+    )
+
+
+def schedule_code_filter_rebuild():
+    global _filter_rebuild
+    if _filter_rebuild is None or _filter_rebuild.done():
+        _filter_rebuild = asyncio.create_task(rebuild_code_filter())
+
+
+async def code_filter_rejects(code: str) -> bool:
+    """True only when the Redis filter is built and does not know `code`.
+
+    Any doubt (filter disabled, not built yet, Redis down) answers False so
+    the caller falls back to the DB.
+    """
+    if not settings.PROMOCODE_FILTER_ENABLED:
+        return False
+    if _filter_untrusted and not await _invalidate_code_filter():
+        return False
+    try:
+        known = await redis_client.promocode_filter_contains(code)
+    except Exception as e:
+        logger.warning(f"Promocode filter unavailable: {e}")
+        return False
+    if known is None:
+        schedule_code_filter_rebuild()
+        return False
+    return not known
+
+
+async def _invalidate_code_filter() -> bool:
+    global _filter_untrusted
+    try:
+        invalidated = await redis_client.promocode_filter_invalidate()
+    except Exception as e:
+        logger.warning(f"Failed to invalidate promocode filter: {e}")
+        invalidated = False
+    _filter_untrusted = not invalidated
+    return invalidated
+
+
+async def add_to_code_filter(codes: List[str]):
+    """Register new codes; if that fails the filter is invalidated, now or on the next lookup"""
+    global _filter_untrusted
+    if not settings.PROMOCODE_FILTER_ENABLED:
+        return
+    try:
+        added = await redis_client.promocode_filter_add(codes)
+    except Exception as e:
+        logger.warning(f"Failed to add promocodes to filter: {e}")
+        added = False
+    if not added:
+        _filter_untrusted = True
+        await _invalidate_code_filter()
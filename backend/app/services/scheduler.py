@@ -4,10 +4,9 @@ import asyncio
 import logging
 from datetime import datetime
 from typing import Optional
-from sqlalchemy.orm import Session
-from .. import models
 from ..config import settings
-from .payment_service import PaymentService
+from .weekly_bonus import WeeklyBonusRun
+from redis_client import redis_client
 
 logger = logging.getLogger(__name__)
 
@@ -16,9 +15,12 @@ class WeeklyBonusScheduler:
     """Scheduler for issuing weekly bonuses"""
     
     def __init__(self, db_session_factory):
+        # Async session factory (AsyncSessionLocal): the scheduler runs on the event loop
         self.db_session_factory = db_session_factory
         self.running = False
         self.task: Optional[asyncio.Task] = None
+        # Weeks already issued and announced by this process
+        self.completed_weeks = set()
     
     async def start(self):
         """Start the scheduler"""
@@ -51,6 +53,7 @@ class WeeklyBonusScheduler:
     
     async def _run_scheduler(self):
         """Main scheduler loop"""
+        await self._resume_interrupted_run()
         while self.running:
             try:
                 await self._check_and_issue_bonus()
@@ -89,67 +92,64 @@ class WeeklyBonusScheduler:
             logger.error(f"Error parsing bonus time: {e}")
             return
         
-        # Issue bonuses to all users
-        logger.info("Issuing weekly bonuses to all users")
-        
-        db = self.db_session_factory()
+        week_key = self._week_key(now)
+        if week_key in self.completed_weeks:
+            return
+
+        await self._run_week(week_key)
+
+    @staticmethod
+    def _week_key(now: datetime) -> str:
+        return now.strftime("%G-W%V")
+
+    async def _run_week(self, week_key: str):
+        """Issue and announce one week's bonus; safe to call again after a crash"""
+        bonus_run = WeeklyBonusRun(self.db_session_factory, week_key)
         try:
-            from .telegram_client import TelegramClient
-            payment_service = PaymentService(db)
-            telegram_client = TelegramClient()
-            
-            # Get all users
-            users = db.query(models.User).all()
-            
-            success_count = 0
-            for user in users:
-                try:
-                    payment = await payment_service.issue_weekly_bonus(user.user_id)
-                    
-                    # Send notification to user
-                    try:
-                        await telegram_client.send_message(
-                            chat_id=user.telegram_id,
-                            text=f"🎉 *Пятничный бонус!* 🎉\n\n💰 +{settings.WEEKLY_BONUS_AMOUNT} баллов\n💳 Новый баланс: {int(user.balance)} баллов\n\nСпасибо за использование QwenEditBot!"
-                        )
-                    except Exception as e:
-                        logger.error(f"Failed to send bonus notification to user {user.user_id}: {e}")
-                    
-                    success_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to issue bonus to user {user.user_id}: {e}")
-            
-            logger.info(f"Weekly bonuses issued: {success_count}/{len(users)} users")
-            
+            notified = await bonus_run.is_notified()
+        except Exception as e:
+            # Without the checkpoint every user would be notified again: credit only
+            # (issuance is deduplicated in the DB) and notify on a later check
+            logger.warning(f"Weekly bonus {week_key}: checkpoint unavailable ({e}), notifications postponed")
+            notified = None
+        if notified:
+            self.completed_weeks.add(week_key)
+            return
+
+        logger.info(f"Issuing weekly bonuses to all users ({week_key})")
+        try:
+            stats = await bonus_run.run(notify=notified is not None)
+            if notified is not None:
+                self.completed_weeks.add(week_key)
+            logger.info(f"Weekly bonuses {week_key} done: {stats}")
+        except Exception as e:
+            logger.error(f"Error issuing weekly bonuses {week_key}: {e}", exc_info=True)
+
+    async def _resume_interrupted_run(self):
+        """Finish this week's run if the process stopped in the middle of it"""
+        if redis_client.redis is None:
+            # Without the checkpoint every user would be notified again
+            return
+        week_key = self._week_key(datetime.utcnow())
+        bonus_run = WeeklyBonusRun(self.db_session_factory, week_key)
+        try:
+            if await bonus_run.has_started() and not await bonus_run.is_notified():
+                logger.info(f"Resuming interrupted weekly bonus run {week_key}")
+                await self._run_week(week_key)
         except Exception as e:
-            logger.error(f"Error issuing weekly bonuses: {e}")
-        finally:
-            db.close()
+            logger.error(f"Error resuming weekly bonus run {week_key}: {e}")
     
     async def issue_bonus_now(self):
         """Issue bonus immediately (for testing or manual trigger)"""
         logger.info("Manually triggering weekly bonus distribution")
         
-        db = self.db_session_factory()
+        # A fresh key per trigger: manual runs are not deduplicated against the weekly one
+        bonus_run = WeeklyBonusRun(self.db_session_factory, f"manual-{datetime.utcnow():%Y%m%d%H%M%S}")
         try:
-            payment_service = PaymentService(db)
-            
-            # Get all users
-            users = db.query(models.User).all()
-            
-            success_count = 0
-            for user in users:
-                try:
-                    await payment_service.issue_weekly_bonus(user.user_id)
-                    success_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to issue bonus to user {user.user_id}: {e}")
-            
-            logger.info(f"Manual bonuses issued: {success_count}/{len(users)} users")
-            return {"success": True, "count": success_count, "total": len(users)}
+            stats = await bonus_run.run(notify=False)
+            logger.info(f"Manual bonuses issued: {stats['issued']} users")
+            return {"success": True, "count": stats['issued'], "total": stats['issued']}
             
         except Exception as e:
             logger.error(f"Error issuing manual bonuses: {e}")
-            return {"success": False, "error": str(e)}
-        finally:
-            db.close()
+            return {"success": False, "error": str(e), "count": bonus_run.stats['issued']}
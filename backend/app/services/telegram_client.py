@@ -11,10 +11,29 @@ logger = logging.getLogger(__name__)
 class TelegramClient:
     """HTTP client for Telegram Bot API"""
     
-    def __init__(self, bot_token: Optional[str] = None):
+    def __init__(self, bot_token: Optional[str] = None, http_client: Optional[httpx.AsyncClient] = None):
         self.bot_token = bot_token or settings.BOT_TOKEN
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
         self.timeout = 10
+        # Shared connection pool for bulk sends; a one-off client is opened per call otherwise
+        self.http_client = http_client
+
+    async def _post(self, url: str, payload: dict) -> httpx.Response:
+        if self.http_client is not None:
+            return await self.http_client.post(url, json=payload)
+        async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
+            return await client.post(url, json=payload)
+
+    def _too_many_requests(self, response: httpx.Response) -> Optional[dict]:
+        """Flood-control reply as {"ok": False, "retry_after": seconds}, else None"""
+        if response.status_code != 429:
+            return None
+        try:
+            retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+        except ValueError:
+            retry_after = 1
+        logger.warning(f"Telegram flood control: retry after {retry_after}s")
+        return {"ok": False, "error": "Too Many Requests", "retry_after": retry_after}
     
     async def send_message(
         self,
@@ -45,18 +64,20 @@ class TelegramClient:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                
-                result = response.json()
-                if not result.get("ok"):
-                    logger.error(f"Telegram API error: {result}")
-                    return {"ok": False, "error": result.get("description")}
-                
-                logger.info(f"Message sent to chat {chat_id}")
-                return result
-                
+            response = await self._post(url, payload)
+            throttled = self._too_many_requests(response)
+            if throttled:
+                return throttled
+            response.raise_for_status()
+            
+            result = response.json()
+            if not result.get("ok"):
+                logger.error(f"Telegram API error: {result}")
+                return {"ok": False, "error": result.get("description")}
+            
+            logger.info(f"Message sent to chat {chat_id}")
+            return result
+            
         except httpx.HTTPError as e:
             logger.error(f"HTTP error sending Telegram message: {e}")
             return {"ok": False, "error": str(e)}
@@ -95,21 +116,69 @@ class TelegramClient:
             payload["caption"] = caption
         
         try:
-            async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                
-                result = response.json()
-                if not result.get("ok"):
-                    logger.error(f"Telegram API error: {result}")
-                    return {"ok": False, "error": result.get("description")}
-                
-                logger.info(f"Photo sent to chat {chat_id}")
-                return result
-                
+            response = await self._post(url, payload)
+            throttled = self._too_many_requests(response)
+            if throttled:
+                return throttled
+            response.raise_for_status()
+            
+            result = response.json()
+            if not result.get("ok"):
+                logger.error(f"Telegram API error: {result}")
+                return {"ok": False, "error": result.get("description")}
+            
+            logger.info(f"Photo sent to chat {chat_id}")
+            return result
+            
         except httpx.HTTPError as e:
             logger.error(f"HTTP error sending Telegram photo: {e}")
             return {"ok": False, "error": str(e)}
         except Exception as e:
             logger.error(f"Error sending Telegram photo: {e}")
             return {"ok": False, "error": str(e)}
+
+    async def answer_callback_query(self, callback_query_id: str, text: Optional[str] = None) -> dict:
+        """Close the loading animation of an inline keyboard button"""
+        payload = {"callback_query_id": callback_query_id}
+        if text:
+            payload["text"] = text
+
+        try:
+            response = await self._post(f"{self.base_url}/answerCallbackQuery", payload)
+            throttled = self._too_many_requests(response)
+            if throttled:
+                return throttled
+            response.raise_for_status()
+
+            result = response.json()
+            if not result.get("ok"):
+                logger.error(f"Failed to answer callback query {callback_query_id}: {result}")
+                return {"ok": False, "error": result.get("description")}
+            return result
+
+        except Exception as e:
+            logger.error(f"Error answering callback query: {e}")
+            return {"ok": False, "error": str(e)}
+
+    async def download_file(self, file_id: str) -> Optional[bytes]:
+        """Resolve a file_id with getFile and download its content"""
+        try:
+            response = await self._post(f"{self.base_url}/getFile", {"file_id": file_id})
+            response.raise_for_status()
+            file_data = response.json()
+            if not file_data.get("ok"):
+                logger.error(f"Could not get file info: {file_data}")
+                return None
+
+            file_url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_data['result']['file_path']}"
+            if self.http_client is not None:
+                response = await self.http_client.get(file_url)
+            else:
+                async with httpx.AsyncClient(timeout=self.timeout, verify=False) as client:
+                    response = await client.get(file_url)
+            response.raise_for_status()
+            return response.content
+
+        except Exception as e:
+            logger.error(f"Error downloading Telegram file {file_id}: {e}")
+            return None
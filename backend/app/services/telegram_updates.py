@@ -0,0 +1,241 @@
+"""Processing of Telegram webhook updates from the Redis stream"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import anyio
+import httpx
+from sqlalchemy import select
+
+from .. import models
+from ..config import settings
+from .job_events import publish_job_event
+from .preset_catalog import preset_catalog
+from .telegram_client import TelegramClient
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+CONSUMER_GROUP = "backend"
+# How long a consumer blocks on XREADGROUP before looking for stale updates
+# (stays below the Redis client's 5 s socket timeout)
+READ_BLOCK_MS = 2000
+
+
+class TelegramUpdateConsumers:
+    """Pool of TELEGRAM_UPDATE_CONSUMERS tasks reading one consumer group.
+
+    The webhook only appends updates to the stream. Each consumer handles
+    one update at a time, so the pool bounds concurrency; updates are
+    acknowledged after handling, and those left pending by a crashed process
+    are reclaimed once idle for TELEGRAM_UPDATE_CLAIM_IDLE_MS. All Telegram
+    calls share one HTTP connection pool.
+    """
+
+    def __init__(self, db_session_factory):
+        # Async session factory (AsyncSessionLocal): consumers run on the event loop
+        self.db_session_factory = db_session_factory
+        self.running = False
+        self.tasks: List[asyncio.Task] = []
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self.telegram: Optional[TelegramClient] = None
+        self.stats = {'processed': 0, 'failed': 0, 'reclaimed': 0}
+        self._group_ready = False
+
+    async def start(self):
+        if self.running:
+            return
+
+        self.http_client = httpx.AsyncClient(timeout=30, verify=False)
+        self.telegram = TelegramClient(http_client=self.http_client)
+        self.running = True
+        prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self.tasks = [
+            asyncio.create_task(self._consume(f"{prefix}-{i}"))
+            for i in range(settings.TELEGRAM_UPDATE_CONSUMERS)
+        ]
+        logger.info(f"Telegram update consumers started: {len(self.tasks)}")
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.http_client.aclose()
+        logger.info("Telegram update consumers stopped")
+
+    async def _consume(self, consumer: str):
+        while self.running:
+            try:
+                if not self._group_ready:
+                    # Created lazily so consumers survive Redis being down at startup
+                    await redis_client.ensure_telegram_update_group(CONSUMER_GROUP)
+                    self._group_ready = True
+                entries = await redis_client.read_telegram_updates(CONSUMER_GROUP, consumer, 1, READ_BLOCK_MS)
+                if not entries:
+                    # Idle: pick up whatever a dead consumer left behind
+                    entries = await redis_client.claim_stale_telegram_updates(
+                        CONSUMER_GROUP, consumer, settings.TELEGRAM_UPDATE_CLAIM_IDLE_MS, 10
+                    )
+                    self.stats['reclaimed'] += len(entries)
+                for entry_id, fields in entries:
+                    await self._handle_entry(entry_id, fields)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                if "NOGROUP" in str(e):
+                    # Redis lost the stream (restart without persistence, trimmed away);
+                    # XADD from the webhook recreates it, but not the group
+                    self._group_ready = False
+                logger.error(f"Telegram update consumer {consumer} error: {e}")
+                await asyncio.sleep(READ_BLOCK_MS / 1000)
+
+    async def _handle_entry(self, entry_id, fields: dict):
+        try:
+            update_data = json.loads(fields[b'payload'])
+            await self.process_update(update_data)
+            self.stats['processed'] += 1
+        except Exception as e:
+            # Handling is not retried: a poison update must not block the stream
+            self.stats['failed'] += 1
+            logger.exception(f"Failed to process Telegram update {fields.get(b'update_id')}: {e}")
+        await redis_client.ack_telegram_update(CONSUMER_GROUP, entry_id)
+
+    async def process_update(self, update_data: dict):
+        """Dispatch one update the way the webhook used to do inline"""
+        logger.debug("Processing Telegram update: %s", update_data.get('update_id'))
+
+        async with self.db_session_factory() as db:
+            if 'message' in update_data:
+                message = update_data['message']
+                user_id = message['from']['id']
+
+                # Check if user exists
+                user = await db.scalar(select(models.User).where(models.User.user_id == user_id))
+                if not user:
+                    logger.warning(f"Unknown user tried to interact: {user_id}")
+                    return
+
+                if 'photo' in message:
+                    await self.handle_photo_message(message, user_id, db)
+                elif 'text' in message and message['text'].startswith('/'):
+                    await self.handle_command(message['text'], user)
+
+            elif 'callback_query' in update_data:
+                callback_query = update_data['callback_query']
+                await self.handle_callback(callback_query, callback_query['from']['id'])
+
+    async def handle_photo_message(self, message: dict, user_id: int, db):
+        """Download the photo, create the job and put it on the worker queue"""
+        # Skip balance checks completely during testing
+        logger.info(f"Balance check skipped for user {user_id} during testing")
+
+        # Get the highest resolution photo
+        largest_photo = max(message['photo'], key=lambda p: p.get('width', 0))
+        file_bytes = await self.telegram.download_file(largest_photo['file_id'])
+        if file_bytes is None:
+            return
+
+        prompt = message.get('caption', '').strip()
+        if not prompt:
+            prompt = "Convert to in the comic style, while preserving composition and character identity. remove the progress bar and watermarks"
+
+        # Save uploaded image to ComfyUI input directory, in the format expected by the workflow
+        uploads_dir = Path(settings.COMFY_INPUT_DIR)
+        task_id = uuid.uuid4().hex[:8]
+        image_path = uploads_dir / f"input_{task_id}.jpg"
+
+        def write_image():
+            uploads_dir.mkdir(parents=True, exist_ok=True)
+            image_path.write_bytes(file_bytes)
+
+        await anyio.to_thread.run_sync(write_image)
+
+        identity = (await db.run_sync(preset_catalog.get_matcher)).identify(prompt)
+        new_job = models.Job(
+            user_id=user_id,
+            image_path=str(image_path),
+            prompt=prompt,
+            preset_key=identity.preset_key,
+            workflow_type=identity.workflow_type,
+            status=models.JobStatus.queued
+        )
+        db.add(new_job)
+        await db.commit()
+        await db.refresh(new_job)
+        await publish_job_event(new_job)
+
+        # Skip balance deduction during testing
+        logger.info(f"Balance deduction skipped for user {user_id} during testing")
+
+        try:
+            await redis_client.enqueue_job({
+                'id': new_job.id,
+                'task_id': task_id,
+                'user_id': new_job.user_id,
+                'image_path': str(image_path),
+                'prompt': new_job.prompt,
+                'status': new_job.status.value,
+                'created_at': new_job.created_at.isoformat() if new_job.created_at else datetime.utcnow().isoformat(),
+                'updated_at': new_job.updated_at.isoformat() if new_job.updated_at else datetime.utcnow().isoformat()
+            })
+            logger.info(f"Job {new_job.id} with task_id {task_id} added to Redis queue")
+            await self.telegram.send_message(
+                user_id,
+                f"✅ Изображение загружено! ID задачи: {task_id}\n⏳ Обработка может занять несколько минут..."
+            )
+        except Exception as redis_error:
+            logger.error(f"Failed to add job {new_job.id} to Redis queue: {redis_error}")
+            await self.telegram.send_message(
+                user_id,
+                "❌ Произошла ошибка при обработке изображения. Повторите попытку позже."
+            )
+            # Skip refund during testing
+            logger.info(f"Refund skipped for user {user_id} during testing")
+
+    async def handle_command(self, command: str, user: models.User):
+        """Handle text commands from users"""
+        if command == '/start':
+            await self.telegram.send_message(
+                user.user_id,
+                f"Добро пожаловать в QwenEditBot 🎨\n\n"
+                f"Вам начислено {settings.INITIAL_BALANCE} баллов!\n\n"
+                f"Загрузите фото и получите результат после обработки AI."
+            )
+        elif command == '/balance':
+            await self.telegram.send_message(user.user_id, f"💰 Ваш баланс: {user.balance} баллов")
+        else:
+            await self.telegram.send_message(
+                user.user_id,
+                f"🤖 Команда '{command}' не распознана.\n\nДоступные команды:\n/start - Начать работу\n/balance - Проверить баланс"
+            )
+
+    async def handle_callback(self, callback_query: dict, user_id: int):
+        """Handle inline keyboard callbacks"""
+        await self.telegram.answer_callback_query(callback_query['id'])
+        logger.debug("Received callback: %s from user %s", callback_query.get('data', ''), user_id)
+
+
+telegram_update_consumers: Optional[TelegramUpdateConsumers] = None
+
+
+async def start_telegram_update_consumers(db_session_factory) -> TelegramUpdateConsumers:
+    global telegram_update_consumers
+    telegram_update_consumers = TelegramUpdateConsumers(db_session_factory)
+    await telegram_update_consumers.start()
+    return telegram_update_consumers
+
+
+async def stop_telegram_update_consumers():
+    if telegram_update_consumers is not None:
+        await telegram_update_consumers.stop()
@@ -0,0 +1,109 @@
+"""Read-through Redis cache for user lookups"""
+
+import logging
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models, schemas
+from ..config import settings
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# telegram_id -> user_id never changes, so the mapping outlives the record
+TELEGRAM_ID_MAPPING_TTL = 7 * 24 * 3600
+
+
+class UserCache:
+    """Caches users as JSON under `<prefix>:id:<user_id>` for USER_CACHE_TTL.
+
+    `<prefix>:tg:<telegram_id>` maps to the user_id, so invalidating a user
+    only needs its user_id: balance changes and registration delete the
+    record and the next lookup reloads it from the DB. Any Redis error falls
+    back to the DB.
+    """
+
+    def __init__(self):
+        self.stats = {'hits': 0, 'misses': 0, 'errors': 0, 'invalidations': 0}
+
+    def _id_key(self, user_id: int) -> str:
+        return f"{settings.REDIS_USER_CACHE_KEY_PREFIX}:id:{user_id}"
+
+    def _tg_key(self, telegram_id: int) -> str:
+        return f"{settings.REDIS_USER_CACHE_KEY_PREFIX}:tg:{telegram_id}"
+
+    async def _read(self, key: str) -> Optional[bytes]:
+        try:
+            return await redis_client.cache_get(key)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.debug(f"User cache read failed: {e}")
+            return None
+
+    async def _store(self, user: schemas.UserResponse):
+        try:
+            await redis_client.cache_set(self._id_key(user.user_id), user.model_dump_json(), settings.USER_CACHE_TTL)
+            if user.telegram_id is not None:
+                await redis_client.cache_set(self._tg_key(user.telegram_id), user.user_id, TELEGRAM_ID_MAPPING_TTL)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.debug(f"User cache write failed: {e}")
+
+    async def _load(self, db: AsyncSession, condition) -> Optional[schemas.UserResponse]:
+        user = await db.scalar(select(models.User).where(condition))
+        if user is None:
+            return None
+        cached = schemas.UserResponse.model_validate(user)
+        await self._store(cached)
+        return cached
+
+    async def get_by_id(self, db: AsyncSession, user_id: int) -> Optional[schemas.UserResponse]:
+        if settings.USER_CACHE_ENABLED:
+            value = await self._read(self._id_key(user_id))
+            if value is not None:
+                self.stats['hits'] += 1
+                return schemas.UserResponse.model_validate_json(value)
+            self.stats['misses'] += 1
+        return await self._load(db, models.User.user_id == user_id)
+
+    async def get_by_telegram_id(self, db: AsyncSession, telegram_id: int) -> Optional[schemas.UserResponse]:
+        if settings.USER_CACHE_ENABLED:
+            user_id = await self._read(self._tg_key(telegram_id))
+            if user_id is not None:
+                return await self.get_by_id(db, int(user_id))
+            self.stats['misses'] += 1
+        return await self._load(db, models.User.telegram_id == telegram_id)
+
+    async def prime(self, user: models.User):
+        """Store a freshly registered user"""
+        if settings.USER_CACHE_ENABLED:
+            await self._store(schemas.UserResponse.model_validate(user))
+
+    async def invalidate(self, *user_ids: int):
+        if not settings.USER_CACHE_ENABLED or not user_ids:
+            return
+        self.stats['invalidations'] += len(user_ids)
+        try:
+            await redis_client.cache_delete(*(self._id_key(user_id) for user_id in user_ids))
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning(f"User cache invalidation failed: {e}")
+
+    async def invalidate_many(self, user_ids: Iterable[int], chunk: int = 500):
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), chunk):
+            await self.invalidate(*user_ids[start:start + chunk])
+
+    def metrics(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_ratio': round(self.stats['hits'] / lookups, 4) if lookups else None,
+            'ttl': settings.USER_CACHE_TTL,
+            'enabled': settings.USER_CACHE_ENABLED,
+        }
+
+
+user_cache = UserCache()
@@ -0,0 +1,237 @@
+"""Bulk weekly bonus issuance and rate-limited notification fan-out"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import httpx
+from sqlalchemy import func, insert, select, update
+
+from .. import models
+from ..config import settings
+from .payment_service import payment_totals
+from .telegram_client import TelegramClient
+from .user_cache import user_cache
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Progress markers live a little longer than the week they belong to
+CHECKPOINT_TTL = 8 * 24 * 3600
+
+
+class RateLimiter:
+    """Spaces out acquisitions to at most `rate` per second across all tasks"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold every sender back, e.g. after a 429 from Telegram"""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+class WeeklyBonusRun:
+    """Issues one week's bonus to every user and notifies them.
+
+    Issuance runs in chunks of WEEKLY_BONUS_CHUNK_SIZE users ordered by
+    user_id: one set-based balance UPDATE plus bulk INSERTs of Payment,
+    PaymentLog and balance_ledger rows per transaction. Every bonus payment carries
+    yukassa_payment_id "weekly_bonus:<week>:<user_id>", so the unique index
+    rejects a double credit and the highest committed user_id is the resume
+    point after a crash.
+
+    Notifications are sent afterwards with bounded concurrency under a
+    global rate limit, sharing one HTTP connection pool. The last notified
+    user_id is checkpointed in Redis after every chunk.
+    """
+
+    def __init__(self, session_factory, week_key: str, amount: int = None):
+        self.session_factory = session_factory
+        self.week_key = week_key
+        self.amount = amount if amount is not None else settings.WEEKLY_BONUS_AMOUNT
+        self.chunk_size = settings.WEEKLY_BONUS_CHUNK_SIZE
+        self.marker_prefix = f"weekly_bonus:{week_key}:"
+        self.checkpoint_key = f"{settings.REDIS_BONUS_KEY_PREFIX}:{week_key}"
+        self.stats = {'issued': 0, 'notified': 0, 'notify_failed': 0}
+
+    def _marker(self, user_id: int) -> str:
+        return f"{self.marker_prefix}{user_id}"
+
+    def _marker_range(self):
+        # ':' + 1 == ';', so this is the half-open range of every marker of the week
+        column = models.Payment.yukassa_payment_id
+        return column >= self.marker_prefix, column < self.marker_prefix[:-1] + ";"
+
+    async def _last_issued_user_id(self, db) -> int:
+        last = await db.scalar(select(func.max(models.Payment.user_id)).where(*self._marker_range()))
+        return last or 0
+
+    async def has_started(self) -> bool:
+        async with self.session_factory() as db:
+            return await self._last_issued_user_id(db) > 0
+
+    async def issue(self) -> int:
+        """Credit every user not yet credited for this week; returns the count"""
+        async with self.session_factory() as db:
+            after = await self._last_issued_user_id(db)
+        if after:
+            logger.info(f"Weekly bonus {self.week_key}: resuming issuance after user {after}")
+
+        while True:
+            async with self.session_factory() as db:
+                async with db.begin():
+                    balances = await self._issue_chunk(db, after)
+            if not balances:
+                break
+            user_ids = sorted(balances)
+            after = user_ids[-1]
+            self.stats['issued'] += len(user_ids)
+            for user_id in user_ids:
+                payment_totals.invalidate(user_id)
+            try:
+                await redis_client.set_balance_snapshots(balances)
+            except Exception as e:
+                logger.warning(f"Weekly bonus {self.week_key}: failed to store balance snapshots: {e}")
+            await user_cache.invalidate_many(user_ids)
+            logger.info(f"Weekly bonus {self.week_key}: {self.stats['issued']} users credited (up to user {after})")
+
+        return self.stats['issued']
+
+    async def _issue_chunk(self, db, after: int) -> Dict[int, float]:
+        """Credit the next chunk of users; returns their new balances by user_id"""
+        user_ids = (await db.scalars(
+            select(models.User.user_id)
+            .where(models.User.user_id > after)
+            .order_by(models.User.user_id)
+            .limit(self.chunk_size)
+        )).all()
+        if not user_ids:
+            return {}
+
+        balances = (await db.execute(
+            update(models.User)
+            .where(models.User.user_id.in_(user_ids))
+            .values(balance=models.User.balance + self.amount)
+            .returning(models.User.user_id, models.User.balance)
+            .execution_options(synchronize_session=False)
+        )).all()
+
+        paid_at = datetime.now()
+        await db.execute(insert(models.Payment), [
+            {
+                'user_id': user_id,
+                'yukassa_payment_id': self._marker(user_id),
+                'amount': self.amount,
+                'currency': "RUB",
+                'status': models.PaymentStatus.succeeded,
+                'payment_type': models.PaymentType.weekly_bonus,
+                'description': "Еженедельный бонус",
+                'paid_at': paid_at,
+            }
+            for user_id in user_ids
+        ])
+        await db.execute(insert(models.PaymentLog), [
+            {
+                'user_id': user_id,
+                'amount': float(self.amount),
+                'status': "completed",
+                'payment_id': self._marker(user_id),
+            }
+            for user_id in user_ids
+        ])
+        await db.execute(insert(models.BalanceLedger), [
+            {
+                'user_id': row.user_id,
+                'delta': float(self.amount),
+                'balance_after': row.balance,
+                'reason': "Еженедельный бонус",
+                'reference': self._marker(row.user_id),
+            }
+            for row in balances
+        ])
+        return {row.user_id: row.balance for row in balances}
+
+    async def _get_checkpoint(self) -> Optional[str]:
+        # Errors propagate: starting over from user 0 would notify everyone twice
+        return await redis_client.get_checkpoint(self.checkpoint_key)
+
+    async def _set_checkpoint(self, value):
+        try:
+            await redis_client.set_checkpoint(self.checkpoint_key, value, CHECKPOINT_TTL)
+        except Exception as e:
+            logger.warning(f"Weekly bonus {self.week_key}: failed to save checkpoint {value}: {e}")
+
+    async def is_notified(self) -> bool:
+        return await self._get_checkpoint() == "done"
+
+    async def notify(self):
+        """Send the bonus message to every credited user not yet notified"""
+        checkpoint = await self._get_checkpoint()
+        if checkpoint == "done":
+            return
+        after = int(checkpoint) if checkpoint else 0
+        if after:
+            logger.info(f"Weekly bonus {self.week_key}: resuming notifications after user {after}")
+
+        limiter = RateLimiter(settings.TELEGRAM_BROADCAST_RATE)
+        semaphore = asyncio.Semaphore(settings.TELEGRAM_BROADCAST_CONCURRENCY)
+
+        async with httpx.AsyncClient(timeout=10, verify=False) as http_client:
+            telegram = TelegramClient(http_client=http_client)
+
+            async def send(telegram_id: int, balance: float):
+                async with semaphore:
+                    text = (
+                        f"🎉 <b>Пятничный бонус!</b> 🎉\n\n💰 +{self.amount} баллов\n"
+                        f"💳 Новый баланс: {int(balance)} баллов\n\nСпасибо за использование QwenEditBot!"
+                    )
+                    for _ in range(2):
+                        await limiter.acquire()
+                        result = await telegram.send_message(chat_id=telegram_id, text=text)
+                        if result.get("retry_after") is None:
+                            break
+                        limiter.pause(result["retry_after"])
+                    if result.get("ok"):
+                        self.stats['notified'] += 1
+                    else:
+                        self.stats['notify_failed'] += 1
+
+            while True:
+                async with self.session_factory() as db:
+                    rows = (await db.execute(
+                        select(models.Payment.user_id, models.User.telegram_id, models.User.balance)
+                        .join(models.User, models.User.user_id == models.Payment.user_id)
+                        .where(*self._marker_range(), models.Payment.user_id > after)
+                        .order_by(models.Payment.user_id)
+                        .limit(self.chunk_size)
+                    )).all()
+                if not rows:
+                    break
+                await asyncio.gather(*(send(row.telegram_id, row.balance) for row in rows))
+                after = rows[-1].user_id
+                await self._set_checkpoint(after)
+
+        await self._set_checkpoint("done")
+        logger.info(
+            f"Weekly bonus {self.week_key}: notifications sent {self.stats['notified']}, "
+            f"failed {self.stats['notify_failed']}"
+        )
+
+    async def run(self, notify: bool = True) -> dict:
+        await self.issue()
+        if notify:
+            await self.notify()
+        return self.stats
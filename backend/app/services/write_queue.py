@@ -0,0 +1,165 @@
+"""Single-writer queue that groups small write transactions into batched commits"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+WriteFn = Callable[[Session], Any]
+
+
+class WriteQueue:
+    """Serialises write transactions through one writer thread.
+
+    SQLite allows a single writer at a time, so concurrent commits from job
+    creation, worker status updates and webhooks only wait on each other.
+    Callers submit a function that applies its changes to a session without
+    committing; the writer runs up to SQLITE_WRITE_BATCH_SIZE of them and
+    commits once. If the batch fails, every item is retried on its own so one
+    bad write cannot fail its neighbours.
+    """
+
+    def __init__(self, session_factory, max_batch: int = None, max_delay_ms: int = None):
+        self.session_factory = session_factory
+        self.max_batch = max_batch or settings.SQLITE_WRITE_BATCH_SIZE
+        self.max_delay = (max_delay_ms if max_delay_ms is not None else settings.SQLITE_WRITE_BATCH_DELAY_MS) / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {'batches': 0, 'writes': 0, 'batch_failures': 0}
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+        logger.info(f"SQLite write queue started (batch {self.max_batch}, delay {self.max_delay * 1000:.0f}ms)")
+
+    async def stop(self):
+        if not self.running:
+            return
+        # Let queued writes finish before shutting down
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        logger.info(f"SQLite write queue stopped ({self.stats})")
+
+    async def submit(self, fn: WriteFn) -> Any:
+        """Run fn(session) in the next batch and return its result after commit"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((fn, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[WriteFn, asyncio.Future]]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                outcomes = await asyncio.to_thread(self._execute, [fn for fn, _ in batch])
+                for (_, future), (ok, value) in zip(batch, outcomes):
+                    if future.done():
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+            except Exception as e:
+                logger.error(f"SQLite write queue batch crashed: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _refresh(self, db: Session, value: Any):
+        # Reload server-side defaults (created_at, onupdate columns) before the session closes
+        state = sa_inspect(value, raiseerr=False)
+        if state is not None and getattr(state, "persistent", False):
+            db.refresh(value)
+
+    def _execute(self, fns: List[WriteFn]) -> List[Tuple[bool, Any]]:
+        """Runs in a worker thread: one transaction for the whole batch"""
+        db = self.session_factory()
+        try:
+            results = [fn(db) for fn in fns]
+            db.commit()
+            for value in results:
+                self._refresh(db, value)
+            self.stats['batches'] += 1
+            self.stats['writes'] += len(fns)
+            return [(True, value) for value in results]
+        except Exception as batch_error:
+            db.rollback()
+            if len(fns) == 1:
+                return [(False, batch_error)]
+            self.stats['batch_failures'] += 1
+            logger.warning(f"Batched commit of {len(fns)} writes failed ({batch_error}), retrying one by one")
+        finally:
+            db.close()
+
+        outcomes = []
+        for fn in fns:
+            db = self.session_factory()
+            try:
+                value = fn(db)
+                db.commit()
+                self._refresh(db, value)
+                self.stats['batches'] += 1
+                self.stats['writes'] += 1
+                outcomes.append((True, value))
+            except Exception as e:
+                db.rollback()
+                outcomes.append((False, e))
+            finally:
+                db.close()
+        return outcomes
+
+
+write_queue: Optional[WriteQueue] = None
+
+
+def get_write_queue() -> Optional[WriteQueue]:
+    """The running write queue, or None when SQLITE_WRITE_QUEUE_ENABLED is off"""
+    if write_queue is not None and write_queue.running:
+        return write_queue
+    return None
+
+
+async def start_write_queue(session_factory) -> Optional[WriteQueue]:
+    global write_queue
+    if not settings.SQLITE_WRITE_QUEUE_ENABLED:
+        return None
+    write_queue = WriteQueue(session_factory)
+    await write_queue.start()
+    return write_queue
+
+
+async def stop_write_queue():
+    if write_queue is not None:
+        await write_queue.stop()
@@ -0,0 +1,25 @@
+"""Conditional request helpers (ETag / If-None-Match)"""
+
+import hashlib
+from typing import Optional
+
+
+def strong_etag(body: bytes) -> str:
+    """Strong validator derived from the exact response bytes"""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value selects `etag` (RFC 9110 weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
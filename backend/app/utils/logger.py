@@ -0,0 +1,198 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format, plus the count of records a hot-loop filter dropped"""
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f"{line} (+{suppressed} suppressed)" if suppressed else line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Merges msg and args in the caller, leaves tracebacks to the listener.
+
+    The message is rendered here, like the stock QueueHandler does, so
+    mutable arguments (dicts, ORM instances) are captured as they are at
+    the call and never read from the listener thread. Unlike the stock
+    handler, exc_info is kept and formatted by the listener: the queue
+    never leaves the process.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class HotLoopFilter(logging.Filter):
+    """Thins out records below WARNING on a logger used inside a hot loop.
+
+    `sample` keeps that fraction of records, `rate` caps them at that many
+    per second (bursts up to one second's worth). Warnings and errors always
+    pass. The next record let through carries the number dropped since.
+    """
+
+    def __init__(self, sample: float = 1.0, rate: Optional[float] = None):
+        super().__init__()
+        self.sample = sample
+        self.rate = rate
+        self.capacity = max(1.0, rate or 0.0)
+        self.tokens = self.capacity
+        self.refilled_at = time.monotonic()
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            if not self._admit():
+                self.dropped += 1
+                return False
+            record.suppressed, self.dropped = self.dropped, 0
+            return True
+
+    def _admit(self) -> bool:
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return False
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+def parse_logger_values(spec: str) -> Dict[str, float]:
+    """'name=value,name=value' -> {name: value}; malformed entries are ignored"""
+    values = {}
+    for item in spec.split(','):
+        name, sep, value = item.partition('=')
+        if not sep:
+            continue
+        try:
+            values[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return values
+
+
+def setup_logger(
+    level: str = "INFO",
+    log_format: str = "text",
+    log_file: Optional[str] = None,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    sampling: str = "",
+    rate_limits: str = "",
+):
+    """Setup logging configuration for the backend.
+
+    Loggers only enqueue records; a QueueListener thread formats them and
+    writes to stdout and, when `log_file` is set, to a size-rotated file.
+    `sampling` and `rate_limits` ('logger=value,...') attach a HotLoopFilter
+    to the named loggers.
+    """
+    global _listener
+
+    # Convert string level to logging level
+    log_level = getattr(logging, level.upper(), logging.INFO)
+
+    if log_format.lower() == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    if _listener is not None:
+        _listener.stop()
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, *handlers)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    # Get root logger
+    logger = logging.getLogger()
+    logger.setLevel(log_level)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(LazyQueueHandler(records))
+
+    samples = parse_logger_values(sampling)
+    rates = parse_logger_values(rate_limits)
+    for name in samples.keys() | rates.keys():
+        hot_logger = logging.getLogger(name)
+        for existing in [f for f in hot_logger.filters if isinstance(f, HotLoopFilter)]:
+            hot_logger.removeFilter(existing)
+        hot_logger.addFilter(HotLoopFilter(sample=samples.get(name, 1.0), rate=rates.get(name)))
+
+    # uvicorn installs its own stdout handlers before the app is imported;
+    # send its error and access logs through the queue as well
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        server_logger = logging.getLogger(name)
+        for handler in list(server_logger.handlers):
+            server_logger.removeHandler(handler)
+        server_logger.propagate = True
+
+    # Suppress overly verbose logs from libraries
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+    return logger
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
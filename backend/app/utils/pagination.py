@@ -0,0 +1,48 @@
+"""Keyset (cursor) pagination helpers for history endpoints"""
+
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func, or_, select
+
+from ..config import settings
+
+
+def keyset_before(model, cursor: int, lookup_models: Sequence = ()):
+    """Condition selecting rows after `cursor` in (created_at DESC, id DESC) order.
+
+    The cursor is the id of the last row of the previous page. Its created_at
+    is looked up in SQL so both sides compare in the stored format, and the
+    (user_id, created_at) index serves the range scan. When pages span a hot
+    and an archive table, `lookup_models` lists the tables the cursor row may
+    be in.
+    """
+    lookups = [
+        select(lookup.created_at).where(lookup.id == cursor).scalar_subquery()
+        for lookup in (lookup_models or (model,))
+    ]
+    cursor_created_at = func.coalesce(*lookups) if len(lookups) > 1 else lookups[0]
+    return or_(
+        model.created_at < cursor_created_at,
+        and_(model.created_at == cursor_created_at, model.id < cursor),
+    )
+
+
+class TotalCache:
+    """Per-user row counts cached for HISTORY_TOTAL_CACHE_TTL seconds"""
+
+    def __init__(self):
+        self._totals: Dict[Tuple[int, Optional[str]], Tuple[float, int]] = {}
+
+    def get(self, user_id: int, status: Optional[str] = None) -> Optional[int]:
+        entry = self._totals.get((user_id, status))
+        if entry and time.monotonic() - entry[0] < settings.HISTORY_TOTAL_CACHE_TTL:
+            return entry[1]
+        return None
+
+    def set(self, user_id: int, total: int, status: Optional[str] = None):
+        self._totals[(user_id, status)] = (time.monotonic(), total)
+
+    def invalidate(self, user_id: int):
+        for key in [key for key in self._totals if key[0] == user_id]:
+            self._totals.pop(key, None)
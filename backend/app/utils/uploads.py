@@ -0,0 +1,96 @@
+"""Streaming upload storage with on-the-fly hashing and image type detection"""
+
+import hashlib
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import aiofiles
+from fastapi import HTTPException, UploadFile, status
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bytes needed to recognise every supported format
+HEADER_SIZE = 12
+
+
+class SavedUpload(NamedTuple):
+    path: Path
+    sha256: str
+    size: int
+    image_type: str
+    deduplicated: bool
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """Detect the image format from its magic bytes; returns a file extension"""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header.startswith(b"GIF87a") or header.startswith(b"GIF89a"):
+        return "gif"
+    if header.startswith(b"BM"):
+        return "bmp"
+    return None
+
+
+async def save_upload(upload: UploadFile, target_dir: Path, prefix: str = "input") -> SavedUpload:
+    """Stream an uploaded image to target_dir in chunks.
+
+    The SHA-256 and the image type are computed while writing, so memory use
+    is bounded by UPLOAD_CHUNK_SIZE. The file is stored under a
+    content-addressed name; an identical upload reuses the existing file.
+    """
+    target_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = target_dir / f".{prefix}_{uuid.uuid4().hex}.part"
+    hasher = hashlib.sha256()
+    header = b""
+    size = 0
+
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while True:
+                chunk = await upload.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(header) < HEADER_SIZE:
+                    header += chunk[:HEADER_SIZE - len(header)]
+                    # Reject non-images before the rest of the body is written
+                    if len(header) >= HEADER_SIZE and not sniff_image_type(header):
+                        raise HTTPException(status_code=400, detail="Uploaded file is not a supported image")
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Image is larger than {settings.UPLOAD_MAX_BYTES // (1024 * 1024)} MB"
+                    )
+                hasher.update(chunk)
+                await out.write(chunk)
+
+        image_type = sniff_image_type(header)
+        if not image_type:
+            raise HTTPException(status_code=400, detail="Uploaded file is not a supported image")
+
+        digest = hasher.hexdigest()
+        final_path = target_dir / f"{prefix}_{digest[:32]}.{image_type}"
+        if final_path.exists():
+            os.unlink(tmp_path)
+            logger.info(f"Upload deduplicated: {final_path.name} ({size} bytes)")
+            return SavedUpload(final_path, digest, size, image_type, True)
+
+        os.replace(tmp_path, final_path)
+        return SavedUpload(final_path, digest, size, image_type, False)
+
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
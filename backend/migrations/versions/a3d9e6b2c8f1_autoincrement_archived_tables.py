@@ -0,0 +1,51 @@
+"""Use AUTOINCREMENT ids on jobs, payments and payment_logs
+
+Revision ID: a3d9e6b2c8f1
+Revises: f5b8d2c7a3e6
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d9e6b2c8f1'
+down_revision: Union[str, Sequence[str], None] = 'f5b8d2c7a3e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Hot table -> archive table sharing its ids
+ARCHIVED_TABLES = {
+    'jobs': 'jobs_archive',
+    'payments': 'payments_archive',
+    'payment_logs': 'payment_logs_archive',
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Without AUTOINCREMENT SQLite hands out max(rowid) + 1, which reuses the ids
+    # of rows archiving moved out. Other databases use sequences and never do.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, archive in ARCHIVED_TABLES.items():
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+            pass
+        # Continue after the highest id ever used, archived rows included
+        op.execute(sa.text("DELETE FROM sqlite_sequence WHERE name = :name").bindparams(name=table))
+        op.execute(sa.text(
+            f"INSERT INTO sqlite_sequence (name, seq) SELECT :name, coalesce(max(id), 0) FROM "
+            f"(SELECT max(id) AS id FROM {table} UNION ALL SELECT max(id) FROM {archive})"
+        ).bindparams(name=table))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in ARCHIVED_TABLES:
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': False}):
+            pass
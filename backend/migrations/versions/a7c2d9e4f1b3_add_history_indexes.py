@@ -0,0 +1,32 @@
+"""Add composite indexes for job and payment history
+
+Revision ID: a7c2d9e4f1b3
+Revises: 89e4824ed01a
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c2d9e4f1b3'
+down_revision: Union[str, Sequence[str], None] = '89e4824ed01a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Keyset pagination of a user's history and status-filtered queue scans
+    op.create_index('ix_jobs_user_id_created_at', 'jobs', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_jobs_status_created_at', 'jobs', ['status', 'created_at'], unique=False)
+    op.create_index('ix_payments_user_id_created_at', 'payments', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_payments_user_id_created_at', table_name='payments')
+    op.drop_index('ix_jobs_status_created_at', table_name='jobs')
+    op.drop_index('ix_jobs_user_id_created_at', table_name='jobs')
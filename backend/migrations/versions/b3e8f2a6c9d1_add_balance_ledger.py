@@ -0,0 +1,42 @@
+"""Add append-only balance ledger
+
+Revision ID: b3e8f2a6c9d1
+Revises: a7c2d9e4f1b3
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e8f2a6c9d1'
+down_revision: Union[str, Sequence[str], None] = 'a7c2d9e4f1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('balance_ledger',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('delta', sa.Float(), nullable=False),
+    sa.Column('balance_after', sa.Float(), nullable=False),
+    sa.Column('reason', sa.String(length=255), nullable=True),
+    sa.Column('reference', sa.String(length=100), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_balance_ledger_id'), 'balance_ledger', ['id'], unique=False)
+    op.create_index('ix_balance_ledger_user_id_id', 'balance_ledger', ['user_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_balance_ledger_user_id_id', table_name='balance_ledger')
+    op.drop_index(op.f('ix_balance_ledger_id'), table_name='balance_ledger')
+    op.drop_table('balance_ledger')
@@ -0,0 +1,42 @@
+"""Add payment webhook events for idempotent YuKassa processing
+
+Revision ID: c4f9a1d7e2b8
+Revises: b3e8f2a6c9d1
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f9a1d7e2b8'
+down_revision: Union[str, Sequence[str], None] = 'b3e8f2a6c9d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('payment_webhook_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('yukassa_payment_id', sa.String(length=100), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('yukassa_payment_id', 'status', name='uq_payment_webhook_events_payment_status')
+    )
+    op.create_index(op.f('ix_payment_webhook_events_id'), 'payment_webhook_events', ['id'], unique=False)
+    op.create_index('ix_payment_webhook_events_processed_at', 'payment_webhook_events', ['processed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_payment_webhook_events_processed_at', table_name='payment_webhook_events')
+    op.drop_index(op.f('ix_payment_webhook_events_id'), table_name='payment_webhook_events')
+    op.drop_table('payment_webhook_events')
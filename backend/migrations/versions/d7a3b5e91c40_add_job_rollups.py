@@ -0,0 +1,57 @@
+"""Add job rollups and analytics watermarks
+
+Revision ID: d7a3b5e91c40
+Revises: c4f9a1d7e2b8
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a3b5e91c40'
+down_revision: Union[str, Sequence[str], None] = 'c4f9a1d7e2b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('job_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=10), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('dimension', sa.String(length=20), nullable=False),
+    sa.Column('key', sa.String(length=50), nullable=False),
+    sa.Column('jobs', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Integer(), nullable=False),
+    sa.Column('failed', sa.Integer(), nullable=False),
+    sa.Column('cancelled', sa.Integer(), nullable=False),
+    sa.Column('latency_sum', sa.Float(), nullable=False),
+    sa.Column('latency_histogram', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('granularity', 'bucket_start', 'dimension', 'key', name='uq_job_rollups_bucket')
+    )
+    op.create_index(op.f('ix_job_rollups_id'), 'job_rollups', ['id'], unique=False)
+    op.create_index('ix_job_rollups_dimension_bucket', 'job_rollups', ['granularity', 'dimension', 'bucket_start'], unique=False)
+    op.create_table('analytics_watermarks',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_index('ix_jobs_created_at', 'jobs', ['created_at'], unique=False)
+    op.create_index('ix_jobs_updated_at', 'jobs', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_updated_at', table_name='jobs')
+    op.drop_index('ix_jobs_created_at', table_name='jobs')
+    op.drop_table('analytics_watermarks')
+    op.drop_index('ix_job_rollups_dimension_bucket', table_name='job_rollups')
+    op.drop_index(op.f('ix_job_rollups_id'), table_name='job_rollups')
+    op.drop_table('job_rollups')
@@ -0,0 +1,36 @@
+"""Add preset_key and workflow_type to jobs
+
+Revision ID: e2c6a8f4b1d9
+Revises: d7a3b5e91c40
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2c6a8f4b1d9'
+down_revision: Union[str, Sequence[str], None] = 'd7a3b5e91c40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    Existing rows keep NULL; fill them with scripts/backfill_job_presets.py.
+    """
+    op.add_column('jobs', sa.Column('preset_key', sa.String(length=50), nullable=True))
+    op.add_column('jobs', sa.Column('workflow_type', sa.String(length=50), nullable=True))
+    op.create_index('ix_jobs_preset_key_created_at', 'jobs', ['preset_key', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_preset_key_created_at', table_name='jobs')
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.drop_column('workflow_type')
+        batch_op.drop_column('preset_key')
@@ -0,0 +1,86 @@
+"""Add archive tables for settled jobs, payments and payment logs
+
+Revision ID: f5b8d2c7a3e6
+Revises: e2c6a8f4b1d9
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5b8d2c7a3e6'
+down_revision: Union[str, Sequence[str], None] = 'e2c6a8f4b1d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('jobs_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('image_path', sa.String(length=255), nullable=True),
+    sa.Column('second_image_path', sa.String(length=255), nullable=True),
+    sa.Column('prompt', sa.Text(), nullable=True),
+    sa.Column('preset_key', sa.String(length=50), nullable=True),
+    sa.Column('workflow_type', sa.String(length=50), nullable=True),
+    sa.Column('status', sa.Enum('queued', 'processing', 'completed', 'failed', 'cancelled', name='jobstatus'), nullable=True),
+    sa.Column('result_path', sa.String(length=255), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('retry_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_jobs_archive_user_id_created_at', 'jobs_archive', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_jobs_archive_created_at', 'jobs_archive', ['created_at'], unique=False)
+
+    op.create_table('payments_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('yukassa_payment_id', sa.String(length=100), nullable=True),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('currency', sa.String(length=3), nullable=True),
+    sa.Column('status', sa.Enum('pending', 'succeeded', 'failed', 'cancelled', name='paymentstatus'), nullable=True),
+    sa.Column('payment_type', sa.Enum('payment', 'weekly_bonus', 'refund', 'promocode', name='paymenttype'), nullable=True),
+    sa.Column('payment_method', sa.String(length=50), nullable=True),
+    sa.Column('payment_method_details', sa.Text(), nullable=True),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('confirmation_url', sa.String(length=500), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('paid_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_payments_archive_yukassa_payment_id'), 'payments_archive', ['yukassa_payment_id'], unique=False)
+    op.create_index('ix_payments_archive_user_id_created_at', 'payments_archive', ['user_id', 'created_at'], unique=False)
+
+    op.create_table('payment_logs_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=True),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('payment_id', sa.String(length=100), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_payment_logs_archive_user_id_created_at', 'payment_logs_archive', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema (archived rows are dropped with the tables)."""
+    op.drop_index('ix_payment_logs_archive_user_id_created_at', table_name='payment_logs_archive')
+    op.drop_table('payment_logs_archive')
+    op.drop_index('ix_payments_archive_user_id_created_at', table_name='payments_archive')
+    op.drop_index(op.f('ix_payments_archive_yukassa_payment_id'), table_name='payments_archive')
+    op.drop_table('payments_archive')
+    op.drop_index('ix_jobs_archive_created_at', table_name='jobs_archive')
+    op.drop_index('ix_jobs_archive_user_id_created_at', table_name='jobs_archive')
+    op.drop_table('jobs_archive')
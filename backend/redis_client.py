@@ -2,6 +2,7 @@ import logging
 from typing import Optional, List, Dict, Any
 import json
 import asyncio
+import time
 from redis.asyncio import Redis
 from app.config import settings
 
@@ -142,33 +143,306 @@ class RedisQueueClient:
         
         return jobs
     
-    async def update_job_status(self, job_id: int, status: str, **kwargs) -> bool:
-        """Update job status in Redis"""
+    def _job_state_key(self, job_id: int) -> str:
+        return f"{settings.REDIS_JOB_STATE_KEY_PREFIX}:{job_id}"
+
+    async def set_job_state(self, job_id: int, fields: Dict[str, Any]) -> bool:
+        """Write fields of the job's state hash in one MULTI/EXEC and refresh its TTL.
+
+        None values delete the field, so a cleared error or result does not
+        linger from an earlier attempt.
+        """
         if not self.redis:
             raise RuntimeError("Redis client not connected")
-        
-        # Update job status - for now just log that this would happen
-        logger.info(f"Job {job_id} status would be updated to {status} in Redis with data: {kwargs}")
+
+        key = self._job_state_key(job_id)
+        present = {name: str(value) for name, value in fields.items() if value is not None}
+        cleared = [name for name, value in fields.items() if value is None]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if present:
+                pipe.hset(key, mapping=present)
+            if cleared:
+                pipe.hdel(key, *cleared)
+            pipe.expire(key, settings.REDIS_JOB_STATE_TTL)
+            await pipe.execute()
         return True
+
+    async def get_job_state(self, job_id: int) -> Dict[str, str]:
+        """The job's state hash, empty when unknown or expired"""
+        if not self.redis:
+            raise RuntimeError("Redis client not connected")
+
+        state = await self.redis.hgetall(self._job_state_key(job_id))
+        return {name.decode('utf-8'): value.decode('utf-8') for name, value in state.items()}
+
+    async def update_job_status(self, job_id: int, status: str, **kwargs) -> bool:
+        """Record a worker-side status transition, with the time the job entered the stage.
+
+        Written under "worker_" names like the worker does: the unprefixed
+        fields hold the committed JobResponse and change only through
+        job_events.store_job_state.
+        """
+        now = time.time()
+        fields = {'status': status, f'{status}_at': now, 'state_updated_at': now, **kwargs}
+        return await self.set_job_state(job_id, {f'worker_{name}': value for name, value in fields.items()})
     
     async def set_job_result(self, job_id: int, result_path: str) -> bool:
-        """Store job result in Redis"""
+        """Store job result in the job's state hash (worker fields)"""
+        await self.set_job_state(job_id, {'worker_result_path': result_path, 'worker_completed_at': time.time()})
+        logger.info(f"Job {job_id} result stored in Redis")
+        return True
+
+    def _job_events_channel(self, job_id: int) -> str:
+        return f"{settings.REDIS_JOB_EVENTS_CHANNEL_PREFIX}:{job_id}"
+
+    async def publish_job_event(self, job_id: int, payload: str) -> int:
+        """Announce a job status transition to its subscribers; returns their count"""
+        if not self.redis:
+            return 0
+
+        return await self.redis.publish(self._job_events_channel(job_id), payload)
+
+    async def subscribe_job_events(self, job_id: int):
+        """PubSub subscribed to one job's transitions; the caller closes it"""
         if not self.redis:
             raise RuntimeError("Redis client not connected")
-        
-        result_data = {
-            'job_id': job_id,
-            'result_path': result_path,
-            'completed_at': asyncio.get_event_loop().time()
-        }
-        
+
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self._job_events_channel(job_id))
+        return pubsub
+
+    async def remove_queued_job(self, job_id: int) -> bool:
+        """Remove a job from the queue before a worker picks it up"""
+        if not await self._ensure_connected():
+            raise RuntimeError("Redis client not connected and reconnect failed")
+
+        # Queue items are JSON blobs, so find the exact payload before LREM
+        job_jsons = await self.redis.lrange(settings.REDIS_JOB_QUEUE_KEY, 0, -1)
+        removed = 0
+        for job_json in job_jsons:
+            try:
+                job_data = json.loads(job_json.decode('utf-8'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            if job_data.get('id') == job_id:
+                removed += await self.redis.lrem(settings.REDIS_JOB_QUEUE_KEY, 0, job_json)
+
+        if removed:
+            logger.info(f"Job {job_id} removed from Redis queue")
+        else:
+            logger.info(f"Job {job_id} not found in Redis queue (already dequeued)")
+        return removed > 0
+
+    async def request_job_cancel(self, job_id: int) -> bool:
+        """Flag a job as cancelled so the worker stops or skips it"""
+        if not await self._ensure_connected():
+            raise RuntimeError("Redis client not connected and reconnect failed")
+
         await self.redis.setex(
-            f"job_result:{job_id}",
+            f"job_cancel:{job_id}",
             settings.REDIS_RESULT_TTL,
-            json.dumps(result_data)
+            "1"
         )
-        
-        logger.info(f"Job {job_id} result stored in Redis")
+
+        logger.info(f"Cancel requested for job {job_id} in Redis")
+        return True
+
+    async def get_checkpoint(self, key: str) -> Optional[str]:
+        """Read a progress marker of a resumable background task.
+
+        Raises ConnectionError when Redis is unreachable, so an unreadable
+        marker is never mistaken for one that was never set.
+        """
+        if not await self._ensure_connected():
+            raise ConnectionError("Redis is not available")
+
+        value = await self.redis.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    async def set_checkpoint(self, key: str, value: Any, ttl: int) -> bool:
+        """Store a progress marker of a resumable background task"""
+        if not await self._ensure_connected():
+            return False
+
+        await self.redis.setex(key, ttl, str(value))
+        return True
+
+    def _promocode_ready_key(self) -> str:
+        return f"{settings.REDIS_PROMOCODE_FILTER_KEY}:ready"
+
+    async def promocode_filter_contains(self, code: str) -> Optional[bool]:
+        """Whether an unused promocode exists; None when the set is not built"""
+        if not self.redis:
+            return None
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.exists(self._promocode_ready_key())
+            pipe.sismember(settings.REDIS_PROMOCODE_FILTER_KEY, code)
+            ready, member = await pipe.execute()
+        if not ready:
+            return None
+        return bool(member)
+
+    async def promocode_filter_rebuild(self, unused: List[str], used: List[str]) -> bool:
+        """Sync the set of unused promocodes with the DB and mark it trustworthy.
+
+        Codes are added and removed in place rather than swapped in, so a code
+        created while the rebuild runs is never dropped from the set.
+        """
+        if not await self._ensure_connected():
+            return False
+
+        key = settings.REDIS_PROMOCODE_FILTER_KEY
+        for start in range(0, len(unused), 1000):
+            await self.redis.sadd(key, *unused[start:start + 1000])
+        for start in range(0, len(used), 1000):
+            await self.redis.srem(key, *used[start:start + 1000])
+        await self.redis.setex(self._promocode_ready_key(), settings.PROMOCODE_FILTER_TTL, "1")
+        logger.info(f"Promocode filter rebuilt with {len(unused)} codes")
+        return True
+
+    async def promocode_filter_add(self, codes: List[str]) -> bool:
+        """Register new promocodes; False when they may be missing from the set"""
+        if not codes:
+            return True
+        if not await self._ensure_connected():
+            return False
+
+        try:
+            for start in range(0, len(codes), 1000):
+                await self.redis.sadd(settings.REDIS_PROMOCODE_FILTER_KEY, *codes[start:start + 1000])
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to add promocodes to filter: {e}")
+            return False
+
+    async def promocode_filter_invalidate(self) -> bool:
+        """Mark the set untrustworthy so lookups fall back to the DB until a rebuild"""
+        if not await self._ensure_connected():
+            return False
+
+        await self.redis.delete(self._promocode_ready_key())
+        return True
+
+    async def promocode_filter_remove(self, code: str) -> bool:
+        """Forget a redeemed promocode"""
+        if not self.redis:
+            return False
+
+        await self.redis.srem(settings.REDIS_PROMOCODE_FILTER_KEY, code)
+        return True
+
+    async def get_balance_snapshot(self, user_id: int) -> Optional[float]:
+        """Last known balance written after a ledger operation"""
+        if not self.redis:
+            return None
+
+        value = await self.redis.get(f"{settings.REDIS_BALANCE_KEY_PREFIX}:{user_id}")
+        return float(value) if value is not None else None
+
+    async def set_balance_snapshot(self, user_id: int, balance: float) -> bool:
+        if not self.redis:
+            return False
+
+        await self.redis.setex(
+            f"{settings.REDIS_BALANCE_KEY_PREFIX}:{user_id}",
+            settings.BALANCE_SNAPSHOT_TTL,
+            str(balance)
+        )
+        return True
+
+    async def set_balance_snapshots(self, balances: Dict[int, float]) -> bool:
+        """Write many balance snapshots in one pipelined round trip"""
+        if not balances or not self.redis:
+            return False
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id, balance in balances.items():
+                pipe.setex(f"{settings.REDIS_BALANCE_KEY_PREFIX}:{user_id}", settings.BALANCE_SNAPSHOT_TTL, str(balance))
+            await pipe.execute()
+        return True
+
+    async def cache_get(self, key: str) -> Optional[bytes]:
+        """Read-through cache lookup; raises when Redis is unavailable"""
+        if not self.redis:
+            raise RuntimeError("Redis client not connected")
+
+        return await self.redis.get(key)
+
+    async def cache_set(self, key: str, value: Any, ttl: int) -> bool:
+        if not self.redis:
+            return False
+
+        await self.redis.setex(key, ttl, value)
+        return True
+
+    async def cache_delete(self, *keys: str) -> int:
+        if not self.redis or not keys:
+            return 0
+
+        return await self.redis.delete(*keys)
+
+    async def push_telegram_update(self, update_id: int, payload: bytes) -> bool:
+        """Append a raw Telegram update to the stream; False if update_id was seen already.
+
+        The seen-marker is set with NX before XADD and removed again if XADD
+        fails, so a Telegram retry of the same update is enqueued exactly once.
+        """
+        if not await self._ensure_connected():
+            raise RuntimeError("Redis client not connected")
+
+        stream = settings.REDIS_TELEGRAM_UPDATES_STREAM
+        seen_key = f"{stream}:seen:{update_id}"
+        if not await self.redis.set(seen_key, "1", nx=True, ex=settings.TELEGRAM_UPDATE_DEDUPE_TTL):
+            return False
+        try:
+            await self.redis.xadd(
+                stream,
+                {"update_id": str(update_id), "payload": payload},
+                maxlen=settings.TELEGRAM_UPDATES_STREAM_MAXLEN,
+                approximate=True
+            )
+        except Exception:
+            await self.redis.delete(seen_key)
+            raise
+        return True
+
+    async def ensure_telegram_update_group(self, group: str):
+        """Create the consumer group (and the stream) if missing"""
+        if not await self._ensure_connected():
+            raise RuntimeError("Redis client not connected")
+
+        try:
+            await self.redis.xgroup_create(settings.REDIS_TELEGRAM_UPDATES_STREAM, group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def read_telegram_updates(self, group: str, consumer: str, count: int, block_ms: int) -> List[tuple]:
+        """New (entry_id, fields) pairs for this consumer, blocking up to block_ms"""
+        if not self.redis:
+            raise RuntimeError("Redis client not connected")
+
+        response = await self.redis.xreadgroup(
+            group, consumer, {settings.REDIS_TELEGRAM_UPDATES_STREAM: ">"}, count=count, block=block_ms
+        )
+        return response[0][1] if response else []
+
+    async def claim_stale_telegram_updates(self, group: str, consumer: str, min_idle_ms: int, count: int) -> List[tuple]:
+        """Take over updates left unacknowledged by a consumer that died"""
+        if not self.redis:
+            return []
+
+        result = await self.redis.xautoclaim(
+            settings.REDIS_TELEGRAM_UPDATES_STREAM, group, consumer, min_idle_ms, start_id="0-0", count=count
+        )
+        return [entry for entry in result[1] if entry[1]]
+
+    async def ack_telegram_update(self, group: str, entry_id) -> bool:
+        if not self.redis:
+            return False
+
+        await self.redis.xack(settings.REDIS_TELEGRAM_UPDATES_STREAM, group, entry_id)
         return True
 
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Fill jobs.preset_key and jobs.workflow_type on rows created before they were recorded.
+
+Prompts are matched against the current presets (normalised-prompt hash
+map, then Aho-Corasick for preset prompts contained in a longer prompt).
+Rows are processed in id order, one transaction per chunk, so the script
+can be stopped and rerun at any time; it only touches rows still NULL.
+updated_at is left as it was, so analytics latencies are not disturbed.
+
+Usage:
+    python scripts/backfill_job_presets.py [--chunk-size 1000] [--dry-run]
+"""
+
+import argparse
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import bindparam, select, update
+
+from app import models
+from app.database import SessionLocal
+from app.services.preset_matching import PresetMatcher
+
+
+def backfill(chunk_size: int, dry_run: bool) -> Counter:
+    with SessionLocal() as db:
+        matcher = PresetMatcher(db.scalars(select(models.Preset)).all())
+
+    stmt = (
+        update(models.Job)
+        .where(models.Job.id == bindparam('job_id'), models.Job.preset_key.is_(None))
+        # Setting updated_at to itself keeps the column's onupdate from firing
+        .values(
+            preset_key=bindparam('key'),
+            workflow_type=bindparam('workflow'),
+            updated_at=models.Job.updated_at
+        )
+    )
+
+    totals = Counter()
+    last_id = 0
+    while True:
+        started = time.monotonic()
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(models.Job.id, models.Job.prompt)
+                .where(models.Job.id > last_id, models.Job.preset_key.is_(None))
+                .order_by(models.Job.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+
+            params = []
+            for row in rows:
+                identity = matcher.identify(row.prompt)
+                totals['custom' if identity.preset_key == 'custom' else 'preset'] += 1
+                params.append({'job_id': row.id, 'key': identity.preset_key, 'workflow': identity.workflow_type})
+
+            if not dry_run:
+                db.connection().execute(stmt, params)
+                db.commit()
+
+        last_id = rows[-1].id
+        totals['rows'] += len(rows)
+        print(f"  ... up to job {last_id}: {len(rows)} rows in {time.monotonic() - started:.2f}s")
+
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill preset_key/workflow_type on legacy jobs")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="match and count without writing")
+    args = parser.parse_args()
+
+    totals = backfill(args.chunk_size, args.dry_run)
+    action = "Would update" if args.dry_run else "Updated"
+    print(f"{action} {totals['rows']} jobs: {totals['preset']} matched a preset, {totals['custom']} custom")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Benchmark SQLite write throughput on a scratch database.
+
+Compares three setups with concurrent read-then-write transactions
+(the shape of a worker status update):
+  1. default    - engine as before: only check_same_thread=False
+  2. profile    - WAL, synchronous=NORMAL, cache/mmap, busy_timeout
+  3. queue      - profile + single-writer WriteQueue with batched commits
+
+Usage:
+    python scripts/benchmark_sqlite_writes.py [--writers 8] [--writes 200]
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.config import settings
+from app.database import Base, configure_sqlite
+from app.services.write_queue import WriteQueue
+
+
+def make_session_factory(db_path: Path, profile: bool):
+    connect_args = {"check_same_thread": False}
+    if profile:
+        connect_args["timeout"] = settings.SQLITE_BUSY_TIMEOUT_MS / 1000
+    engine = create_engine(f"sqlite:///{db_path}", connect_args=connect_args)
+    if profile:
+        configure_sqlite(engine)
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+def write_op(writer: int, i: int):
+    def apply(db):
+        # Read first, like update_job_status does, then write
+        db.query(models.Job).filter(models.Job.user_id == writer).order_by(models.Job.id.desc()).first()
+        db.add(models.Job(
+            user_id=writer,
+            image_path=f"bench_{writer}_{i}.png",
+            prompt="benchmark",
+            status=models.JobStatus.queued,
+        ))
+    return apply
+
+
+def run_threaded(session_factory, writers: int, writes: int):
+    errors = 0
+    errors_lock = threading.Lock()
+
+    def writer(n: int):
+        nonlocal errors
+        for i in range(writes):
+            db = session_factory()
+            try:
+                write_op(n, i)(db)
+                db.commit()
+            except OperationalError:
+                db.rollback()
+                with errors_lock:
+                    errors += 1
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, errors
+
+
+async def run_queued(session_factory, writers: int, writes: int):
+    queue = WriteQueue(session_factory)
+    await queue.start()
+    errors = 0
+
+    async def writer(n: int):
+        nonlocal errors
+        for i in range(writes):
+            try:
+                await queue.submit(write_op(n, i))
+            except OperationalError:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    elapsed = time.perf_counter() - started
+    await queue.stop()
+    return elapsed, errors, queue.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite write throughput benchmark")
+    parser.add_argument("--writers", type=int, default=8, help="concurrent writers")
+    parser.add_argument("--writes", type=int, default=200, help="writes per writer")
+    args = parser.parse_args()
+    total = args.writers * args.writes
+
+    print(f"{args.writers} writers x {args.writes} writes = {total} transactions\n")
+    print(f"{'setup':<10} {'seconds':>9} {'writes/s':>10} {'locked':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, profile in (("default", False), ("profile", True)):
+            engine, factory = make_session_factory(Path(tmp) / f"{name}.db", profile)
+            elapsed, errors = run_threaded(factory, args.writers, args.writes)
+            engine.dispose()
+            print(f"{name:<10} {elapsed:>9.2f} {(total - errors) / elapsed:>10.0f} {errors:>8}")
+
+        engine, factory = make_session_factory(Path(tmp) / "queue.db", True)
+        elapsed, errors, stats = asyncio.run(run_queued(factory, args.writers, args.writes))
+        engine.dispose()
+        print(f"{'queue':<10} {elapsed:>9.2f} {(total - errors) / elapsed:>10.0f} {errors:>8}")
+        print(f"\nqueue: {stats['batches']} commits for {stats['writes']} writes")
+
+
+if __name__ == "__main__":
+    main()
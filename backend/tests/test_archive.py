@@ -0,0 +1,50 @@
+"""Archiving the newest rows must not let their ids be handed out again"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import models
+from app.database import Base
+from app.services.archive import TARGETS, archive_chunk
+
+JOBS = next(target for target in TARGETS if target.name == "jobs")
+
+
+def _old_job(created_at: datetime) -> models.Job:
+    return models.Job(user_id=1, prompt="p", status=models.JobStatus.completed, created_at=created_at)
+
+
+async def _archive_newest_then_insert(db_path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    old = datetime.utcnow() - timedelta(days=60)
+    cutoff = datetime.utcnow() - timedelta(days=30)
+    async with session_factory() as db:
+        db.add(models.User(user_id=1, telegram_id=1, balance=0))
+        db.add_all([_old_job(old + timedelta(minutes=i)) for i in range(3)])
+        await db.commit()
+
+        # Every job is settled and old: the newest ids leave the hot table
+        assert await archive_chunk(db, JOBS, cutoff, chunk_size=10) == 3
+        archived_max = await db.scalar(select(func.max(models.JobArchive.id)))
+
+        job = _old_job(old)
+        db.add(job)
+        await db.commit()
+        assert job.id > archived_max
+
+        # The next run moves the new row too instead of failing on a duplicate id
+        assert await archive_chunk(db, JOBS, cutoff, chunk_size=10) == 1
+        assert await db.scalar(select(func.count()).select_from(models.JobArchive)) == 4
+        assert await db.scalar(select(models.Job.id).where(models.Job.id == job.id)) is None
+    await engine.dispose()
+
+
+def test_archived_ids_are_not_reused(tmp_path):
+    asyncio.run(_archive_newest_then_insert(str(tmp_path / "archive.db")))
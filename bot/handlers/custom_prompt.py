@@ -9,7 +9,7 @@ from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 
 from ..states import UserState
-from ..keyboards import cancel_keyboard, main_menu_keyboard, main_menu_inline_keyboard, custom_prompt_type_keyboard, back_and_main_menu_keyboard
+from ..keyboards import cancel_keyboard, main_menu_inline_keyboard, custom_prompt_type_keyboard, back_and_main_menu_keyboard, job_cancel_keyboard
 from ..utils import download_telegram_photo, send_error_message
 
 logger = logging.getLogger(__name__)
@@ -141,6 +141,7 @@ async def handle_custom_prompt(message: types.Message, state: FSMContext):
                 telegram_id=message.from_user.id,
                 image_file=file_tuple,
                 prompt=prompt_text,
+                preset_key="custom",
             )
 
             job_id = job_data.get("id")
@@ -149,7 +150,7 @@ async def handle_custom_prompt(message: types.Message, state: FSMContext):
                 "✅ Фото отправлено на обработку!\n\n"
                 f"ID задачи: {job_id}\n"
                 "Результат будет готов в течение нескольких минут.",
-                reply_markup=main_menu_keyboard(),
+                reply_markup=job_cancel_keyboard(job_id),
             )
 
             await state.clear()
@@ -418,7 +419,8 @@ async def handle_custom_prompt_2_photos(message: types.Message, state: FSMContex
                 telegram_id=message.from_user.id,
                 image_file=f1_tuple,
                 prompt=prompt_text,
-                second_image_file=f2_tuple
+                second_image_file=f2_tuple,
+                preset_key="custom"
             )
             
             job_id = job_data.get('id')
@@ -427,7 +429,7 @@ async def handle_custom_prompt_2_photos(message: types.Message, state: FSMContex
                 f"✅ Фото отправлены на обработку!\n\n"
                 f"ID задачи: {job_id}\n"
                 f"Результат будет готов в течение нескольких минут.",
-                reply_markup=main_menu_keyboard(),
+                reply_markup=job_cancel_keyboard(job_id),
             )
             
             await state.clear()
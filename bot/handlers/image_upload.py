@@ -7,7 +7,7 @@ from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import StateFilter
 from ..states import UserState
-from ..keyboards import main_menu_keyboard, main_menu_inline_keyboard, cancel_keyboard, back_and_main_menu_keyboard
+from ..keyboards import main_menu_keyboard, main_menu_inline_keyboard, cancel_keyboard, back_and_main_menu_keyboard, job_cancel_keyboard
 from ..utils import download_telegram_photo, send_error_message
 
 logger = logging.getLogger(__name__)
@@ -152,7 +152,8 @@ async def confirm_processing(callback: types.CallbackQuery, state: FSMContext):
             job_data = await api_client.create_job(
                 telegram_id=callback.from_user.id,
                 image_file=file_tuple,
-                prompt=prompt
+                prompt=prompt,
+                preset_key="custom" if custom_prompt or not selected_preset else str(selected_preset.get("id"))
             )
             
             job_id = job_data.get('id')
@@ -173,7 +174,7 @@ async def confirm_processing(callback: types.CallbackQuery, state: FSMContext):
                 f"ID задачи: {job_id}\n"
                 f"Статус: ⏳ В очереди\n\n"
                 f"Как результат будет готов, вы получите уведомление.",
-                reply_markup=main_menu_inline_keyboard()
+                reply_markup=job_cancel_keyboard(job_id)
             )
             
             logger.info(f"Job {job_id} created for user {callback.from_user.id} with prompt: {prompt[:50]}...")
@@ -209,6 +210,33 @@ async def cancel_processing(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("Произошла ошибка", show_alert=True)
 
 
+@router.callback_query(F.data.startswith("cancel_job_"))
+async def cancel_job(callback: types.CallbackQuery, state: FSMContext):
+    """Cancel a submitted job from the "job accepted" message"""
+    try:
+        from ..main import api_client
+        
+        job_id = int(callback.data.split("_")[2])
+        job = await api_client.cancel_job(callback.from_user.id, job_id)
+        
+        if not job:
+            await callback.answer("Не удалось отменить задачу: возможно, она уже завершена", show_alert=True)
+            return
+        
+        await state.set_state(UserState.main_menu)
+        
+        await callback.message.edit_text(
+            f"🚫 Задача {job_id} отменена.\n\nВы в главном меню.",
+            reply_markup=main_menu_inline_keyboard()
+        )
+        
+        await callback.answer("Задача отменена")
+        
+    except Exception as e:
+        logger.error(f"Error cancelling job: {e}")
+        await callback.answer("Произошла ошибка", show_alert=True)
+
+
 @router.message(StateFilter(UserState.awaiting_image_for_preset), ~F.photo)
 async def handle_wrong_input(message: types.Message, state: FSMContext):
     """Handle wrong input when expecting photo for preset"""
@@ -7,7 +7,6 @@ from ..states import UserState
 from ..keyboards import (
     edit_photo_submenu_keyboard,
     category_keyboard,
-    main_menu_keyboard,
     main_menu_inline_keyboard,
     back_and_main_menu_keyboard,
     fitting_room_instructions_keyboard,
@@ -43,6 +42,7 @@ from ..keyboards import (
     appearance_updo_keyboard,
     appearance_braids_keyboard,
     appearance_stylistic_keyboard,
+    job_cancel_keyboard,
 )
 from ..utils import send_error_message
 
@@ -2683,7 +2683,8 @@ async def handle_second_fitting_photo(message: types.Message, state: FSMContext)
                 telegram_id=message.from_user.id,
                 image_file=f1_tuple,
                 prompt=fitting_prompt,
-                second_image_file=f2_tuple
+                second_image_file=f2_tuple,
+                preset_key="fitting"
             )
             
             job_id = job_data.get('id')
@@ -2693,7 +2694,7 @@ async def handle_second_fitting_photo(message: types.Message, state: FSMContext)
                 f"ID задачи: {job_id}\n"
                 f"Результат будет готов в течение нескольких минут.\n\n"
                 f"С вашего баланса списано 30 баллов.",
-                reply_markup=main_menu_keyboard()
+                reply_markup=job_cancel_keyboard(job_id)
             )
             await state.clear()
             await state.set_state(UserState.main_menu)
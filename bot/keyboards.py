@@ -436,6 +436,16 @@ def cancel_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+# Job Cancel Keyboard (Inline) - attached to the "job accepted" message
+def job_cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    """Create keyboard with a button to cancel a submitted job"""
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="🚫 Отменить задачу", callback_data=f"cancel_job_{job_id}"))
+    builder.row(InlineKeyboardButton(text="🏠 Главное меню", callback_data="back_to_menu"))
+    
+    return builder.as_markup()
+
+
 # Promocode Keyboard (Inline)
 def promocode_keyboard() -> InlineKeyboardMarkup:
     """Create promocode keyboard"""
@@ -2,7 +2,7 @@
 
 import aiohttp
 import logging
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from ..config import settings
 
 logger = logging.getLogger(__name__)
@@ -14,6 +14,30 @@ class BackendAPIClient:
     def __init__(self):
         self.base_url = settings.BACKEND_URL
         self.timeout = aiohttp.ClientTimeout(total=settings.BACKEND_API_TIMEOUT)
+        # Preset responses by request path, revalidated with If-None-Match
+        self._preset_cache: Dict[str, Tuple[str, Any]] = {}
+    
+    async def _get_revalidated(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """GET with a client-side cache: a 304 reuses the stored body"""
+        cache_key = endpoint + ("?" + "&".join(f"{k}={v}" for k, v in sorted(params.items())) if params else "")
+        cached = self._preset_cache.get(cache_key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        url = f"{self.base_url}{endpoint}"
+        
+        try:
+            async with aiohttp.ClientSession(timeout=self.timeout) as session:
+                async with session.get(url, params=params, headers=headers) as response:
+                    if response.status == 304 and cached:
+                        return cached[1]
+                    response.raise_for_status()
+                    body = await response.json()
+                    etag = response.headers.get("ETag")
+                    if etag:
+                        self._preset_cache[cache_key] = (etag, body)
+                    return body
+        except aiohttp.ClientError as e:
+            logger.error(f"Backend API request failed: GET {url} - {e}")
+            raise Exception(f"Failed to connect to backend: {str(e)}")
     
     async def _request(
         self,
@@ -45,8 +69,8 @@ class BackendAPIClient:
                         response.raise_for_status()
                         return await response.json()
                 else:
-                    # For GET requests
-                    async with session.get(url, params=params) as response:
+                    # For GET requests (and bodiless POSTs such as job cancel)
+                    async with session.request(method, url, params=params) as response:
                         response.raise_for_status()
                         return await response.json()
                         
@@ -120,8 +144,7 @@ class BackendAPIClient:
     async def get_preset(self, preset_id: int) -> Optional[Dict[str, Any]]:
         """Get preset by ID"""
         try:
-            response = await self._request("GET", f"/api/presets/{preset_id}")
-            return response
+            return await self._get_revalidated(f"/api/presets/{preset_id}")
         except Exception as e:
             logger.error(f"Failed to get preset {preset_id}: {e}")
             return None
@@ -130,8 +153,7 @@ class BackendAPIClient:
         """Get presets, optionally filtered by category"""
         try:
             params = {"category": category} if category else {}
-            response = await self._request("GET", "/api/presets", params=params)
-            return response
+            return await self._get_revalidated("/api/presets/", params=params)
         except Exception as e:
             logger.error(f"Failed to get presets (category: {category}): {e}")
             return []
@@ -139,7 +161,7 @@ class BackendAPIClient:
     async def get_preset_prompt(self, preset_id: int) -> Optional[str]:
         """Get preset prompt by ID"""
         try:
-            response = await self._request("GET", f"/api/presets/{preset_id}")
+            response = await self._get_revalidated(f"/api/presets/{preset_id}")
             return response.get('prompt')
         except Exception as e:
             logger.error(f"Failed to get preset prompt for {preset_id}: {e}")
@@ -150,7 +172,8 @@ class BackendAPIClient:
         telegram_id: int,
         image_file: tuple,  # (filename, file_content, content_type)
         prompt: str,
-        second_image_file: Optional[tuple] = None  # (filename, file_content, content_type)
+        second_image_file: Optional[tuple] = None,  # (filename, file_content, content_type)
+        preset_key: Optional[str] = None  # preset id, "custom" or "fitting"
     ) -> Dict[str, Any]:
         """Create a new job with prompt by telegram_id"""
         try:
@@ -180,6 +203,8 @@ class BackendAPIClient:
                 'user_id': user_id,
                 'prompt': prompt
             }
+            if preset_key:
+                params['preset_key'] = preset_key
             
             # Don't add admin flag to params since we removed the parameter from backend endpoint
             # The admin status is determined by checking the telegram_id in the backend
@@ -201,10 +226,33 @@ class BackendAPIClient:
             logger.error(f"Failed to get job status {job_id}: {e}")
             return None
     
-    async def get_user_jobs(self, telegram_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get user's jobs by telegram_id"""
+    async def cancel_job(self, telegram_id: int, job_id: int) -> Optional[Dict[str, Any]]:
+        """Cancel a queued or running job on behalf of the user"""
+        try:
+            # Get user by telegram_id so the backend can check job ownership
+            user_data = await self.get_user(telegram_id)
+            if not user_data:
+                raise Exception(f"User with telegram_id {telegram_id} not found")
+            
+            user_id = user_data['user_id']
+            
+            response = await self._request(
+                "POST",
+                f"/api/jobs/{job_id}/cancel",
+                params={"user_id": user_id}
+            )
+            logger.info(f"Job {job_id} cancelled for user {telegram_id} (internal user_id {user_id})")
+            return response
+        except Exception as e:
+            logger.error(f"Failed to cancel job {job_id} for user by telegram_id {telegram_id}: {e}")
+            return None
+    
+    async def get_user_jobs(self, telegram_id: int, limit: int = 10, cursor: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get user's jobs by telegram_id (pass the last job id as cursor for the next page)"""
         try:
             params = {"limit": limit}
+            if cursor is not None:
+                params["cursor"] = cursor
             response = await self._request("GET", f"/api/jobs/user/{telegram_id}", params=params)
             return response
         except Exception as e:
@@ -250,18 +298,21 @@ class BackendAPIClient:
         telegram_id: int,
         limit: int = 20,
         offset: int = 0,
-        status: Optional[str] = None
+        status: Optional[str] = None,
+        cursor: Optional[int] = None
     ) -> Dict[str, Any]:
-        """Get user's payment history by telegram_id"""
+        """Get user's payment history by telegram_id (cursor = next_cursor of the previous page)"""
         try:
             params = {"limit": limit, "offset": offset}
             if status:
                 params["status"] = status
+            if cursor is not None:
+                params["cursor"] = cursor
             response = await self._request("GET", f"/api/payments/user/{telegram_id}", params=params)
             return response
         except Exception as e:
             logger.error(f"Failed to get payments for user by telegram_id {telegram_id}: {e}")
-            return {"payments": [], "total": 0, "limit": limit, "offset": offset}
+            return {"payments": [], "total": 0, "limit": limit, "offset": offset, "next_cursor": None}
     
     async def use_promocode(self, telegram_id: int, code: str) -> Dict[str, Any]:
         """Use a promocode by telegram_id"""
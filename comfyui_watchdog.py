@@ -2,6 +2,11 @@
 """
 ComfyUI Watchdog - предотвращает "засыпание" ComfyUI процесса
 Отправляет периодические keep-alive запросы к ComfyUI API
+
+УСТАРЕЛО: keep-alive встроен в worker (worker/services/comfyui_keepalive.py)
+и проверяет ComfyUI только когда задачи к нему не обращались.
+Отдельный процесс запускается только с флагом --standalone
+(например, для отладки без worker).
 """
 
 import asyncio
@@ -331,6 +336,13 @@ class ComfyUIWatchdog:
 
 async def main():
     """Главная функция"""
+    if "--standalone" not in sys.argv:
+        logger.warning(
+            "comfyui_watchdog.py is deprecated: the worker runs its own load-aware "
+            "keep-alive (COMFYUI_KEEPALIVE_ENABLED). Use --standalone to run it anyway."
+        )
+        return
+
     # Создаем директорию для логов
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
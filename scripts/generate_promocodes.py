@@ -2,6 +2,8 @@
 """
 Script to generate promocodes and save them to a file.
 Usage: python scripts/generate_promocodes.py
+       python scripts/generate_promocodes.py --count 10000 --amount 100 --output codes.csv
+       python scripts/generate_promocodes.py --import-csv codes.csv
 """
 
 import requests
@@ -42,6 +44,35 @@ def batch_generate_promocodes(amounts: List[int]):
         return None
 
 
+def bulk_generate_to_csv(count: int, amount: int, output: str):
+    """Generate `count` promocodes in one request and stream them into a CSV file"""
+    url = f"{BACKEND_URL}/api/promocodes/batch-generate"
+    data = {"count": count, "amount": amount}
+    
+    with requests.post(url, params={"download": "true"}, json=data, stream=True) as response:
+        if response.status_code != 200:
+            print(f"Error: {response.status_code} - {response.text}")
+            return False
+        with open(output, "wb") as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+    return True
+
+
+def import_promocodes_csv(path: str):
+    """Upload a CSV file with code,amount rows"""
+    url = f"{BACKEND_URL}/api/promocodes/import"
+    
+    with open(path, "rb") as f:
+        response = requests.post(url, files={"file": (path, f, "text/csv")})
+    
+    if response.status_code == 200:
+        return response.json()
+    else:
+        print(f"Error: {response.status_code} - {response.text}")
+        return None
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generate promocodes")
     parser.add_argument(
@@ -60,10 +91,53 @@ def main():
         type=int,
         help="Generate batch of promocodes with specified amounts (e.g., --batch 100 200 300)"
     )
+    parser.add_argument(
+        "--count",
+        type=int,
+        help="Generate this many promocodes of --amount points in one transaction"
+    )
+    parser.add_argument(
+        "--amount",
+        type=int,
+        help="Amount (points) for --count"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="CSV file for --count (default: promocodes_<count>x<amount>.csv)"
+    )
+    parser.add_argument(
+        "--import-csv",
+        type=str,
+        help="Import promocodes from a CSV file with code,amount rows"
+    )
     
     args = parser.parse_args()
     
-    if args.single:
+    if args.import_csv:
+        print(f"Importing promocodes from {args.import_csv}...")
+        result = import_promocodes_csv(args.import_csv)
+        
+        if result:
+            print("\n[OK] Import finished!")
+            print(f"   Imported: {result['imported']}")
+            print(f"   Already existing: {len(result['existing'])}")
+            print(f"   Duplicates in file: {len(result['duplicates'])}")
+            print(f"   Invalid rows: {len(result['invalid'])}")
+            for row in result['invalid'][:20]:
+                print(f"      row {row['row']}: {row['code']} - {row['error']}")
+    
+    elif args.count:
+        if not args.amount:
+            parser.error("--count requires --amount")
+        output = args.output or f"promocodes_{args.count}x{args.amount}.csv"
+        print(f"Generating {args.count} promocodes for {args.amount} points...")
+        
+        if bulk_generate_to_csv(args.count, args.amount, output):
+            print("\n[OK] Promocodes generated successfully!")
+            print(f"   File: {output}")
+    
+    elif args.single:
         # Generate single promocode
         print(f"Generating promocode for {args.single} points...")
         result = generate_single_promocode(args.single, args.custom_code)
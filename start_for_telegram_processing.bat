@@ -173,11 +173,10 @@ timeout /t 2 /nobreak >nul
 start "QwenEditBot Worker" cmd /c "cd /d "%~dp0" && title Worker && python -m worker.run > "%~dp0logs\worker\runtime.log" 2>&1"
 timeout /t 2 /nobreak >nul
 
-:: Start ComfyUI Watchdog (предотвращает "засыпание" ComfyUI через API запросы)
-echo [6.5/7] Запуск ComfyUI Watchdog...
+:: ComfyUI keep-alive (предотвращает "засыпание" ComfyUI) теперь работает внутри Worker
+:: Отдельный процесс больше не нужен: keep-alive встроен в Worker и проверяет
+:: ComfyUI только когда задачи к нему не обращались (COMFYUI_KEEPALIVE_ENABLED)
 if not exist "%LOG_DIR%\comfyui" mkdir "%LOG_DIR%\comfyui"
-start "ComfyUI Watchdog" cmd /c "cd /d "%~dp0" && title ComfyUI-Watchdog && python comfyui_watchdog.py > "%~dp0logs\comfyui\watchdog.log" 2>&1"
-timeout /t 1 /nobreak >nul
 
 :: Window Waker (программное пробуждение окна через Windows API) - включено для более надежной работы
 echo [6.6/7] Запуск ComfyUI Window Waker...
@@ -201,7 +200,7 @@ echo Логи доступны в отдельных окнах:
 echo   - Backend (порт 8000) - Логи: %~dp0logs\backend\
 echo   - Bot (Telegram API) - Логи: %~dp0logs\bot\
 echo   - Worker (Обработка задач) - Логи: %~dp0logs\worker\
-echo   - ComfyUI Watchdog - Логи: %~dp0logs\comfyui\
+echo   - ComfyUI Window Waker - Логи: %~dp0logs\comfyui\
 echo.
 echo 📋 Диагностическая информация: %DIAGNOSTIC_LOG%
 echo 📋 Общий лог запуска: %~dp0startup.log
@@ -210,7 +209,7 @@ echo 🔍 Если система зависает:
 echo   1. Проверьте логи в %~dp0logs\
 echo   2. Смотрите PERFORMANCE_OPTIMIZATION_GUIDE.md
 echo   3. Смотрите OPTIMIZATION_REPORT.md
-echo   4. ComfyUI Watchdog автоматически предотвращает "засыпание"
+echo   4. Keep-alive в Worker автоматически предотвращает "засыпание"
 echo      Смотрите COMFYUI_WAKEUP_SOLUTION.md для деталей
 echo.
 echo Нажмите любую клавишу, чтобы закрыть это окно (сервисы продолжат работу).
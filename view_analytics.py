@@ -4,126 +4,86 @@
 Показывает статистику выбора пресетов и кастомных промптов пользователями
 """
 
+import asyncio
 import sys
 from pathlib import Path
-from collections import Counter, defaultdict
-from datetime import datetime, timedelta
-from typing import Dict, List, Tuple, Optional
-from sqlalchemy import func, desc
+from typing import Dict, List, Optional
+from sqlalchemy import desc
 from sqlalchemy.orm import Session
 
 # Добавляем путь к backend для импорта
 backend_path = Path(__file__).parent / "backend"
 sys.path.insert(0, str(backend_path))
 
-from app.database import SessionLocal, engine
-from app.models import Job, Preset, User, JobStatus
-from app.config import settings
+from app.database import SessionLocal, AsyncSessionLocal
+from app.models import Job, Preset, User
+from app.services.analytics import job_report, refresh_rollups
+from app.services.preset_matching import PresetMatcher
 
 
 class AnalyticsViewer:
-    """Класс для просмотра аналитики использования пресетов и промптов"""
+    """Класс для просмотра аналитики использования пресетов и промптов
+    
+    Статистика читается из таблиц job_rollups (их обновляет бэкенд), поэтому
+    время отчета не зависит от длины истории джоб.
+    """
     
     def __init__(self):
         self.db: Session = SessionLocal()
         self.presets_cache: Dict[int, Preset] = {}
         self._load_presets()
+        self.matcher = PresetMatcher(self.presets_cache.values())
+        self._reports: Dict[Optional[int], Dict] = {}
     
     def _load_presets(self):
         """Загрузить все пресеты в кэш"""
-        presets = self.db.query(Preset).all()
+        presets = self.db.query(Preset).order_by(Preset.id).all()
         for preset in presets:
             self.presets_cache[preset.id] = preset
     
-    def _match_prompt_to_preset(self, prompt: str) -> Optional[Preset]:
-        """Сопоставить промпт с пресетом (точное совпадение или частичное)"""
-        if not prompt:
-            return None
-        
-        prompt_clean = prompt.strip()
-        
-        # Сначала ищем точное совпадение
-        for preset in self.presets_cache.values():
-            if preset.prompt and preset.prompt.strip() == prompt_clean:
-                return preset
-        
-        # Затем ищем частичное совпадение (промпт пресета содержится в промпте джобы)
-        for preset in self.presets_cache.values():
-            if preset.prompt and preset.prompt.strip() in prompt_clean:
-                return preset
-        
-        return None
+    def refresh(self) -> int:
+        """Догнать роллапы до текущего момента (только изменившиеся часы)"""
+        return asyncio.run(refresh_rollups(AsyncSessionLocal))
+    
+    def _report(self, days: Optional[int]) -> Dict:
+        """Отчет из роллапов (кэшируется на время работы скрипта)"""
+        if days not in self._reports:
+            async def build():
+                async with AsyncSessionLocal() as db:
+                    return await job_report(db, days=days)
+            self._reports[days] = asyncio.run(build())
+        return self._reports[days]
     
     def get_preset_usage_stats(self, days: Optional[int] = None) -> Dict:
         """Получить статистику использования пресетов"""
-        query = self.db.query(Job)
-        
-        if days:
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            query = query.filter(Job.created_at >= cutoff_date)
-        
-        jobs = query.filter(Job.status.in_([JobStatus.completed, JobStatus.processing, JobStatus.queued])).all()
-        
-        preset_usage = Counter()
-        custom_prompts = []
-        preset_details = defaultdict(list)
-        
-        for job in jobs:
-            matched_preset = self._match_prompt_to_preset(job.prompt)
-            
-            if matched_preset:
-                preset_key = f"{matched_preset.category} / {matched_preset.name}"
-                preset_usage[preset_key] += 1
-                preset_details[preset_key].append({
-                    'job_id': job.id,
-                    'user_id': job.user_id,
-                    'created_at': job.created_at,
-                    'status': job.status.value
-                })
-            else:
-                custom_prompts.append({
-                    'job_id': job.id,
-                    'user_id': job.user_id,
-                    'prompt': job.prompt[:100] + '...' if job.prompt and len(job.prompt) > 100 else job.prompt,
-                    'created_at': job.created_at,
-                    'status': job.status.value
-                })
+        report = self._report(days)
+        preset_usage = {
+            (f"{preset['category']} / {preset['name']}" if preset['category'] else preset['name']): preset['jobs']
+            for preset in report['presets']
+        }
+        custom_prompts = [job for job in self.get_recent_jobs(100) if job['is_custom']]
         
         return {
-            'preset_usage': dict(preset_usage.most_common()),
+            'preset_usage': preset_usage,
+            'presets': report['presets'],
             'custom_prompts': custom_prompts,
-            'preset_details': dict(preset_details),
-            'total_jobs': len(jobs),
-            'preset_jobs': sum(preset_usage.values()),
-            'custom_jobs': len(custom_prompts)
+            'totals': report['totals'],
+            'total_jobs': report['totals']['jobs'],
+            'preset_jobs': report['preset_jobs'],
+            'custom_jobs': report['custom']['jobs'],
+            'rolled_up_until': report['rolled_up_until']
         }
     
     def get_user_stats(self, days: Optional[int] = None) -> List[Dict]:
         """Получить статистику по пользователям"""
-        query = self.db.query(
-            User.user_id,
-            User.username,
-            User.telegram_id,
-            func.count(Job.id).label('job_count')
-        ).join(Job, User.user_id == Job.user_id)
-        
-        if days:
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            query = query.filter(Job.created_at >= cutoff_date)
-        
-        query = query.group_by(User.user_id, User.username, User.telegram_id)
-        query = query.order_by(desc('job_count'))
-        
-        results = query.all()
-        
         return [
             {
-                'user_id': row.user_id,
-                'username': row.username or f"user_{row.telegram_id}",
-                'telegram_id': row.telegram_id,
-                'job_count': row.job_count
+                'user_id': user['user_id'],
+                'username': user['username'] or f"user_{user['telegram_id']}",
+                'telegram_id': user['telegram_id'] or 0,
+                'job_count': user['jobs']
             }
-            for row in results
+            for user in self._report(days)['users']
         ]
     
     def get_recent_jobs(self, limit: int = 20) -> List[Dict]:
@@ -132,7 +92,11 @@ class AnalyticsViewer:
         
         result = []
         for job in jobs:
-            matched_preset = self._match_prompt_to_preset(job.prompt)
+            if job.preset_key:
+                # Записано при создании джобы (или скриптом backfill_job_presets.py)
+                matched_preset = self.presets_cache.get(int(job.preset_key)) if job.preset_key.isdigit() else None
+            else:
+                matched_preset = self.matcher.match(job.prompt)
             preset_info = None
             if matched_preset:
                 preset_info = f"{matched_preset.category} / {matched_preset.name}"
@@ -162,14 +126,19 @@ class AnalyticsViewer:
         print("="*80)
         
         print(f"\n📈 Общая статистика:")
+        print(f"   Данные на: {stats['rolled_up_until'] or 'роллапы еще не построены'}")
         print(f"   Всего джоб: {stats['total_jobs']}")
         print(f"   С пресетами: {stats['preset_jobs']} ({stats['preset_jobs']/stats['total_jobs']*100:.1f}%)" if stats['total_jobs'] > 0 else "   С пресетами: 0")
         print(f"   Кастомных промптов: {stats['custom_jobs']} ({stats['custom_jobs']/stats['total_jobs']*100:.1f}%)" if stats['total_jobs'] > 0 else "   Кастомных промптов: 0")
         
+        latency = stats['totals']['latency']
+        if latency['p50'] is not None:
+            print(f"   Время обработки: среднее {latency['avg']}с, p50 ≤{latency['p50']:.0f}с, p95 ≤{latency['p95']:.0f}с")
+        
         if stats['preset_usage']:
             print(f"\n🏆 ТОП ПРЕСЕТОВ (по использованию):")
             print("-" * 80)
-            for i, (preset_name, count) in enumerate(stats['preset_usage'].most_common(20), 1):
+            for i, (preset_name, count) in enumerate(list(stats['preset_usage'].items())[:20], 1):
                 percentage = (count / stats['preset_jobs'] * 100) if stats['preset_jobs'] > 0 else 0
                 print(f"   {i:2d}. {preset_name:50s} | {count:4d} раз ({percentage:5.1f}%)")
         
@@ -260,12 +229,18 @@ def main():
     parser.add_argument('--recent', action='store_true', help='Показать последние джобы')
     parser.add_argument('--days', type=int, help='Период в днях (например, 7 для последней недели)')
     parser.add_argument('--limit', type=int, default=20, help='Количество последних джоб (по умолчанию: 20)')
+    parser.add_argument('--no-refresh', action='store_true', help='Не обновлять роллапы перед отчетом')
     
     args = parser.parse_args()
     
     viewer = AnalyticsViewer()
     
     try:
+        if not args.no_refresh and not args.recent:
+            try:
+                viewer.refresh()
+            except Exception as e:
+                print(f"⚠️  Не удалось обновить роллапы ({e}), показаны сохраненные данные")
         if args.presets:
             viewer.print_preset_usage_stats(args.days)
         elif args.users:
@@ -19,14 +19,48 @@ class Settings(BaseSettings):
     REDIS_DB: int = Field(0, env="REDIS_DB")
     REDIS_JOB_QUEUE_KEY: str = Field("qwenedit:job_queue", env="REDIS_JOB_QUEUE_KEY")
     REDIS_RESULT_TTL: int = Field(3600, env="REDIS_RESULT_TTL")  # 1 hour
+    # Per-job state hash shared with the backend (status, stage timestamps, worker, prompt)
+    REDIS_JOB_STATE_KEY_PREFIX: str = Field("qwenedit:job", env="REDIS_JOB_STATE_KEY_PREFIX")
+    REDIS_JOB_STATE_TTL: int = Field(86400, env="REDIS_JOB_STATE_TTL")  # seconds after the last transition
 
     # ComfyUI configuration
     COMFYUI_URL: str = Field("http://localhost:8188", env="COMFYUI_URL")
     COMFYUI_TIMEOUT: int = Field(900, env="COMFYUI_TIMEOUT")  # Increased from 300 to 900 seconds (15 minutes) to allow for large models
-    COMFYUI_POLL_INTERVAL: float = Field(0.25, env="COMFYUI_POLL_INTERVAL")  # 0.25 second between checks
+    COMFYUI_POLL_INTERVAL: float = Field(0.25, env="COMFYUI_POLL_INTERVAL")  # 0.25 second between checks near the expected finish
+    COMFYUI_POLL_SLEEP_FRACTION: float = Field(0.7, env="COMFYUI_POLL_SLEEP_FRACTION")  # first poll after this share of the expected runtime
+    COMFYUI_POLL_DENSE_UNTIL: float = Field(1.3, env="COMFYUI_POLL_DENSE_UNTIL")  # dense polling until this multiple of the expected runtime
+    COMFYUI_POLL_BACKOFF_FACTOR: float = Field(1.5, env="COMFYUI_POLL_BACKOFF_FACTOR")
+    COMFYUI_POLL_MAX_INTERVAL: float = Field(5.0, env="COMFYUI_POLL_MAX_INTERVAL")
+    COMFYUI_POLL_LOG_INTERVAL: float = Field(15.0, env="COMFYUI_POLL_LOG_INTERVAL")  # seconds between progress logs
+    COMFYUI_CANCEL_CHECK_INTERVAL: float = Field(2.0, env="COMFYUI_CANCEL_CHECK_INTERVAL")  # while waiting for the first poll
     COMFYUI_INPUT_DIR: str = Field("C:/ComfyUI/ComfyUI/input", env="COMFYUI_INPUT_DIR")
     COMFYUI_OUTPUT_DIR: str = Field("C:/ComfyUI/ComfyUI/output", env="COMFYUI_OUTPUT_DIR")
 
+    # Per-job timeouts (COMFYUI_TIMEOUT above is the hard upper bound)
+    COMFYUI_MIN_JOB_TIMEOUT: int = Field(120, env="COMFYUI_MIN_JOB_TIMEOUT")
+    COMFYUI_TIMEOUT_MULTIPLIER: float = Field(4.0, env="COMFYUI_TIMEOUT_MULTIPLIER")
+    COMFYUI_COLD_START_SECONDS: int = Field(240, env="COMFYUI_COLD_START_SECONDS")  # model load after idle
+    COMFYUI_WARM_WINDOW_SECONDS: int = Field(600, env="COMFYUI_WARM_WINDOW_SECONDS")
+    COMFYUI_EXPECTED_OVERHEAD_SECONDS: float = Field(8.0, env="COMFYUI_EXPECTED_OVERHEAD_SECONDS")
+    COMFYUI_EXPECTED_SECONDS_PER_MP_STEP: float = Field(2.5, env="COMFYUI_EXPECTED_SECONDS_PER_MP_STEP")
+    COMFYUI_RUNTIME_EWMA_ALPHA: float = Field(0.3, env="COMFYUI_RUNTIME_EWMA_ALPHA")
+    COMFYUI_IDLE_VERIFY_TIMEOUT: int = Field(60, env="COMFYUI_IDLE_VERIFY_TIMEOUT")  # wait for GPU after interrupt
+
+    # Model residency (warm-up at startup, /free when idle and no traffic is forecast)
+    COMFYUI_WARMUP_ENABLED: bool = Field(True, env="COMFYUI_WARMUP_ENABLED")
+    COMFYUI_FREE_IDLE_SECONDS: int = Field(1800, env="COMFYUI_FREE_IDLE_SECONDS")
+    COMFYUI_RESIDENCY_MIN_RATE: float = Field(1.0, env="COMFYUI_RESIDENCY_MIN_RATE")  # jobs/hour
+    COMFYUI_RESIDENCY_CHECK_INTERVAL: int = Field(30, env="COMFYUI_RESIDENCY_CHECK_INTERVAL")
+
+    # Keep-alive probe (only when no job talked to ComfyUI recently) and circuit breaker
+    COMFYUI_KEEPALIVE_ENABLED: bool = Field(True, env="COMFYUI_KEEPALIVE_ENABLED")
+    COMFYUI_KEEPALIVE_MIN_INTERVAL: int = Field(15, env="COMFYUI_KEEPALIVE_MIN_INTERVAL")
+    COMFYUI_KEEPALIVE_MAX_INTERVAL: int = Field(120, env="COMFYUI_KEEPALIVE_MAX_INTERVAL")
+    COMFYUI_KEEPALIVE_METRICS_INTERVAL: int = Field(60, env="COMFYUI_KEEPALIVE_METRICS_INTERVAL")
+    COMFYUI_CIRCUIT_FAILURE_THRESHOLD: int = Field(3, env="COMFYUI_CIRCUIT_FAILURE_THRESHOLD")
+    COMFYUI_CIRCUIT_RESET_SECONDS: int = Field(30, env="COMFYUI_CIRCUIT_RESET_SECONDS")
+    REDIS_METRICS_KEY_PREFIX: str = Field("qwenedit:metrics", env="REDIS_METRICS_KEY_PREFIX")
+
     # Telegram configuration
     BOT_TOKEN: str = Field(..., env="BOT_TOKEN")
     TELEGRAM_API_URL: str = Field("https://api.telegram.org", env="TELEGRAM_API_URL")
@@ -35,6 +69,15 @@ class Settings(BaseSettings):
     WORKER_POLLING_INTERVAL: int = Field(1, env="WORKER_POLLING_INTERVAL")  # Reduced from 2 to 1
     WORKER_GPU_LOCK_TIMEOUT: int = Field(30, env="WORKER_GPU_LOCK_TIMEOUT")
     WORKER_LOG_LEVEL: str = Field("INFO", env="WORKER_LOG_LEVEL")
+    WORKER_LOG_FORMAT: str = Field("text", env="WORKER_LOG_FORMAT")  # text or json
+    WORKER_LOG_FILE: Optional[str] = Field(None, env="WORKER_LOG_FILE")  # rotated log file, stdout only when empty
+    WORKER_LOG_MAX_BYTES: int = Field(10 * 1024 * 1024, env="WORKER_LOG_MAX_BYTES")  # size before rotation
+    WORKER_LOG_BACKUP_COUNT: int = Field(5, env="WORKER_LOG_BACKUP_COUNT")
+    # Hot-loop loggers, 'logger=value,...': fraction of records kept / records per second (below WARNING)
+    WORKER_LOG_SAMPLING: str = Field("", env="WORKER_LOG_SAMPLING")
+    WORKER_LOG_RATE_LIMITS: str = Field(
+        "worker.main.dequeue=1,worker.processors.image_editor.poll=2", env="WORKER_LOG_RATE_LIMITS"
+    )
 
     # Retry configuration
     MAX_RETRIES: int = Field(3, env="MAX_RETRIES")
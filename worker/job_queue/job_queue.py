@@ -125,27 +125,27 @@ class JobQueue:
         Update job status
         kwargs: result_path, error, retry_count
         """
+        # The Redis state hash answers status queries right away; the backend
+        # keeps the durable record (batched by its SQLite write queue)
+        success = False
         try:
-            # Update in Redis
             success = await redis_client.update_job_status(job_id, status, **kwargs)
-            if success:
-                logger.debug(f"Job {job_id} status updated to {status} in Redis")
-            
-            # Also update via API for consistency
+        except Exception as e:
+            logger.warning(f"Job {job_id} status {status} not stored in Redis: {e}")
+
+        try:
             update_data = {"status": status}
             update_data.update(kwargs)
             
             job = await self.backend_client.update_job(job_id, update_data)
             if job:
                 logger.debug(f"Job {job_id} status updated to {status} via API")
-            else:
-                logger.warning(f"Job {job_id} status update failed via API, but updated in Redis")
-            
-            return True
+                return True
+            logger.warning(f"Job {job_id} status update failed via API{', but updated in Redis' if success else ''}")
+            return success
         except Exception as e:
             logger.error(f"Error updating job {job_id} status: {e}")
-            # Still return True if Redis update was successful, since that's our primary storage
-            return success  # Return the Redis update success status
+            return success
 
     async def get_job(self, job_id: int) -> Optional[Job]:
         """Get job by ID"""
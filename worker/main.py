@@ -6,16 +6,21 @@ from pathlib import Path
 
 from worker.job_queue.job_queue import JobQueue
 from worker.gpu.lock import GPULock
-from worker.processors.image_editor import ImageEditorProcessor
+from worker.processors.image_editor import ImageEditorProcessor, JobCancelledError
 from worker.processors.result_handler import ResultHandler
 from worker.retry.strategy import RetryStrategy
 from worker.config import settings
 from worker.services.comfyui_client import ComfyUIClient
+from worker.services.comfyui_health import comfyui_health
+from worker.services.comfyui_keepalive import ComfyUIKeepAlive
 from worker.redis_client import redis_client
 from worker.services.file_monitor import FileMonitor
+from worker.services.model_residency import ModelResidencyManager
 from worker.job_queue.job_queue import Job
 
 logger = logging.getLogger(__name__)
+# Per-iteration records of the queue polling loop; rate limited via WORKER_LOG_RATE_LIMITS
+dequeue_logger = logging.getLogger(f"{__name__}.dequeue")
 
 
 class QwenEditWorker:
@@ -27,6 +32,8 @@ class QwenEditWorker:
         self.retry = RetryStrategy()
         self.comfyui_client = ComfyUIClient()
         self.file_monitor = None
+        self.residency = ModelResidencyManager(self.gpu_lock) if settings.COMFYUI_WARMUP_ENABLED else None
+        self.keepalive = ComfyUIKeepAlive() if settings.COMFYUI_KEEPALIVE_ENABLED else None
 
     async def initialize(self):
         """Initialize worker components"""
@@ -82,6 +89,16 @@ class QwenEditWorker:
         if self.file_monitor:
             asyncio.create_task(self.file_monitor.run())
             logger.info("File monitor started in background")
+
+        # Start model warm-up / residency policy in background if enabled
+        if self.residency:
+            asyncio.create_task(self.residency.run())
+            logger.info("Model residency manager started in background")
+
+        # Start ComfyUI keep-alive probe in background if enabled
+        if self.keepalive:
+            asyncio.create_task(self.keepalive.run())
+            logger.info("ComfyUI keep-alive started in background")
         
         # Define local variables to avoid UnboundLocalError
         polling_interval = settings.WORKER_POLLING_INTERVAL
@@ -92,7 +109,7 @@ class QwenEditWorker:
         while True:
             try:
                 # 1. Get next job from queue (non-blocking)
-                logger.debug("Checking queue for next job...")
+                dequeue_logger.debug("Checking queue for next job...")
                 try:
                     job_data = await redis_client.dequeue_job()
                 except Exception as redis_error:
@@ -104,7 +121,7 @@ class QwenEditWorker:
                 if not job_data:
                     # No job received - use exponential backoff
                     current_backoff = min(current_backoff + polling_interval, max_backoff)
-                    logger.debug(f"No job in queue, waiting {current_backoff}s before next check...")
+                    dequeue_logger.debug("No job in queue, waiting %ss before next check...", current_backoff)
                     await asyncio.sleep(current_backoff)
                     continue
                 
@@ -170,8 +187,20 @@ class QwenEditWorker:
                     updated_at=parsed_updated_at,
                 )
                 
+                # Skip jobs cancelled while they were waiting in the queue
+                if await redis_client.is_job_cancelled(job.id):
+                    logger.info(f"Job {job.id} was cancelled, skipping")
+                    continue
+
                 logger.info(f"Processing job {job.id} from queue (user: {job.user_id})")
 
+                # Do not send jobs to a ComfyUI that is known to be down
+                if not comfyui_health.allow_request():
+                    logger.warning(f"ComfyUI circuit is open, returning job {job.id} to queue")
+                    await redis_client.enqueue_job(job_data)
+                    await asyncio.sleep(polling_interval)
+                    continue
+
                 # 2. Try to acquire GPU lock
                 if not await self.gpu_lock.acquire(timeout=gpu_lock_timeout):
                     logger.warning(f"Failed to acquire GPU lock for job {job.id}, returning to queue")
@@ -181,10 +210,13 @@ class QwenEditWorker:
                     continue
 
                 try:
-                    # 3. Check ComfyUI health before processing
-                    logger.info(f"Checking ComfyUI health before processing job {job.id}")
+                    # 3. Check ComfyUI health before processing, unless it answered recently
                     try:
-                        comfyui_healthy = await self.comfyui_client.check_health()
+                        if comfyui_health.seconds_since_contact() < settings.COMFYUI_KEEPALIVE_MIN_INTERVAL:
+                            comfyui_healthy = True
+                        else:
+                            logger.info(f"Checking ComfyUI health before processing job {job.id}")
+                            comfyui_healthy = await self.comfyui_client.check_health()
                         
                         if not comfyui_healthy:
                             logger.warning(f"ComfyUI health check failed for job {job.id}, returning to queue")
@@ -197,6 +229,10 @@ class QwenEditWorker:
                         await asyncio.sleep(polling_interval)
                         continue
                     
+                    # Counted only now: jobs returned to the queue above come back as new dequeues
+                    if self.residency:
+                        self.residency.record_arrival()
+
                     # 4. Update job status to processing
                     await self.queue.update_job_status(
                         job.id,
@@ -204,14 +240,20 @@ class QwenEditWorker:
                     )
 
                     # 5. Process the job with timeout protection
+                    job_timeout = self.processor.get_timeout(job)
+                    logger.info(f"Job {job.id} timeout set to {job_timeout:.0f}s")
                     try:
                         result_path = await asyncio.wait_for(
                             self.processor.process(job),
-                            timeout=settings.COMFYUI_TIMEOUT + 30  # Add buffer for safety
+                            timeout=job_timeout
                         )
                     except asyncio.TimeoutError:
                         logger.error(f"Job {job.id} processing timeout exceeded")
-                        raise Exception(f"Processing timeout exceeded ({settings.COMFYUI_TIMEOUT}s)")
+                        # Stop the prompt inside ComfyUI so the next job does not queue
+                        # behind it; the GPU lock is released only after this returns
+                        if not await self.processor.stop_current_prompt(job.id):
+                            logger.error(f"ComfyUI still busy after timeout of job {job.id}")
+                        raise Exception(f"Processing timeout exceeded ({job_timeout:.0f}s)")
 
                     # 6. Update job status to completed
                     if not Path(result_path).exists():
@@ -219,6 +261,9 @@ class QwenEditWorker:
                         raise Exception(f"Result file not found: {result_path}")
                     
                     logger.info(f"Result file verified for job {job.id}: {result_path}")
+
+                    if self.residency:
+                        self.residency.record_job_finished()
                     
                     await self.queue.update_job_status(
                         job.id,
@@ -239,6 +284,10 @@ class QwenEditWorker:
 
                     logger.info(f"Job {job.id} completed successfully")
 
+                except JobCancelledError as e:
+                    # Backend already marked the job cancelled; the ComfyUI prompt is stopped
+                    logger.info(f"Job {job.id} cancelled: {e}")
+
                 except Exception as e:
                     logger.error(f"Error processing job {job.id}: {str(e)}", exc_info=True)
 
@@ -1,15 +1,25 @@
 import asyncio
 import logging
+import time
 from pathlib import Path
+from typing import Optional
 
 import aiohttp
 
 from worker.config import settings
 from worker.job_queue.job_queue import Job
+from worker.processors.runtime_estimator import runtime_estimator
+from worker.redis_client import redis_client
 from worker.services.comfyui_client import ComfyUIClient
 from worker.workflows.qwen_edit_2511 import build_workflow
 
 logger = logging.getLogger(__name__)
+# Per-poll records of _wait_and_download; sampled/rate limited via WORKER_LOG_* settings
+poll_logger = logging.getLogger(f"{__name__}.poll")
+
+
+class JobCancelledError(Exception):
+    """Raised when a job was cancelled while the worker was processing it."""
 
 
 class ImageEditorProcessor:
@@ -17,10 +27,30 @@ class ImageEditorProcessor:
 
     def __init__(self):
         self.comfyui_client = ComfyUIClient()
+        # Prompt of the job in flight; kept after a timeout so it can be stopped
+        self.current_prompt_id: Optional[str] = None
+
+    def get_timeout(self, job: Job) -> float:
+        """Timeout for the job derived from its expected execution time."""
+        return runtime_estimator.timeout_for(job)
+
+    async def stop_current_prompt(self, job_id: int) -> bool:
+        """Interrupt the in-flight ComfyUI prompt and wait until the GPU is idle."""
+        prompt_id = self.current_prompt_id
+        if not prompt_id:
+            return True
+
+        logger.warning(f"Stopping ComfyUI prompt {prompt_id} of job {job_id}")
+        await self.comfyui_client.cancel_prompt(prompt_id)
+        idle = await self.comfyui_client.wait_until_idle(prompt_id, settings.COMFYUI_IDLE_VERIFY_TIMEOUT)
+        self.current_prompt_id = None
+        return idle
 
     async def process(self, job: Job) -> str:
         """Process a job via ComfyUI and return a local path to the result image."""
 
+        self.current_prompt_id = None
+
         source_path = Path(job.image_path)
         second_path = Path(job.second_image_path) if job.second_image_path else None
 
@@ -41,12 +71,27 @@ class ImageEditorProcessor:
             workflow = build_workflow(job)
             logger.debug(f"Workflow prepared for job {job.id}")
 
+            if await redis_client.is_job_cancelled(job.id):
+                raise JobCancelledError(f"Job {job.id} cancelled before submission")
+
+            cold = not runtime_estimator.is_warm
+            expected = runtime_estimator.expected_seconds(job)
+            started_at = time.monotonic()
             comfyui_job_id = await self.comfyui_client.send_workflow(workflow)
+            self.current_prompt_id = comfyui_job_id
             logger.info(f"ComfyUI job {comfyui_job_id} created for job {job.id}")
+            try:
+                await redis_client.update_job_state(job.id, prompt_id=comfyui_job_id)
+            except Exception as e:
+                logger.debug(f"Could not store prompt id of job {job.id}: {e}")
 
-            result_path = await self._wait_and_download(comfyui_job_id, job.id)
+            result_path = await self._wait_and_download(comfyui_job_id, job.id, expected)
+            self.current_prompt_id = None
+            runtime_estimator.record(job, time.monotonic() - started_at, cold=cold)
             logger.info(f"Result saved to {result_path}")
 
+        except JobCancelledError:
+            raise
         except Exception as e:
             logger.error(f"Error processing job {job.id}: {str(e)}")
             raise
@@ -71,36 +116,67 @@ class ImageEditorProcessor:
 
         return str(result_path)
 
-    async def _wait_and_download(self, comfyui_job_id: str, job_id: int) -> Path:
-        """Wait for result and download."""
-
-        max_attempts = 3600  # 3600 * 0.25s = 900s = 15 minutes
-        logger.info(f"Starting to wait and download result for job {job_id}, ComfyUI job: {comfyui_job_id}")
-
-        for attempt in range(max_attempts):
+    def _next_poll_delay(self, elapsed: float, expected: float, previous_delay: float) -> float:
+        """Delay before the next /history poll.
+
+        Dense polling around the expected finish, exponential backoff after it.
+        """
+        if elapsed < expected * settings.COMFYUI_POLL_DENSE_UNTIL:
+            return settings.COMFYUI_POLL_INTERVAL
+        return min(
+            max(previous_delay, settings.COMFYUI_POLL_INTERVAL) * settings.COMFYUI_POLL_BACKOFF_FACTOR,
+            settings.COMFYUI_POLL_MAX_INTERVAL,
+        )
+
+    async def _wait_and_download(self, comfyui_job_id: str, job_id: int, expected: float) -> Path:
+        """Wait for result and download.
+
+        Sleeps through most of the expected execution time before the first
+        /history poll; the job timeout in the worker bounds the total wait.
+        """
+
+        logger.info(
+            f"Starting to wait and download result for job {job_id}, ComfyUI job: {comfyui_job_id} "
+            f"(expected {expected:.1f}s)"
+        )
+
+        started_at = time.monotonic()
+        first_poll_at = expected * settings.COMFYUI_POLL_SLEEP_FRACTION
+        last_log_at = started_at
+        delay = 0.0
+        attempt = 0
+
+        while time.monotonic() - started_at < settings.COMFYUI_TIMEOUT:
+            # Cancellation is checked outside the try block so it is not swallowed
+            if await redis_client.is_job_cancelled(job_id):
+                logger.info(f"Job {job_id} cancelled, stopping ComfyUI prompt {comfyui_job_id}")
+                await self.stop_current_prompt(job_id)
+                raise JobCancelledError(f"Job {job_id} cancelled during processing")
+
+            elapsed = time.monotonic() - started_at
+            if elapsed < first_poll_at:
+                # Nothing to poll for yet; wake up periodically only to honour cancellation
+                await asyncio.sleep(min(first_poll_at - elapsed, settings.COMFYUI_CANCEL_CHECK_INTERVAL))
+                continue
+
+            attempt += 1
             try:
-                # Log every 10 attempts to track progress
-                if attempt % 10 == 0 and attempt > 0:
-                    logger.info(f"Waiting for job {job_id}... (attempt {attempt}/{max_attempts}, {attempt * settings.COMFYUI_POLL_INTERVAL:.1f}s elapsed)")
-                
-                # Профилактическое "дергание" ComfyUI каждые 20 попыток (5 секунд)
-                # Это предотвращает "засыпание" во время обработки
-                # Уменьшено с 40 до 20 для более частых пробуждений
-                if attempt > 0 and attempt % 20 == 0:
-                    logger.info(f"Proactive ComfyUI wakeup at attempt {attempt} to prevent sleeping...")
-                    try:
-                        # Легкий запрос к system_stats для поддержания активности
-                        await self.comfyui_client.check_health()
-                        logger.debug(f"Proactive wakeup successful at attempt {attempt}")
-                    except Exception as wakeup_error:
-                        logger.warning(f"Proactive wakeup failed at attempt {attempt} (non-critical): {wakeup_error}")
-                
+                if time.monotonic() - last_log_at >= settings.COMFYUI_POLL_LOG_INTERVAL:
+                    last_log_at = time.monotonic()
+                    poll_logger.info(
+                        "Waiting for job %s... (%.1fs elapsed, expected %.1fs, %d polls, poll interval %.2fs)",
+                        job_id, elapsed, expected, attempt, delay
+                    )
+
                 history = await self.comfyui_client.get_history(comfyui_job_id)
-                logger.debug(f"Attempt {attempt}: get_history returned: {type(history)} = {bool(history)}")
+                poll_logger.debug("Attempt %d: get_history returned: %s = %s", attempt, type(history), bool(history))
 
                 if history and isinstance(history, dict) and comfyui_job_id in history:
                     job_result = history[comfyui_job_id]
-                    logger.debug(f"Attempt {attempt}: Got history for job {job_id}, job_result keys: {job_result.keys() if isinstance(job_result, dict) else type(job_result)}")
+                    poll_logger.debug(
+                        "Attempt %d: Got history for job %s, job_result keys: %s",
+                        attempt, job_id, job_result.keys() if isinstance(job_result, dict) else type(job_result)
+                    )
 
                     if job_result and "outputs" in job_result:
                         output_image_info = None
@@ -149,19 +225,26 @@ class ImageEditorProcessor:
                                         f"Failed to download result image: {img_response.status}"
                                     )
                         else:
-                            logger.debug(f"Attempt {attempt}: Job result has outputs but no images")
+                            poll_logger.debug("Attempt %d: Job result has outputs but no images", attempt)
                     else:
-                        logger.debug(f"Attempt {attempt}: Job still processing (no outputs yet)")
+                        poll_logger.debug("Attempt %d: Job still processing (no outputs yet)", attempt)
                 else:
-                    logger.debug(f"Attempt {attempt}: history={bool(history)}, is_dict={isinstance(history, dict) if history else False}, has_job={comfyui_job_id in history if isinstance(history, dict) else False}")
+                    poll_logger.debug(
+                        "Attempt %d: history=%s, has_job=%s",
+                        attempt, bool(history), isinstance(history, dict) and comfyui_job_id in history
+                    )
 
             except Exception as e:
-                logger.error(
-                    f"Error checking ComfyUI job status for {comfyui_job_id} at attempt {attempt}: {str(e)}", 
+                poll_logger.error(
+                    "Error checking ComfyUI job status for %s at attempt %d: %s", comfyui_job_id, attempt, e,
                     exc_info=True
                 )
 
-            await asyncio.sleep(settings.COMFYUI_POLL_INTERVAL)
+            delay = self._next_poll_delay(time.monotonic() - started_at, expected, delay)
+            await asyncio.sleep(delay)
 
-        logger.error(f"ComfyUI job timeout for job {job_id} after {max_attempts} attempts ({max_attempts * settings.COMFYUI_POLL_INTERVAL:.1f}s)")
+        logger.error(
+            f"ComfyUI job timeout for job {job_id} after {attempt} polls "
+            f"({time.monotonic() - started_at:.1f}s)"
+        )
         raise Exception("ComfyUI job timeout")
@@ -0,0 +1,74 @@
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from worker.config import settings
+from worker.job_queue.job_queue import Job
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeEstimator:
+    """Expected ComfyUI execution time per workflow and resolution.
+
+    Starts from a prior derived from megapixels and sampler steps, then
+    tracks an exponentially weighted moving average of observed runs.
+    """
+
+    def __init__(self):
+        self._ewma: Dict[Tuple[str, int, int], float] = {}
+        self._samples: Dict[Tuple[str, int, int], int] = {}
+        self.last_run_at: Optional[float] = None  # monotonic time of last finished run
+
+    def _key(self, job: Job) -> Tuple[str, int, int]:
+        workflow_type = "try-on" if job.second_image_path else "standard"
+        return workflow_type, settings.QWEN_EDIT_SCALE_MEGAPIXELS, settings.QWEN_EDIT_STEPS
+
+    def _prior(self, key: Tuple[str, int, int]) -> float:
+        workflow_type, megapixels, steps = key
+        expected = settings.COMFYUI_EXPECTED_OVERHEAD_SECONDS + (
+            settings.COMFYUI_EXPECTED_SECONDS_PER_MP_STEP * megapixels * steps
+        )
+        # The second reference image adds an extra encode pass
+        if workflow_type == "try-on":
+            expected *= 1.3
+        return expected
+
+    @property
+    def is_warm(self) -> bool:
+        """True if a run finished recently enough that models are still loaded"""
+        if self.last_run_at is None:
+            return False
+        return time.monotonic() - self.last_run_at < settings.COMFYUI_WARM_WINDOW_SECONDS
+
+    def expected_seconds(self, job: Job) -> float:
+        """Expected execution time of the job on a warm ComfyUI"""
+        key = self._key(job)
+        return self._ewma.get(key) or self._prior(key)
+
+    def timeout_for(self, job: Job) -> float:
+        """Hard timeout for the job, capped by COMFYUI_TIMEOUT"""
+        timeout = self.expected_seconds(job) * settings.COMFYUI_TIMEOUT_MULTIPLIER
+        if not self.is_warm:
+            # Leave room for loading UNET, CLIP, VAE and LoRA from disk
+            timeout += settings.COMFYUI_COLD_START_SECONDS
+        return max(settings.COMFYUI_MIN_JOB_TIMEOUT, min(timeout, settings.COMFYUI_TIMEOUT))
+
+    def record(self, job: Job, duration: float, cold: bool = False):
+        """Record an observed execution time"""
+        self.last_run_at = time.monotonic()
+        if cold:
+            # Cold runs include model loading and would skew the estimate
+            logger.debug(f"Skipping cold run of job {job.id} ({duration:.1f}s) in runtime stats")
+            return
+
+        key = self._key(job)
+        previous = self._ewma.get(key)
+        alpha = settings.COMFYUI_RUNTIME_EWMA_ALPHA
+        self._ewma[key] = duration if previous is None else alpha * duration + (1 - alpha) * previous
+        self._samples[key] = self._samples.get(key, 0) + 1
+        logger.debug(f"Runtime estimate for {key}: {self._ewma[key]:.1f}s ({self._samples[key]} samples)")
+
+
+# Global runtime estimator instance
+runtime_estimator = RuntimeEstimator()
@@ -2,11 +2,17 @@ import logging
 from typing import Optional, List, Dict, Any
 import json
 import asyncio
+import os
+import socket
+import time
 from redis.asyncio import Redis
 from worker.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Identifies this worker process in job state hashes
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
 
 class RedisQueueClient:
     """Redis client for job queue management with auto-reconnect"""
@@ -159,35 +165,70 @@ class RedisQueueClient:
         
         return jobs
     
-    async def update_job_status(self, job_id: int, status: str, **kwargs) -> bool:
-        """Update job status in Redis"""
+    async def update_job_state(self, job_id: int, **fields) -> bool:
+        """Write fields of the job's state hash in one MULTI/EXEC and refresh its TTL.
+
+        Field names are prefixed with "worker_": the unprefixed fields are the
+        committed JobResponse the backend serves, and only the backend writes
+        them. Every write carries this worker's id. None values delete the
+        field, so an error from an earlier attempt does not linger after a retry.
+        """
         if not self.redis:
             raise RuntimeError("Redis client not connected")
-        
-        # Update job status - for now just log that this would happen
-        logger.info(f"Job {job_id} status would be updated to {status} in Redis with data: {kwargs}")
+
+        fields = {'worker_id': WORKER_ID, **{f'worker_{name}': value for name, value in fields.items()}}
+        key = f"{settings.REDIS_JOB_STATE_KEY_PREFIX}:{job_id}"
+        present = {name: str(value) for name, value in fields.items() if value is not None}
+        cleared = [name for name, value in fields.items() if value is None]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping=present)
+            if cleared:
+                pipe.hdel(key, *cleared)
+            pipe.expire(key, settings.REDIS_JOB_STATE_TTL)
+            await pipe.execute()
+        return True
+
+    async def update_job_status(self, job_id: int, status: str, **kwargs) -> bool:
+        """Record a status transition, with the time the job entered the stage"""
+        now = time.time()
+        await self.update_job_state(job_id, status=status, **{f'{status}_at': now, 'state_updated_at': now}, **kwargs)
+        logger.debug(f"Job {job_id} status updated to {status} in Redis")
         return True
     
     async def set_job_result(self, job_id: int, result_path: str) -> bool:
-        """Store job result in Redis"""
-        if not self.redis:
-            raise RuntimeError("Redis client not connected")
-        
-        result_data = {
-            'job_id': job_id,
-            'result_path': result_path,
-            'completed_at': asyncio.get_event_loop().time()
-        }
-        
-        await self.redis.setex(
-            f"job_result:{job_id}",
-            settings.REDIS_RESULT_TTL,
-            json.dumps(result_data)
-        )
-        
+        """Store job result in the job's state hash"""
+        await self.update_job_state(job_id, result_path=result_path, completed_at=time.time())
         logger.info(f"Job {job_id} result stored in Redis")
         return True
 
+    async def is_job_cancelled(self, job_id: int) -> bool:
+        """Check whether the backend requested cancellation of a job"""
+        if not self.redis:
+            return False
+
+        try:
+            return bool(await self.redis.exists(f"job_cancel:{job_id}"))
+        except Exception as e:
+            # Never fail a job because the cancel flag could not be read
+            logger.warning(f"Could not read cancel flag for job {job_id}: {e}")
+            return False
+
+    async def publish_metrics(self, name: str, metrics: Dict[str, Any], ttl: int = 300) -> bool:
+        """Store a flat metrics snapshot as a Redis hash (qwenedit:metrics:<name>)"""
+        if not self.redis:
+            return False
+
+        key = f"{settings.REDIS_METRICS_KEY_PREFIX}:{name}"
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hset(key, mapping={k: str(v) for k, v in metrics.items()})
+            pipe.expire(key, ttl)
+            await pipe.execute()
+            return True
+        except Exception as e:
+            logger.warning(f"Could not publish {name} metrics: {e}")
+            return False
+
 
 # Global Redis client instance
 redis_client = RedisQueueClient()
\ No newline at end of file
@@ -6,7 +6,15 @@ from worker.utils.logger import setup_logger
 from worker.redis_client import redis_client
 
 # Setup logging
-setup_logger(settings.WORKER_LOG_LEVEL)
+setup_logger(
+    settings.WORKER_LOG_LEVEL,
+    log_format=settings.WORKER_LOG_FORMAT,
+    log_file=settings.WORKER_LOG_FILE,
+    max_bytes=settings.WORKER_LOG_MAX_BYTES,
+    backup_count=settings.WORKER_LOG_BACKUP_COUNT,
+    sampling=settings.WORKER_LOG_SAMPLING,
+    rate_limits=settings.WORKER_LOG_RATE_LIMITS,
+)
 logger = logging.getLogger(__name__)
 
 async def cleanup():
@@ -3,10 +3,29 @@ import asyncio
 import aiohttp
 from typing import Optional, Dict, Any
 from worker.config import settings
+from worker.services.comfyui_health import comfyui_health
 
 logger = logging.getLogger(__name__)
 
 
+async def _on_request_end(session, trace_ctx, params):
+    comfyui_health.record_success()
+
+
+async def _on_request_exception(session, trace_ctx, params):
+    # A cancelled wait (job timeout, shutdown) says nothing about ComfyUI itself
+    if not isinstance(params.exception, asyncio.CancelledError):
+        comfyui_health.record_failure()
+
+
+def _health_trace_config() -> aiohttp.TraceConfig:
+    """Report every request outcome to the shared ComfyUI health state"""
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    return trace_config
+
+
 class ComfyUIClient:
     """HTTP client for ComfyUI API with connection pooling"""
 
@@ -27,7 +46,8 @@ class ComfyUIClient:
             
             self.session = aiohttp.ClientSession(
                 connector=self.connector,
-                timeout=self.timeout
+                timeout=self.timeout,
+                trace_configs=[_health_trace_config()]
             )
             logger.debug("Created new aiohttp session with connection pooling")
         return self.session
@@ -100,6 +120,113 @@ class ComfyUIClient:
             logger.error(f"Error getting ComfyUI history: {str(e)}", exc_info=True)
             return None
 
+    async def interrupt(self, prompt_id: Optional[str] = None) -> bool:
+        """Interrupt the prompt that is currently executing"""
+        url = f"{self.base_url}/interrupt"
+
+        try:
+            session = await self._get_session()
+            # Newer ComfyUI builds only interrupt when the running prompt matches
+            payload = {"prompt_id": prompt_id} if prompt_id else {}
+
+            async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 200:
+                    logger.info(f"ComfyUI interrupt sent (prompt: {prompt_id})")
+                    return True
+                error_text = await response.text()
+                logger.error(f"Failed to interrupt ComfyUI: {response.status} - {error_text}")
+                return False
+        except Exception as e:
+            logger.error(f"Error interrupting ComfyUI: {str(e)}")
+            return False
+
+    async def delete_from_queue(self, prompt_id: str) -> bool:
+        """Delete a pending prompt from the ComfyUI queue"""
+        url = f"{self.base_url}/queue"
+
+        try:
+            session = await self._get_session()
+
+            async with session.post(url, json={"delete": [prompt_id]}, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 200:
+                    logger.info(f"ComfyUI prompt {prompt_id} deleted from queue")
+                    return True
+                error_text = await response.text()
+                logger.error(f"Failed to delete prompt {prompt_id} from queue: {response.status} - {error_text}")
+                return False
+        except Exception as e:
+            logger.error(f"Error deleting prompt {prompt_id} from ComfyUI queue: {str(e)}")
+            return False
+
+    async def free_memory(self, unload_models: bool = True) -> bool:
+        """Ask ComfyUI to unload models and release VRAM"""
+        url = f"{self.base_url}/free"
+
+        try:
+            session = await self._get_session()
+            payload = {"unload_models": unload_models, "free_memory": True}
+
+            async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 200:
+                    logger.info("ComfyUI models unloaded and memory freed")
+                    return True
+                error_text = await response.text()
+                logger.error(f"Failed to free ComfyUI memory: {response.status} - {error_text}")
+                return False
+        except Exception as e:
+            logger.error(f"Error freeing ComfyUI memory: {str(e)}")
+            return False
+
+    async def get_queue(self) -> Optional[Dict]:
+        """Get running and pending prompts"""
+        url = f"{self.base_url}/queue"
+
+        try:
+            session = await self._get_session()
+
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 200:
+                    return await response.json()
+                error_text = await response.text()
+                logger.error(f"Failed to get ComfyUI queue: {response.status} - {error_text}")
+                return None
+        except Exception as e:
+            logger.error(f"Error getting ComfyUI queue: {str(e)}")
+            return None
+
+    async def wait_until_idle(self, prompt_id: str, timeout: float) -> bool:
+        """Wait until nothing is executing and the prompt is gone from the queue.
+
+        Re-sends the interrupt while the GPU is still busy. Returns False if
+        ComfyUI did not become idle within the timeout.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+
+        while loop.time() < deadline:
+            queue = await self.get_queue()
+            if queue is not None:
+                running = queue.get("queue_running", [])
+                pending_ids = [item[1] for item in queue.get("queue_pending", []) if len(item) > 1]
+                if not running and prompt_id not in pending_ids:
+                    logger.info(f"ComfyUI is idle after stopping prompt {prompt_id}")
+                    return True
+                if prompt_id in pending_ids:
+                    await self.delete_from_queue(prompt_id)
+                if running:
+                    await self.interrupt()
+            await asyncio.sleep(1.0)
+
+        logger.error(f"ComfyUI did not become idle within {timeout}s after stopping prompt {prompt_id}")
+        return False
+
+    async def cancel_prompt(self, prompt_id: str) -> bool:
+        """Stop a prompt whether it is still pending or already running"""
+        # Delete first so a pending prompt cannot start after the interrupt
+        deleted = await self.delete_from_queue(prompt_id)
+        interrupted = await self.interrupt(prompt_id)
+        return deleted or interrupted
+
     async def download_result(self, prompt_id: str, filename: str) -> Optional[bytes]:
         """Download result image - This method is now deprecated as we get the URL from history"""
         logger.warning("download_result method is deprecated, use image info from history instead")
@@ -118,6 +245,7 @@ class ComfyUIClient:
                 if response.status == 200:
                     data = await response.json()
                     logger.debug(f"ComfyUI health check successful: {data}")
+                    comfyui_health.record_system_stats(data)
                     return True
                 else:
                     error_text = await response.text()
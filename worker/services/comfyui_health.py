@@ -0,0 +1,109 @@
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from worker.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class ComfyUIHealth:
+    """Shared view of ComfyUI availability inside the worker.
+
+    Every ComfyUIClient reports each request here, so job traffic doubles as
+    a health signal. The keep-alive probe only fills the gaps, and the
+    circuit breaker stops new jobs from being sent while ComfyUI is down.
+    """
+
+    def __init__(self):
+        self.state = CircuitState.CLOSED
+        self.last_contact_at: Optional[float] = None  # monotonic time of last response
+        self.opened_at: Optional[float] = None
+        self.consecutive_failures = 0
+        self.recoveries = 0  # open -> closed transitions, i.e. ComfyUI came back
+        # Successes after at least one failed request: ComfyUI may have restarted
+        # even when too few requests failed to open the circuit
+        self.reconnects = 0
+        # Memory PyTorch holds on the GPU(s), from the last /system_stats answer;
+        # close to zero right after a ComfyUI (re)start, before any model is loaded
+        self.torch_vram_total: Optional[int] = None
+        self.stats = {
+            'requests_ok': 0,
+            'requests_failed': 0,
+            'probes_sent': 0,
+            'probes_failed': 0,
+            'probes_skipped': 0,
+            'circuit_opened': 0,
+        }
+
+    def record_success(self):
+        """ComfyUI answered a request (any HTTP status counts as alive)"""
+        self.last_contact_at = time.monotonic()
+        if self.consecutive_failures:
+            self.reconnects += 1
+        self.consecutive_failures = 0
+        self.stats['requests_ok'] += 1
+        if self.state != CircuitState.CLOSED:
+            logger.info(f"ComfyUI is reachable again, closing circuit (was {self.state})")
+            self.state = CircuitState.CLOSED
+            self.opened_at = None
+            self.recoveries += 1
+
+    def record_failure(self):
+        """ComfyUI did not answer (connection error or timeout)"""
+        self.consecutive_failures += 1
+        self.stats['requests_failed'] += 1
+        if self.state == CircuitState.HALF_OPEN or (
+            self.state == CircuitState.CLOSED
+            and self.consecutive_failures >= settings.COMFYUI_CIRCUIT_FAILURE_THRESHOLD
+        ):
+            if self.state == CircuitState.CLOSED:
+                logger.error(f"ComfyUI failed {self.consecutive_failures} consecutive requests, opening circuit")
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+            self.stats['circuit_opened'] += 1
+
+    def record_system_stats(self, data: Dict[str, Any]):
+        """Keep what /system_stats says about GPU memory held by ComfyUI"""
+        devices = [d for d in data.get('devices', []) if d.get('type') == 'cuda']
+        if devices:
+            self.torch_vram_total = sum(d.get('torch_vram_total') or 0 for d in devices)
+
+    def allow_request(self) -> bool:
+        """False while the circuit is open and the reset timeout has not passed"""
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self.opened_at < settings.COMFYUI_CIRCUIT_RESET_SECONDS:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            logger.info("ComfyUI circuit half-open, letting a request through")
+        return True
+
+    @property
+    def is_available(self) -> bool:
+        return self.state == CircuitState.CLOSED
+
+    def seconds_since_contact(self) -> float:
+        if self.last_contact_at is None:
+            return float("inf")
+        return time.monotonic() - self.last_contact_at
+
+    def metrics(self) -> Dict[str, Any]:
+        since_contact = self.seconds_since_contact()
+        return {
+            **self.stats,
+            'circuit_state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'recoveries': self.recoveries,
+            'reconnects': self.reconnects,
+            'seconds_since_contact': round(since_contact, 1) if since_contact != float("inf") else -1,
+        }
+
+
+# Global ComfyUI health instance shared by all clients in the worker process
+comfyui_health = ComfyUIHealth()
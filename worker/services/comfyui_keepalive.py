@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import time
+
+from worker.config import settings
+from worker.redis_client import redis_client
+from worker.services.comfyui_client import ComfyUIClient
+from worker.services.comfyui_health import comfyui_health
+
+logger = logging.getLogger(__name__)
+
+
+class ComfyUIKeepAlive:
+    """Adaptive keep-alive probe for ComfyUI (replaces comfyui_watchdog.py).
+
+    - Skips the probe while jobs are talking to ComfyUI: their requests are
+      recorded in the shared health state and count as contact.
+    - Doubles the interval after each healthy probe on an idle ComfyUI, up to
+      COMFYUI_KEEPALIVE_MAX_INTERVAL, and drops back to the minimum on failure.
+    - Respects the circuit breaker: while the circuit is open it waits for the
+      reset timeout and then sends a single half-open probe.
+    - Publishes health and probe statistics to Redis for monitoring.
+    """
+
+    def __init__(self):
+        self.comfyui_client = ComfyUIClient()
+        self.interval = settings.COMFYUI_KEEPALIVE_MIN_INTERVAL
+        self._last_metrics_at = 0.0
+
+    async def probe(self) -> bool:
+        """Send one /system_stats probe and adapt the interval"""
+        comfyui_health.stats['probes_sent'] += 1
+        healthy = await self.comfyui_client.check_health()
+        if healthy:
+            self.interval = min(self.interval * 2, settings.COMFYUI_KEEPALIVE_MAX_INTERVAL)
+        else:
+            comfyui_health.stats['probes_failed'] += 1
+            self.interval = settings.COMFYUI_KEEPALIVE_MIN_INTERVAL
+            logger.warning(f"ComfyUI keep-alive probe failed (circuit: {comfyui_health.state})")
+        return healthy
+
+    async def tick(self) -> float:
+        """Probe if due; returns how long to sleep before the next check"""
+        if not comfyui_health.allow_request():
+            remaining = settings.COMFYUI_CIRCUIT_RESET_SECONDS - (time.monotonic() - comfyui_health.opened_at)
+            return max(1.0, remaining)
+
+        since_contact = comfyui_health.seconds_since_contact()
+        if comfyui_health.is_available and since_contact < self.interval:
+            # Recent job traffic already proved ComfyUI is alive
+            comfyui_health.stats['probes_skipped'] += 1
+            if since_contact < settings.COMFYUI_KEEPALIVE_MIN_INTERVAL:
+                # Busy ComfyUI: stay responsive for when the traffic stops
+                self.interval = settings.COMFYUI_KEEPALIVE_MIN_INTERVAL
+            return max(1.0, self.interval - since_contact)
+
+        await self.probe()
+        return self.interval
+
+    async def publish_metrics(self):
+        metrics = comfyui_health.metrics()
+        metrics['keepalive_interval'] = self.interval
+        await redis_client.publish_metrics("comfyui", metrics, ttl=settings.COMFYUI_KEEPALIVE_METRICS_INTERVAL * 5)
+        logger.debug(f"ComfyUI health metrics: {metrics}")
+
+    async def run(self):
+        logger.info(
+            f"ComfyUI keep-alive started (interval {settings.COMFYUI_KEEPALIVE_MIN_INTERVAL}"
+            f"-{settings.COMFYUI_KEEPALIVE_MAX_INTERVAL}s, probes only when idle)"
+        )
+        while True:
+            try:
+                delay = await self.tick()
+                if time.monotonic() - self._last_metrics_at >= settings.COMFYUI_KEEPALIVE_METRICS_INTERVAL:
+                    self._last_metrics_at = time.monotonic()
+                    await self.publish_metrics()
+            except Exception as e:
+                logger.error(f"Error in ComfyUI keep-alive: {e}", exc_info=True)
+                delay = settings.COMFYUI_KEEPALIVE_MIN_INTERVAL
+            # Wake up at least as often as metrics are published
+            await asyncio.sleep(min(delay, settings.COMFYUI_KEEPALIVE_METRICS_INTERVAL))
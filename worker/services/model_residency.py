@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from worker.config import settings
+from worker.gpu.lock import GPULock
+from worker.processors.runtime_estimator import runtime_estimator
+from worker.services.comfyui_client import ComfyUIClient
+from worker.services.comfyui_health import comfyui_health
+from worker.workflows.qwen_edit_2511 import build_warmup_workflow
+
+logger = logging.getLogger(__name__)
+
+WARMUP_IMAGE_NAME = "qwenedit_warmup.png"
+
+
+class ArrivalForecast:
+    """Hour-of-day job arrival rate (jobs/hour) as an EWMA across days"""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.rates: List[Optional[float]] = [None] * 24
+        self._current_hour: Optional[int] = None
+        self._current_count = 0
+
+    def _roll(self, now: datetime):
+        hour = now.hour
+        if self._current_hour is None:
+            self._current_hour = hour
+            return
+        if hour != self._current_hour:
+            previous = self.rates[self._current_hour]
+            count = float(self._current_count)
+            self.rates[self._current_hour] = (
+                count if previous is None else self.alpha * count + (1 - self.alpha) * previous
+            )
+            self._current_hour = hour
+            self._current_count = 0
+
+    def record_arrival(self, now: Optional[datetime] = None):
+        now = now or datetime.now()
+        self._roll(now)
+        self._current_count += 1
+
+    def expected_rate(self, now: Optional[datetime] = None) -> float:
+        """Forecast for the current and next hour (the larger of the two)"""
+        now = now or datetime.now()
+        self._roll(now)
+        upcoming = [self.rates[now.hour], self.rates[(now.hour + 1) % 24]]
+        known = [rate for rate in upcoming if rate is not None]
+        forecast = max(known) if known else 0.0
+        # Traffic in the current hour counts even before the bucket rolls over
+        return max(forecast, float(self._current_count))
+
+
+class ModelResidencyManager:
+    """Keeps ComfyUI models loaded while traffic is expected.
+
+    - Sends a tiny warm-up workflow at startup and after ComfyUI restarts
+      (seen as a failed -> successful request, or as /system_stats reporting
+      no GPU memory held while models should be loaded).
+    - Pre-warms when the arrival forecast says jobs are coming.
+    - Calls /free after COMFYUI_FREE_IDLE_SECONDS without jobs when the
+      forecast is below COMFYUI_RESIDENCY_MIN_RATE.
+    """
+
+    def __init__(self, gpu_lock: GPULock):
+        self.gpu_lock = gpu_lock
+        self.comfyui_client = ComfyUIClient()
+        self.forecast = ArrivalForecast()
+        self.models_loaded = False
+        self.last_activity = time.monotonic()
+        self._reconnects = comfyui_health.reconnects
+        self._startup_warmup_pending = False
+
+    def record_arrival(self):
+        """Called once per job, when it starts processing (not when it is requeued)"""
+        self.forecast.record_arrival()
+        self.last_activity = time.monotonic()
+
+    def record_job_finished(self):
+        """Called when a job finished on ComfyUI (models are resident now)"""
+        self.models_loaded = True
+        self._startup_warmup_pending = False
+        self.last_activity = time.monotonic()
+        # The last /system_stats reading predates the load
+        comfyui_health.torch_vram_total = None
+
+    def _ensure_warmup_image(self) -> str:
+        path = Path(settings.COMFYUI_INPUT_DIR) / WARMUP_IMAGE_NAME
+        if not path.exists():
+            from PIL import Image
+            Image.new("RGB", (64, 64), color=(128, 128, 128)).save(path)
+        return path.name
+
+    async def warm_up(self) -> bool:
+        """Run the warm-up workflow; the caller must hold the GPU lock"""
+        started_at = time.monotonic()
+        try:
+            workflow = build_warmup_workflow(self._ensure_warmup_image())
+            prompt_id = await self.comfyui_client.send_workflow(workflow)
+        except Exception as e:
+            logger.warning(f"ComfyUI warm-up could not be submitted: {e}")
+            return False
+
+        deadline = started_at + settings.COMFYUI_COLD_START_SECONDS + settings.COMFYUI_MIN_JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            history = await self.comfyui_client.get_history(prompt_id)
+            if history and prompt_id in history:
+                status = history[prompt_id].get("status", {})
+                if status.get("status_str") == "error":
+                    logger.warning(f"ComfyUI warm-up prompt {prompt_id} failed: {status}")
+                    return False
+                self.models_loaded = True
+                self.last_activity = time.monotonic()
+                runtime_estimator.last_run_at = self.last_activity
+                comfyui_health.torch_vram_total = None
+                logger.info(f"ComfyUI warm-up finished in {time.monotonic() - started_at:.1f}s")
+                return True
+            await asyncio.sleep(1.0)
+
+        logger.warning(f"ComfyUI warm-up prompt {prompt_id} did not finish in time, interrupting")
+        await self.comfyui_client.cancel_prompt(prompt_id)
+        return False
+
+    async def free_models(self) -> bool:
+        """Unload models; the caller must hold the GPU lock"""
+        if await self.comfyui_client.free_memory():
+            self.models_loaded = False
+            # Next job pays the load cost again, so give it the cold-start timeout
+            runtime_estimator.last_run_at = None
+            return True
+        return False
+
+    async def _with_gpu_lock(self, action) -> bool:
+        # Never wait for the lock: a job in flight always wins
+        if not await self.gpu_lock.acquire(timeout=0):
+            return False
+        try:
+            return await action()
+        finally:
+            await self.gpu_lock.release()
+
+    async def tick(self):
+        """One evaluation of the residency policy"""
+        # Availability comes from the shared health state (job traffic and the
+        # keep-alive probe), so the policy does not send probes of its own
+        if not comfyui_health.is_available:
+            self.models_loaded = False
+            return
+
+        # Any failed -> successful transition counts as a possible restart, not only
+        # a closed circuit: a quick restart may fail a single request or probe
+        restarted = comfyui_health.reconnects != self._reconnects or self._startup_warmup_pending
+        self._reconnects = comfyui_health.reconnects
+        # A restart that no request or probe saw fail: PyTorch holds no GPU memory
+        # although the models were loaded
+        if self.models_loaded and comfyui_health.torch_vram_total == 0:
+            restarted = True
+
+        if restarted:
+            logger.info("ComfyUI is back up, models need to be reloaded")
+            self.models_loaded = False
+
+        expected_rate = self.forecast.expected_rate()
+        traffic_expected = expected_rate >= settings.COMFYUI_RESIDENCY_MIN_RATE
+        idle_for = time.monotonic() - self.last_activity
+
+        if not self.models_loaded and (restarted or traffic_expected):
+            logger.info(f"Warming up ComfyUI (forecast {expected_rate:.1f} jobs/h, restarted={restarted})")
+            if await self._with_gpu_lock(self.warm_up):
+                self._startup_warmup_pending = False
+        elif self.models_loaded and not traffic_expected and idle_for >= settings.COMFYUI_FREE_IDLE_SECONDS:
+            logger.info(f"ComfyUI idle for {idle_for:.0f}s and forecast {expected_rate:.1f} jobs/h, freeing VRAM")
+            await self._with_gpu_lock(self.free_models)
+
+    async def run(self):
+        """Warm up once, then evaluate the policy periodically"""
+        if await self.comfyui_client.check_health():
+            logger.info("Warming up ComfyUI at worker startup")
+            await self._with_gpu_lock(self.warm_up)
+        else:
+            # Warm up as soon as ComfyUI becomes reachable
+            self._startup_warmup_pending = True
+        self._reconnects = comfyui_health.reconnects
+
+        while True:
+            await asyncio.sleep(settings.COMFYUI_RESIDENCY_CHECK_INTERVAL)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Error in model residency check: {e}", exc_info=True)
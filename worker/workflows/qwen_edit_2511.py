@@ -1,3 +1,4 @@
+from datetime import datetime
 from pathlib import Path
 
 from worker.config import settings
@@ -154,3 +155,33 @@ def build_workflow(job: Job) -> dict:
     }
 
     return workflow_json
+
+
+def build_warmup_workflow(image_filename: str) -> dict:
+    """Build a minimal run of the same workflow to load models into VRAM.
+
+    Uses the same UNET, CLIP, VAE and LoRA as real jobs, but a tiny image,
+    a single sampler step and PreviewImage so nothing lands in the output dir.
+    """
+
+    now = datetime.utcnow()
+    warmup_job = Job(
+        id=0,
+        user_id=0,
+        image_path=image_filename,
+        prompt="warm-up",
+        status="warmup",
+        created_at=now,
+        updated_at=now,
+    )
+
+    workflow_json = build_workflow(warmup_job)
+    workflow_json["79"]["inputs"]["megapixels"] = 0.05
+    workflow_json["65"]["inputs"]["steps"] = 1
+    workflow_json["9"] = {
+        "inputs": {"images": ["8", 0]},
+        "class_type": "PreviewImage",
+        "_meta": {"title": "Preview Image"},
+    }
+
+    return workflow_json